@@ -0,0 +1,78 @@
+"""
+Size and round-trip time of the cache / Celery codecs on prediction payloads.
+
+    python -m benchmarks.bench_codecs --repeat 200
+
+Payloads: one temperature prediction, batch results of 100 and 10000 predictions,
+and 10000 x 3 float32 scores as a NumPy array. Codecs whose dependency is not
+installed (msgpack, zstandard) are skipped.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks import percentile
+from project.codecs import Codec, CodecError
+
+CODECS = [
+    ("json", "none"),
+    ("orjson", "none"),
+    ("msgpack", "none"),
+    ("json", "zlib"),
+    ("orjson", "zlib"),
+    ("orjson", "zstd"),
+    ("msgpack", "zlib"),
+    ("msgpack", "zstd"),
+]
+
+
+def make_payloads():
+    rng = np.random.default_rng(0)
+
+    def batch(n):
+        results = [{"temperature": float(t)} for t in rng.normal(20, 5, n)]
+        return {"model_id": 1, "results": results}
+
+    return {
+        "single": {"temperature": 21.5},
+        "batch-100": batch(100),
+        "batch-10000": batch(10000),
+        "ndarray-10000x3": {"model_id": 2, "scores": rng.random((10000, 3), dtype=np.float32)},
+    }
+
+
+def time_round_trips(codec, payload, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        codec.loads(codec.dumps(payload))
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main(repeat, compress_min_bytes):
+    for name, payload in make_payloads().items():
+        print(f"\n{name}")
+        for serializer, compression in CODECS:
+            try:
+                codec = Codec(serializer, compression, compress_min_bytes)
+            except CodecError:
+                continue
+            size = len(codec.dumps(payload))
+            latencies = time_round_trips(codec, payload, repeat)
+            print(
+                f"  {serializer + '/' + compression:>14}: {size:>9} bytes  "
+                f"p50 {percentile(latencies, 50) * 1000:8.3f} ms  "
+                f"p99 {percentile(latencies, 99) * 1000:8.3f} ms"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--compress-min-bytes", type=int, default=4096)
+    args = parser.parse_args()
+    main(args.repeat, args.compress_min_bytes)
@@ -0,0 +1,307 @@
+"""
+Load test of the inference path: throughput and latency percentiles per scenario.
+
+- `predict-temp`: POST /inference/predict-temp, auth, quota check, cache, enqueue
+- `task_status`: GET /inference/task_status of finished tasks
+- `quota`: `crud.check_user_access`, the quota check of every prediction
+- `run_model`: the `run_model` task body, cache lookup and predict
+
+    python -m benchmarks.bench_inference_path --local --requests 2000 --concurrency 32
+    python -m benchmarks.bench_inference_path --scenario predict-temp --scenario quota
+
+`--local` runs everything in this process, on a scratch SQLite database and fakeredis,
+with Celery tasks run eagerly. Without it, the configured `DATABASE_URL` / `REDIS_URL`
+are used, e.g. the Postgres and Redis containers of docker-compose (migrated with
+`alembic upgrade head`), and `--url` sends the HTTP scenarios to a running API.
+`--distinct-inputs` sets the share of predictions served from the cache.
+
+Results are written as JSON to `--output` (default `benchmarks/results/<commit>.json`),
+to compare with `python -m benchmarks.compare`.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime, timezone
+
+from benchmarks import summarize
+
+SCENARIOS = ["predict-temp", "task_status", "quota", "run_model"]
+TEMPERATURE_MODEL_ID = 2
+BENCH_EMAIL = "bench@example.com"
+BENCH_PASSWORD = "bench-password"
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def use_local_backends(db_path):
+    """SQLite, fakeredis and eager in-memory Celery. Must run before `project` is imported."""
+    os.environ["FASTAPI_CONFIG"] = "testing"
+    from project.config import settings
+
+    settings.DATABASE_URL = f"sqlite+aiosqlite:///{db_path}"
+    settings.CELERY_BROKER_URL = "memory://"
+    settings.CELERY_RESULT_BACKEND = "cache+memory://"
+    settings.CELERY_TASK_ALWAYS_EAGER = True
+    settings.CELERY_TASK_STORE_EAGER_RESULT = True
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    import fakeredis
+    from project import redis_utils
+
+    server = fakeredis.FakeServer()
+    redis_utils.redis_client = fakeredis.FakeRedis(server=server)
+    redis_utils.async_redis_client = fakeredis.aioredis.FakeRedis(server=server)
+
+
+def random_input(n_distinct):
+    """One of `n_distinct` temperature inputs, the others are cache hits once computed."""
+    rng = random.Random(random.randrange(n_distinct))
+    return {
+        "latitude": rng.randint(-90, 89),
+        "longitude": rng.randint(-180, 179),
+        "month": rng.randint(1, 12),
+        "hour": rng.randint(0, 23),
+    }
+
+
+async def drive(call, n_requests, concurrency, warmup):
+    """Run `call` `n_requests` times from `concurrency` clients, after `warmup` calls."""
+    for _ in range(warmup):
+        await call()
+
+    latencies = []
+    errors = 0
+    remaining = iter(range(n_requests))
+
+    async def client():
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            try:
+                ok = await call()
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+async def setup_bench_user(session_maker):
+    """A user granted the temperature model, under a policy its calls never exhaust."""
+    from fastapi_users.password import PasswordHelper
+    from sqlalchemy import select
+
+    from project.fu_core.users.models import User
+    from project.inference import crud
+    from project.inference.models import UserAccess
+
+    async with session_maker() as session:
+        policy = await crud.get_access_policy_by_name(session, "bench")
+        if policy is None:
+            policy = await crud.create_access_policy(session, "bench", 10**9, 10**9)
+        user = await session.scalar(select(User).where(User.email == BENCH_EMAIL))
+        if user is None:
+            user = User(
+                email=BENCH_EMAIL,
+                hashed_password=PasswordHelper().hash(BENCH_PASSWORD),
+                is_active=True,
+                is_verified=True,
+            )
+            session.add(user)
+            await session.commit()
+        access = await session.scalar(
+            select(UserAccess).where(
+                UserAccess.user_id == user.id, UserAccess.model_id == TEMPERATURE_MODEL_ID
+            )
+        )
+        if access is None:
+            await crud.create_user_access(session, user.id, TEMPERATURE_MODEL_ID, policy.id)
+        elif access.access_policy_id != policy.id:
+            access.access_policy_id = policy.id
+            await session.commit()
+        return user.id
+
+
+async def login(client):
+    response = await client.post(
+        "/api/v1/auth/jwt/login", data={"username": BENCH_EMAIL, "password": BENCH_PASSWORD}
+    )
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(__file__),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def enqueue_tasks(args, task_ids, count=100):
+    """Finished tasks for the `task_status` scenario to poll."""
+    from project.inference import tasks
+
+    for _ in range(count):
+        task = tasks.run_model.apply_async(
+            (TEMPERATURE_MODEL_ID, random_input(args.distinct_inputs))
+        )
+        task_ids.append(task.id)
+
+
+def scenario_calls(args, client, headers, user_id, task_ids):
+    """The call of each scenario, `task_status` polls the tasks in `task_ids`."""
+    from project.database import async_session_maker
+    from project.inference import crud, tasks
+
+    async def predict_temp():
+        response = await client.post(
+            f"/api/v1/inference/predict-temp/{TEMPERATURE_MODEL_ID}",
+            json=random_input(args.distinct_inputs),
+            headers=headers,
+        )
+        return response.status_code == 200
+
+    async def task_status():
+        response = await client.get(f"/api/v1/inference/task_status/{random.choice(task_ids)}")
+        return response.status_code == 200
+
+    async def quota():
+        async with async_session_maker() as session:
+            has_access, _ = await crud.check_user_access(session, user_id, TEMPERATURE_MODEL_ID)
+        return has_access
+
+    async def run_model():
+        # Blocking, as in a worker process: one thread per concurrent client
+        result = await asyncio.to_thread(
+            tasks.run_model.apply, (TEMPERATURE_MODEL_ID, random_input(args.distinct_inputs))
+        )
+        return result.successful()
+
+    return {
+        "predict-temp": predict_temp,
+        "task_status": task_status,
+        "quota": quota,
+        "run_model": run_model,
+    }
+
+
+def print_stats(name, stats):
+    print(
+        f"{name:>14} {stats.get('requests_per_s', 0):>10.1f} req/s"
+        f"  p50 {stats.get('p50_ms', 0):>8.2f} ms"
+        f"  p95 {stats.get('p95_ms', 0):>8.2f} ms"
+        f"  p99 {stats.get('p99_ms', 0):>8.2f} ms"
+        f"  errors {stats['errors']}"
+    )
+
+
+def write_report(args, settings, results):
+    commit = git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "backend": "local" if args.local else "services",
+            "target": args.url or "in-process",
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "distinct_inputs": args.distinct_inputs,
+            "settings": {
+                name: getattr(settings, name)
+                for name in (
+                    "QUOTA_BACKEND",
+                    "SERVICE_CALL_WRITE_MODE",
+                    "CACHE_CODEC",
+                    "CACHE_COMPRESSION",
+                )
+            },
+        },
+        "scenarios": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit[:12]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {output}")
+
+
+async def main(args):
+    if args.local:
+        use_local_backends(args.db_path)
+
+    import httpx
+
+    from project import create_app
+    from project.config import settings
+    from project.database import async_session_maker, create_db_and_tables
+
+    settings.LOG_LEVEL = args.log_level
+    app = create_app()
+    # Tasks run by the bench itself have no service call to complete
+    logging.getLogger("project.inference.crud").setLevel(logging.ERROR)
+    if args.local:
+        await create_db_and_tables()
+    # Runs the startup handlers: seeds models and policies, starts the background writers
+    await app.router.startup()
+
+    user_id = await setup_bench_user(async_session_maker)
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=30)
+    else:
+        transport = httpx.ASGITransport(app=app)
+        client = httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=30)
+    headers = await login(client)
+
+    task_ids = []
+    calls = scenario_calls(args, client, headers, user_id, task_ids)
+    results = {}
+    try:
+        for name in args.scenario or SCENARIOS:
+            if name == "task_status" and not task_ids:
+                enqueue_tasks(args, task_ids)
+            results[name] = await drive(calls[name], args.requests, args.concurrency, args.warmup)
+            print_stats(name, results[name])
+    finally:
+        await client.aclose()
+        await app.router.shutdown()
+
+    write_report(args, settings, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--scenario", action="append", choices=SCENARIOS, help="repeatable, all by default"
+    )
+    parser.add_argument("--requests", type=int, default=1000, help="per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument(
+        "--warmup", type=int, default=50, help="unmeasured calls before each scenario"
+    )
+    parser.add_argument("--distinct-inputs", type=int, default=100)
+    parser.add_argument(
+        "--local", action="store_true", help="SQLite, fakeredis and eager Celery, in process"
+    )
+    parser.add_argument(
+        "--db-path", default="./bench.db", help="scratch SQLite database of --local"
+    )
+    parser.add_argument("--url", help="API to send the HTTP scenarios to, in process by default")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="JSON results file")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,87 @@
+"""
+Throughput vs added latency of inline predictions, with and without micro-batching.
+
+Drives the temperature model through `InlineRunner` with `--concurrency` clients
+sending single predictions, for several (max_batch_size, max_batch_wait_ms) settings:
+
+    python -m benchmarks.bench_micro_batching --requests 5000 --concurrency 64
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks import percentile
+from project.inference.inline import InlineRunner
+from project.inference.model_pool import model_pool
+from project.inference.model_registry import model_registry
+
+TEMPERATURE_MODEL_ID = 2
+DEFAULT_SETTINGS = [(1, 0.0), (8, 1.0), (32, 2.0), (64, 5.0)]
+
+
+def random_input():
+    return {
+        "latitude": random.randint(-90, 89),
+        "longitude": random.randint(-180, 179),
+        "month": random.randint(1, 12),
+        "hour": random.randint(0, 23),
+    }
+
+
+async def run_setting(max_batch_size, max_wait_ms, n_requests, concurrency, threads):
+    model_registry[TEMPERATURE_MODEL_ID]["max_batch_size"] = max_batch_size
+    model_registry[TEMPERATURE_MODEL_ID]["max_batch_wait_ms"] = max_wait_ms
+    runner = InlineRunner(threads)
+    latencies = []
+    fallbacks = 0
+    remaining = iter(range(n_requests))
+
+    async def client():
+        nonlocal fallbacks
+        for _ in remaining:
+            start = time.perf_counter()
+            result = await runner.run(TEMPERATURE_MODEL_ID, random_input())
+            latencies.append(time.perf_counter() - start)
+            if result is None:
+                fallbacks += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "max_batch_size": max_batch_size,
+        "max_batch_wait_ms": max_wait_ms,
+        "throughput": n_requests / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "fallbacks": fallbacks,
+    }
+
+
+async def main(args):
+    # Fit the model once, outside of the measurements
+    model_pool.get(TEMPERATURE_MODEL_ID)
+
+    print(
+        f"{'batch':>6} {'wait ms':>8} {'pred/s':>10} {'p50 ms':>8} {'p99 ms':>8} "
+        f"{'fallbacks':>10}"
+    )
+    for max_batch_size, max_wait_ms in DEFAULT_SETTINGS:
+        stats = await run_setting(
+            max_batch_size, max_wait_ms, args.requests, args.concurrency, args.threads
+        )
+        print(
+            f"{stats['max_batch_size']:>6} {stats['max_batch_wait_ms']:>8.1f} "
+            f"{stats['throughput']:>10.0f} {stats['p50_ms']:>8.2f} {stats['p99_ms']:>8.2f} "
+            f"{stats['fallbacks']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=64, help="inline runner max concurrency")
+    asyncio.run(main(parser.parse_args()))
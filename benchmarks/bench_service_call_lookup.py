@@ -0,0 +1,118 @@
+"""
+Cost of recording a task completion on a large service_call table.
+
+Loads `--rows` service calls into two scratch tables, then times `--lookups`
+completions on each:
+
+- `legacy`: celery_task_id as an unindexed string, SELECT the row then UPDATE it
+- `indexed`: celery_task_id as a uuid with a unique index, one UPDATE ... RETURNING id
+
+    python -m benchmarks.bench_service_call_lookup --rows 1000000 --lookups 1000
+
+Runs against `DATABASE_URL` by default (Postgres in development), `--url` to override.
+The scratch tables are dropped at the end.
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, Uuid, select, update
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from benchmarks import percentile
+from project.config import settings
+
+CHUNK_SIZE = 10000
+
+
+def make_tables():
+    metadata = MetaData()
+    legacy = Table(
+        "bench_service_call_legacy", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("celery_task_id", String, nullable=True),
+        Column("time_completed", DateTime(timezone=True), nullable=True),
+    )
+    indexed = Table(
+        "bench_service_call_indexed", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("celery_task_id", Uuid(as_uuid=False), nullable=True, unique=True, index=True),
+        Column("time_completed", DateTime(timezone=True), nullable=True),
+    )
+    return metadata, legacy, indexed
+
+
+async def load(engine, tables, task_ids):
+    for start in range(0, len(task_ids), CHUNK_SIZE):
+        rows = [{"celery_task_id": task_id} for task_id in task_ids[start:start + CHUNK_SIZE]]
+        async with engine.begin() as conn:
+            for table in tables:
+                await conn.execute(table.insert(), rows)
+
+
+async def complete_legacy(conn, table, task_id, now):
+    row = (await conn.execute(select(table.c.id).where(table.c.celery_task_id == task_id))).first()
+    await conn.execute(update(table).where(table.c.id == row.id).values(time_completed=now))
+
+
+async def complete_indexed(conn, table, task_id, now):
+    await conn.execute(
+        update(table)
+        .where(table.c.celery_task_id == task_id)
+        .values(time_completed=now)
+        .returning(table.c.id)
+    )
+
+
+async def time_lookups(engine, complete, table, task_ids):
+    latencies = []
+    for task_id in task_ids:
+        start = time.perf_counter()
+        async with engine.begin() as conn:
+            await complete(conn, table, task_id, datetime.now(timezone.utc))
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def main(url, n_rows, n_lookups):
+    engine = create_async_engine(url)
+    metadata, legacy, indexed = make_tables()
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.drop_all)
+        await conn.run_sync(metadata.create_all)
+
+    try:
+        task_ids = [str(uuid4()) for _ in range(n_rows)]
+        start = time.perf_counter()
+        await load(engine, (legacy, indexed), task_ids)
+        print(f"Loaded {n_rows} rows per table in {time.perf_counter() - start:.1f}s")
+
+        sample = random.sample(task_ids, n_lookups)
+        for name, complete, table in (
+            ("legacy", complete_legacy, legacy),
+            ("indexed", complete_indexed, indexed),
+        ):
+            latencies = await time_lookups(engine, complete, table, sample)
+            print(
+                f"{name:>8}: {len(latencies) / sum(latencies):8.1f} completions/s  "
+                f"p50 {percentile(latencies, 50) * 1000:7.2f} ms  "
+                f"p99 {percentile(latencies, 99) * 1000:7.2f} ms"
+            )
+    finally:
+        async with engine.begin() as conn:
+            await conn.run_sync(metadata.drop_all)
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--url", default=settings.DATABASE_URL)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--lookups", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.url, args.rows, args.lookups))
@@ -0,0 +1,78 @@
+"""
+Compare two results of `bench_inference_path`, e.g. a branch against main.
+
+    python -m benchmarks.compare benchmarks/results/<base>.json benchmarks/results/<new>.json
+
+Prints the change of each metric per scenario and exits with status 1 when a
+latency percentile grew, or the throughput dropped, by more than `--threshold`
+percent, so it can gate a CI job. Compare runs made with the same backend and
+concurrency on the same machine: the others are flagged.
+"""
+import argparse
+import json
+import sys
+
+LATENCY_METRICS = ["p50_ms", "p95_ms", "p99_ms"]
+THROUGHPUT_METRICS = ["requests_per_s"]
+COMPARED_META = ["backend", "target", "concurrency", "distinct_inputs", "settings"]
+
+
+def change(base, new):
+    """Relative change in percent, None without a base value."""
+    if not base:
+        return None
+    return (new - base) / base * 100
+
+
+def compare(base, new, threshold):
+    """Rows (scenario, metric, base, new, change %, regression) of scenarios in both runs."""
+    rows = []
+    for scenario, base_stats in base["scenarios"].items():
+        new_stats = new["scenarios"].get(scenario)
+        if new_stats is None:
+            continue
+        for metric in LATENCY_METRICS + THROUGHPUT_METRICS:
+            if metric not in base_stats or metric not in new_stats:
+                continue
+            delta = change(base_stats[metric], new_stats[metric])
+            worse = delta if metric in LATENCY_METRICS else -delta if delta is not None else None
+            regression = worse is not None and worse > threshold
+            rows.append(
+                (scenario, metric, base_stats[metric], new_stats[metric], delta, regression)
+            )
+        base_errors = base_stats.get("errors", 0)
+        if new_stats.get("errors", 0) > base_errors:
+            rows.append((scenario, "errors", base_errors, new_stats["errors"], None, True))
+    return rows
+
+
+def main(args):
+    with open(args.base) as file:
+        base = json.load(file)
+    with open(args.new) as file:
+        new = json.load(file)
+
+    for key in COMPARED_META:
+        if base["meta"].get(key) != new["meta"].get(key):
+            base_value, new_value = base["meta"].get(key), new["meta"].get(key)
+            print(f"warning: {key} differs: {base_value} vs {new_value}")
+
+    print(f"{base['meta']['commit'][:12]} -> {new['meta']['commit'][:12]}")
+    print(f"{'scenario':>14} {'metric':>15} {'base':>10} {'new':>10} {'change':>9}")
+    rows = compare(base, new, args.threshold)
+    for scenario, metric, base_value, new_value, delta, regression in rows:
+        delta_text = f"{delta:+8.1f}%" if delta is not None else f"{'':>9}"
+        flag = "  REGRESSION" if regression else ""
+        values = f"{base_value:>10.2f} {new_value:>10.2f}"
+        print(f"{scenario:>14} {metric:>15} {values} {delta_text}{flag}")
+    return 1 if any(row[-1] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument(
+        "--threshold", type=float, default=10.0, help="percent, regressions above fail"
+    )
+    sys.exit(main(parser.parse_args()))
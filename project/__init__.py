@@ -1,6 +1,7 @@
 import logging
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Response
 from sqladmin import Admin
+from project import metrics, redis_utils, tracing
 from project.config import settings
 from project.database import engine
 from project.fu_core import fastapi_users_router
@@ -14,6 +15,7 @@ logging.getLogger("fastapi").setLevel(logging.INFO)
 def create_app() -> FastAPI:
     from project.logging import configure_logging
     configure_logging()
+    tracing.configure_from_settings()
     
 
     
@@ -22,16 +24,48 @@ def create_app() -> FastAPI:
     from project.celery_utils import create_celery
     app.celery_app = create_celery()
 
+    from project.inference.cache import announce_model_versions, cache_stats
+    from project.inference.notifications import result_notifier
+    from project.local_cache import invalidator
+    from project.inference.service_call_log import ServiceCallWriter, buffered
+    app.service_call_writer = None
+
     @app.on_event("startup")
     async def on_startup():
+        await redis_utils.open_async_redis()
+        announce_model_versions()
+        invalidator.start()
         async for session in get_async_session():
             logger.info("Seeding the database with initial data...")
             await seed_inference_data(session)
+        if buffered():
+            app.service_call_writer = ServiceCallWriter(
+                max_rows=settings.SERVICE_CALL_FLUSH_MAX_ROWS,
+                interval_ms=settings.SERVICE_CALL_FLUSH_INTERVAL_MS,
+                max_deliveries=settings.SERVICE_CALL_MAX_DELIVERIES,
+            )
+            app.service_call_writer.start()
+
+    @app.on_event("shutdown")
+    async def on_shutdown():
+        if app.service_call_writer is not None:
+            await app.service_call_writer.stop()
+        await result_notifier.close()
+        invalidator.stop()
+        await redis_utils.close_async_redis()
+        tracing.flush()
+        cache_stats.flush()
 
     @app.get("/")
     async def root():
         return {"message": "hello world"}
 
+    @app.get("/metrics", include_in_schema=False)
+    def prometheus_metrics():
+        return Response(metrics.collect(), media_type=metrics.CONTENT_TYPE_LATEST)
+
+    app.middleware("http")(metrics.observe_request)
+
     app.include_router(fastapi_users_router, prefix=settings.API_V1_STR)
     app.include_router(inference_router, prefix=settings.API_V1_STR)
 
@@ -1,16 +1,37 @@
 from celery import current_app as current_celery_app
 from celery.result import AsyncResult
+from project.codecs import codec_from_settings, register_celery_serializer
 from project.config import settings
+import asyncio
 import functools
 import logging
+import os
+import random
+import reprlib
+import threading
+import time
 from celery import shared_task
-from celery.utils.log import get_task_logger
+from celery.signals import setup_logging
 from celery.exceptions import MaxRetriesExceededError
 
-logger = get_task_logger(__name__)
+logger = logging.getLogger(__name__)
+
+# Task payloads in logs: nested containers are cut before being rendered
+_payload_repr = reprlib.Repr()
+_payload_repr.maxlevel = 3
+_payload_repr.maxstring = _payload_repr.maxother = 200
+_payload_repr.maxlist = _payload_repr.maxtuple = _payload_repr.maxdict = _payload_repr.maxset = 20
+
+
+@setup_logging.connect
+def keep_project_logging(**kwargs):
+    # With a receiver, Celery leaves the logging set up by configure_logging to the worker
+    pass
+
 
 def create_celery():
     celery_app = current_celery_app
+    register_celery_serializer(codec_from_settings("TASK"))
     celery_app.config_from_object(settings, namespace="CELERY")
 
     return celery_app
@@ -37,9 +58,47 @@ def get_task_info(task_id):
 
 
 
-@shared_task
-def dummy_task():
-    return "This is a dummy task."
+def preview(value, max_length: int | None = None) -> str:
+    """Bounded repr of a task payload, a large result costs no more to log than a small one."""
+    max_length = settings.LOG_MAX_VALUE_LENGTH if max_length is None else max_length
+    text = _payload_repr.repr(value)
+    if len(text) > max_length:
+        return f"{text[:max_length]}... ({len(text)} chars)"
+    return text
+
+
+def sampled(rate: float | None = None) -> bool:
+    """Whether to log this successful task, a share `LOG_TASK_SUCCESS_SAMPLE_RATE` of them is."""
+    rate = settings.LOG_TASK_SUCCESS_SAMPLE_RATE if rate is None else rate
+    return rate >= 1 or random.random() < rate
+
+
+_worker_loop = None
+_worker_loop_pid = None
+_worker_loop_lock = threading.Lock()
+
+
+def get_worker_loop() -> asyncio.AbstractEventLoop:
+    """
+    Long-lived event loop of this process, running in a daemon thread. All async work
+    of a worker (database sessions, async Redis) goes through it, so the pooled
+    connections, which are bound to the loop that opened them, are reused from one task
+    to the next. Started on first use, and again in a forked child process.
+    """
+    global _worker_loop, _worker_loop_pid
+    with _worker_loop_lock:
+        if _worker_loop is None or _worker_loop_pid != os.getpid() or _worker_loop.is_closed():
+            _worker_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_worker_loop.run_forever, name="worker-event-loop", daemon=True
+            ).start()
+            _worker_loop_pid = os.getpid()
+    return _worker_loop
+
+
+def run_async(coro, timeout: float | None = None):
+    """Run a coroutine on the worker loop and wait for its result, from a (sync) Celery task."""
+    return asyncio.run_coroutine_threadsafe(coro, get_worker_loop()).result(timeout)
 
 
 
@@ -62,20 +121,37 @@ class custom_celery_task:
     def __call__(self, func):
         @functools.wraps(func)
         def wrapper_func(*args, **kwargs):
+            # Payloads are only rendered, and cut, for the records actually written
+            extra = {"task": func.__name__, "task_id": task_func.request.id}
             try:
-                logger.info(f"Starting task {func.__name__} with args: {args}, kwargs: {kwargs}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        f"Starting task {func.__name__} with args: {preview(args)}, "
+                        f"kwargs: {preview(kwargs)}",
+                        extra=extra,
+                    )
                 if self.task_kwargs.get('bind', False):
                     # If bind=True, the first argument is 'self'
                     result = func(args[0], *args[1:], **kwargs)
                 else:
                     result = func(*args, **kwargs)
-                logger.info(f"Completed task {func.__name__} with result: {result}")
+                # The result backend write starts now, see the task_success handler
+                task_func.request.returned_at = time.perf_counter()
+                if sampled() and logger.isEnabledFor(logging.INFO):
+                    logger.info(
+                        f"Completed task {func.__name__} with result: {preview(result)}",
+                        extra=extra,
+                    )
                 return result
             except self.EXCEPTION_BLOCK_LIST as e:
-                logger.error(f"Task {func.__name__} failed with non-retryable exception: {e}")
+                logger.error(
+                    f"Task {func.__name__} failed with non-retryable exception: {e}, "
+                    f"args: {preview(args)}",
+                    extra=extra,
+                )
                 raise
             except Exception as e:
-                logger.error(f"Task {func.__name__} failed with exception: {e}")
+                logger.error(f"Task {func.__name__} failed with exception: {e}", extra=extra)
                 countdown = self._get_retry_countdown(task_func)
                 raise task_func.retry(exc=e, countdown=countdown)
 
@@ -0,0 +1,229 @@
+"""
+Serialization of cached results and Celery task payloads.
+
+A `Codec` turns a value into bytes with one of the serializers below, compressed
+when the encoded value is larger than `compress_min_bytes`:
+
+- `json`: the standard library, the default
+- `orjson`: same wire format as `json`, several times faster
+- `msgpack`: binary, smaller for numbers
+
+Compression is `zlib` (standard library) or `zstd`.
+
+Encoded values start with a two-byte header naming the serializer and compression,
+so any codec decodes what any other wrote and the configuration can change without
+flushing the cache. Uncompressed JSON is written as is, without a header.
+
+NumPy arrays are encoded as their raw buffer plus dtype and shape with `msgpack`,
+and as lists with `json` / `orjson`.
+"""
+import json
+import zlib
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from project.config import settings
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+MAGIC = b"\x00"  # JSON text never starts with NUL
+
+SERIALIZERS = {"json": 1, "orjson": 2, "msgpack": 3}
+COMPRESSIONS = {"none": 0, "zlib": 1, "zstd": 2}
+
+NDARRAY_EXT_CODE = 1
+
+
+class CodecError(ValueError):
+    pass
+
+
+def _json_default(value: Any):
+    if np is not None:
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        if isinstance(value, np.generic):
+            return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _msgpack_default(value: Any):
+    if np is not None:
+        if isinstance(value, np.ndarray):
+            array = np.ascontiguousarray(value)
+            header = msgpack.packb([array.dtype.str, list(array.shape)])
+            return msgpack.ExtType(NDARRAY_EXT_CODE, header + array.tobytes())
+        if isinstance(value, np.generic):
+            return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not msgpack serializable")
+
+
+def _msgpack_ext_hook(code: int, data: bytes):
+    if code != NDARRAY_EXT_CODE:
+        return msgpack.ExtType(code, data)
+    unpacker = msgpack.Unpacker()
+    unpacker.feed(data)
+    dtype, shape = unpacker.unpack()
+    # Writable copy, frombuffer alone would be a read-only view of the message
+    return np.frombuffer(data[unpacker.tell():], dtype=dtype).reshape(shape).copy()
+
+
+def _dumps_json(value: Any) -> bytes:
+    return json.dumps(value, default=_json_default).encode("utf-8")
+
+
+def _dumps_orjson(value: Any) -> bytes:
+    return orjson.dumps(value, default=_json_default, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def _loads_json(data: bytes) -> Any:
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def _dumps_msgpack(value: Any) -> bytes:
+    return msgpack.packb(value, default=_msgpack_default, use_bin_type=True)
+
+
+def _loads_msgpack(data: bytes) -> Any:
+    if msgpack is None:
+        raise CodecError("Value encoded with msgpack, which is not installed")
+    return msgpack.unpackb(data, ext_hook=_msgpack_ext_hook, raw=False)
+
+
+DUMPS: Dict[str, Callable[[Any], bytes]] = {
+    "json": _dumps_json,
+    "orjson": _dumps_orjson,
+    "msgpack": _dumps_msgpack,
+}
+LOADS: Dict[int, Callable[[bytes], Any]] = {
+    SERIALIZERS["json"]: _loads_json,
+    SERIALIZERS["orjson"]: _loads_json,
+    SERIALIZERS["msgpack"]: _loads_msgpack,
+}
+
+
+def _compress(compression: str, data: bytes, level: Optional[int]) -> bytes:
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=level or 3).compress(data)
+    return zlib.compress(data, level or 6)
+
+
+def _decompress(compression: int, data: bytes) -> bytes:
+    if compression == COMPRESSIONS["zstd"]:
+        if zstandard is None:
+            raise CodecError("Value compressed with zstd, which is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if compression == COMPRESSIONS["zlib"]:
+        return zlib.decompress(data)
+    return data
+
+
+class Codec:
+    def __init__(
+        self,
+        serializer: str = "json",
+        compression: str = "none",
+        compress_min_bytes: int = 4096,
+        compress_level: Optional[int] = None,
+    ):
+        if serializer not in SERIALIZERS:
+            raise CodecError(
+                f"Unknown serializer {serializer!r}, expected one of {sorted(SERIALIZERS)}"
+            )
+        if compression not in COMPRESSIONS:
+            raise CodecError(
+                f"Unknown compression {compression!r}, expected one of {sorted(COMPRESSIONS)}"
+            )
+        for name, module, package in (
+            ("orjson", orjson, "orjson"),
+            ("msgpack", msgpack, "msgpack"),
+            ("zstd", zstandard, "zstandard"),
+        ):
+            if module is None and name in (serializer, compression):
+                raise CodecError(f"The {name} codec requires `pip install {package}`")
+        self.serializer = serializer
+        self.compression = compression
+        self.compress_min_bytes = compress_min_bytes
+        self.compress_level = compress_level
+
+    def __repr__(self):
+        return (
+            f"Codec({self.serializer!r}, {self.compression!r}, "
+            f"compress_min_bytes={self.compress_min_bytes})"
+        )
+
+    def dumps(self, value: Any) -> bytes:
+        data = DUMPS[self.serializer](value)
+        compression = "none"
+        if self.compression != "none" and len(data) >= self.compress_min_bytes:
+            data = _compress(self.compression, data, self.compress_level)
+            compression = self.compression
+        elif self.serializer != "msgpack":
+            # Plain JSON stays readable by processes running an older version
+            return data
+        header = COMPRESSIONS[compression] << 4 | SERIALIZERS[self.serializer]
+        return MAGIC + bytes([header]) + data
+
+    def loads(self, data: bytes) -> Any:
+        return loads(data)
+
+
+def parse_header(data: bytes) -> Tuple[int, int, bytes]:
+    """(serializer id, compression id, payload) of an encoded value."""
+    header = data[1]
+    return header & 0x0F, header >> 4, data[2:]
+
+
+def loads(data) -> Any:
+    """Decode a value written by any codec, or plain JSON."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if not data.startswith(MAGIC):
+        return _loads_json(data)
+    serializer, compression, payload = parse_header(data)
+    if serializer not in LOADS:
+        raise CodecError(f"Unknown serializer id {serializer}")
+    return LOADS[serializer](_decompress(compression, payload))
+
+
+def codec_from_settings(prefix: str) -> Codec:
+    """The codec configured by `{prefix}_CODEC`, `_COMPRESSION` and `_COMPRESS_MIN_BYTES`."""
+    return Codec(
+        getattr(settings, f"{prefix}_CODEC"),
+        getattr(settings, f"{prefix}_COMPRESSION"),
+        getattr(settings, f"{prefix}_COMPRESS_MIN_BYTES"),
+    )
+
+
+CELERY_SERIALIZER = "inference"
+CELERY_CONTENT_TYPE = "application/x-inference-codec"
+
+
+def register_celery_serializer(codec: Codec):
+    """Make `codec` available to Celery as the `inference` task / result serializer."""
+    from kombu.serialization import register
+
+    register(
+        CELERY_SERIALIZER,
+        codec.dumps,
+        loads,
+        content_type=CELERY_CONTENT_TYPE,
+        content_encoding="binary",
+    )
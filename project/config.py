@@ -50,17 +50,105 @@ class BaseConfig:
     }
     CELERY_TASK_ROUTES = (route_task,)
 
+    # Task / result serializer: "json", or "inference" to use TASK_CODEC (see project/codecs.py).
+    # Both are always accepted, so workers and API can switch one after the other
+    CELERY_TASK_SERIALIZER: str = os.getenv("CELERY_TASK_SERIALIZER", "json")
+    CELERY_RESULT_SERIALIZER: str = os.getenv("CELERY_RESULT_SERIALIZER", "json")
+    CELERY_ACCEPT_CONTENT: list = ["json", "inference"]
+    CELERY_RESULT_ACCEPT_CONTENT: list = ["json", "inference"]
+
     # Define your Celery beat schedule here
     CELERY_BEAT_SCHEDULE: dict = {
-        "dummy_task": {
-            "task": "project.celery_utils.dummy_task",
-            "schedule": 60.0  # Run every 60 seconds
+        "reconcile_quota_counters": {
+            "task": "project.inference.tasks.reconcile_quota_counters",
+            "schedule": 300.0  # Rebuild Redis quota counters from service_call every 5 minutes
+        },
+        "maintain_service_call_partitions": {
+            "task": "project.inference.tasks.maintain_service_call_partitions",
+            "schedule": 86400.0  # Create upcoming / expire old service_call partitions daily
         },
     }
     REDIS_HOST: str = os.getenv('REDIS_HOST', 'redis')
     REDIS_PORT: int = int(os.getenv('REDIS_PORT', 6379))
     REDIS_URL: str = f"redis://{REDIS_HOST}:{REDIS_PORT}/0"
+    # Async client of the API: shared pool, callers wait for a free connection once it is full
+    REDIS_MAX_CONNECTIONS: int = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+    REDIS_POOL_TIMEOUT: float = 5.0  # Seconds to wait for a free pooled connection
+    REDIS_SOCKET_TIMEOUT: float = 5.0
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30  # Seconds idle before a connection is pinged on reuse
+    # Prometheus metrics of the worker nodes, served by their main process (0 disables)
+    WORKER_METRICS_PORT: int = int(os.getenv("WORKER_METRICS_PORT", 9808))
+    # Logging (see project/logging.py): "text" or "json" records, written by a listener thread
+    # when LOG_QUEUE. Successful tasks are logged at this rate, payloads cut to
+    # LOG_MAX_VALUE_LENGTH chars
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "text")
+    LOG_QUEUE: bool = os.getenv("LOG_QUEUE", "true").lower() == "true"
+    LOG_TASK_SUCCESS_SAMPLE_RATE: float = float(os.getenv("LOG_TASK_SUCCESS_SAMPLE_RATE", 1.0))
+    LOG_MAX_VALUE_LENGTH: int = int(os.getenv("LOG_MAX_VALUE_LENGTH", 500))
+    # Request tracing (see project/tracing.py): "none", "json" (spans appended to TRACING_FILE)
+    # or "otlp" (OTLP/HTTP JSON to a collector, e.g. http://otel-collector:4318)
+    TRACING_EXPORTER: str = os.getenv("TRACING_EXPORTER", "none")
+    TRACING_FILE: str = os.getenv("TRACING_FILE", str(BASE_DIR / "traces.jsonl"))
+    TRACING_OTLP_ENDPOINT: str = os.getenv("TRACING_OTLP_ENDPOINT", "http://localhost:4318")
+    TRACING_SERVICE_NAME: str = os.getenv("TRACING_SERVICE_NAME", "inference")
+    # Share of new traces recorded
+    TRACING_SAMPLE_RATE: float = float(os.getenv("TRACING_SAMPLE_RATE", 1.0))
     CACHE_EXPIRATION_TIME: int = 3600  # Default cache expiration time in seconds
+    # In-process LRU in front of the Redis result cache, entries never outlive the Redis ones
+    LOCAL_CACHE_MAX_ENTRIES: int = 10000
+    LOCAL_CACHE_TTL: float = 60.0
+    # Users authenticated by JWT, cached in memory and Redis: a change made outside of the
+    # UserManager (e.g. straight in the database) shows after at most USER_CACHE_TTL seconds
+    USER_CACHE_TTL: float = 60.0
+    USER_CACHE_MAX_ENTRIES: int = 10000
+    # Access policies, models and grants cached by the API, dropped on every change made through
+    # the ORM. Changes made outside of it (e.g. SQL in psql) show after at most METADATA_CACHE_TTL
+    METADATA_CACHE_TTL: float = 300.0
+    METADATA_CACHE_MAX_ENTRIES: int = 100000
+    CACHE_LOCK_TIMEOUT: float = 30.0  # Seconds a worker may hold the compute lock of a missing key
+    CACHE_LOCK_WAIT: float = 10.0  # Seconds others wait for its result before computing it
+    CACHE_EARLY_REFRESH_BETA: float = 1.0  # > 1 refreshes hot keys earlier, 0 disables it
+    # Seconds hit / miss counts stay in process before being added in Redis
+    CACHE_STATS_FLUSH_INTERVAL: float = 5.0
+    # Memory budget of Redis, applied at API startup when set (e.g. "512mb"). The volatile-*
+    # policies only evict keys with a TTL: cached results and quota counters, never the service
+    # call stream
+    REDIS_MAXMEMORY: str = os.getenv("REDIS_MAXMEMORY", "")
+    REDIS_MAXMEMORY_POLICY: str = os.getenv("REDIS_MAXMEMORY_POLICY", "volatile-lfu")
+    # Codecs of cached results and "inference" Celery payloads: json, orjson or msgpack, compressed
+    # with none, zlib or zstd once the encoded value reaches *_COMPRESS_MIN_BYTES
+    CACHE_CODEC: str = os.getenv("CACHE_CODEC", "json")
+    CACHE_COMPRESSION: str = os.getenv("CACHE_COMPRESSION", "none")
+    CACHE_COMPRESS_MIN_BYTES: int = 4096
+    TASK_CODEC: str = os.getenv("TASK_CODEC", "json")
+    TASK_COMPRESSION: str = os.getenv("TASK_COMPRESSION", "none")
+    TASK_COMPRESS_MIN_BYTES: int = 4096
+    MODEL_POOL_PRELOAD: bool = True  # Build registered models when a worker process starts
+    # Inline predictions in flight before falling back to Celery
+    INLINE_INFERENCE_MAX_CONCURRENCY: int = 4
+    BATCH_MAX_SIZE: int = 10000  # Max number of inputs accepted by /inference/predict-batch
+    # "database": count service_call rows on each request, "redis": atomic counters in Redis
+    QUOTA_BACKEND: str = os.getenv("QUOTA_BACKEND", "database")
+    # "sync": service_call rows are written by the request / task, "buffered": events are
+    # appended to a Redis stream and bulk-written by a writer running in each API process
+    SERVICE_CALL_WRITE_MODE: str = os.getenv("SERVICE_CALL_WRITE_MODE", "sync")
+    SERVICE_CALL_FLUSH_INTERVAL_MS: int = 500  # Max time an event waits before being written
+    SERVICE_CALL_FLUSH_MAX_ROWS: int = 1000  # Events written per batch
+    SERVICE_CALL_MAX_DELIVERIES: int = 5  # Deliveries of an event before it is dead-lettered
+    COMPLETION_WRITER_MAX_ROWS: int = 500  # Task completions written per UPDATE by a worker
+    COMPLETION_WRITER_INTERVAL_MS: int = 200  # Max time a completion waits before being written
+    COMPLETION_WRITER_SHUTDOWN_TIMEOUT: float = 10.0  # Seconds to flush completions at worker exit
+    RESULT_STREAM_TIMEOUT: float = 300.0  # Seconds a /results stream waits for its task
+    RESULT_STREAM_KEEPALIVE: float = 15.0  # Seconds between SSE keep-alive comments while waiting
+    TASK_STATUS_MAX_WAIT: float = 30.0  # Longest long-poll of /inference/task_status?wait=
+    # Monthly service_call partitions (Postgres): created ahead, expired after the retention
+    SERVICE_CALL_PARTITIONS_AHEAD: int = 3
+    SERVICE_CALL_RETENTION_MONTHS: int = int(os.getenv("SERVICE_CALL_RETENTION_MONTHS", 13))
+    # Detach and rename expired partitions instead of dropping them, to archive them
+    SERVICE_CALL_ARCHIVE_EXPIRED: bool = (
+        os.getenv("SERVICE_CALL_ARCHIVE_EXPIRED", "false").lower() == "true"
+    )
 
 
 
@@ -69,13 +157,15 @@ class DevelopmentConfig(BaseConfig):
 
 
 class ProductionConfig(BaseConfig):
-    pass
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "json")
+    LOG_TASK_SUCCESS_SAMPLE_RATE: float = float(os.getenv("LOG_TASK_SUCCESS_SAMPLE_RATE", 0.01))
 
 
 class TestingConfig(BaseConfig):
     # https://fastapi.tiangolo.com/advanced/testing-database/
     DATABASE_URL: ClassVar[str] = "sqlite+aiosqlite:///./test.db"
     DATABASE_CONNECT_DICT: ClassVar[dict] = {"check_same_thread": False}
+    LOG_QUEUE: bool = False  # Records are written before the test reads them
 
 
 @lru_cache
@@ -1,16 +1,48 @@
+from typing import Optional
+
+import jwt
+from fastapi_users import exceptions
 from fastapi_users.authentication import (
     AuthenticationBackend,
     BearerTransport,
     JWTStrategy,
 )
+from fastapi_users.jwt import decode_jwt
 
+from project import metrics
 from project.config import settings
 
 bearer_transport = BearerTransport(tokenUrl=f"{settings.API_V1_STR}/auth/jwt/login")
 
 
+class CachedJWTStrategy(JWTStrategy):
+    """JWT strategy reading the user of the token through the user cache."""
+
+    async def read_token(self, token: Optional[str], user_manager):
+        if token is None:
+            return None
+        try:
+            data = decode_jwt(
+                token, self.decode_key, self.token_audience, algorithms=[self.algorithm]
+            )
+            user_id = data.get("sub")
+            if user_id is None:
+                return None
+        except jwt.PyJWTError:
+            return None
+
+        from project.fu_core.users.cache import get_cached_user  # Import inside the function
+
+        try:
+            parsed_id = user_manager.parse_id(user_id)
+        except exceptions.InvalidID:
+            return None
+        with metrics.timer("auth"):
+            return await get_cached_user(user_manager.user_db, parsed_id)
+
+
 def get_jwt_strategy() -> JWTStrategy:
-    return JWTStrategy(
+    return CachedJWTStrategy(
         secret=settings.SECRET_KEY, lifetime_seconds=settings.JWT_TOKEN_LIFETIME, algorithm="HS256"
     )
 
@@ -1,5 +1,5 @@
 import uuid
-from typing import Optional
+from typing import Any, Dict, Optional
 
 from fastapi import Request
 from fastapi_users import BaseUserManager, FastAPIUsers, UUIDIDMixin
@@ -7,6 +7,7 @@ from fastapi_users import BaseUserManager, FastAPIUsers, UUIDIDMixin
 from project.config import settings
 from project.fu_core.security import auth_backend
 from project.fu_core.users import deps, models
+from project.fu_core.users.cache import invalidate_user
 
 
 class UserManager(UUIDIDMixin, BaseUserManager[models.User, uuid.UUID]):
@@ -26,6 +27,21 @@ class UserManager(UUIDIDMixin, BaseUserManager[models.User, uuid.UUID]):
     ):
         print(f"Verification requested for user {user.id}. Verification token: {token}")
 
+    # Users authenticated from the cache must see these changes on their next request
+    async def on_after_update(
+        self, user: models.User, update_dict: Dict[str, Any], request: Optional[Request] = None
+    ):
+        await invalidate_user(user.id)
+
+    async def on_after_verify(self, user: models.User, request: Optional[Request] = None):
+        await invalidate_user(user.id)
+
+    async def on_after_reset_password(self, user: models.User, request: Optional[Request] = None):
+        await invalidate_user(user.id)
+
+    async def on_after_delete(self, user: models.User, request: Optional[Request] = None):
+        await invalidate_user(user.id)
+
 
 fastapi_users = FastAPIUsers[models.User, uuid.UUID](deps.get_user_manager, [auth_backend])
 
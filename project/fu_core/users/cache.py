@@ -0,0 +1,113 @@
+"""
+Users authenticated by their JWT, cached in memory then Redis so the hot path does
+not SELECT the user row on every request.
+
+Only identity fields are cached, never `hashed_password`: cached users come back as
+transient `User` objects, used to authorize the request. `CachedUserDatabase`
+reloads the row before writing, and the `UserManager` hooks invalidate the entry
+in every process once the user changes.
+"""
+import logging
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import redis
+from fastapi_users.db import SQLAlchemyUserDatabase
+
+from project import redis_utils
+from project.config import settings
+from project.fu_core.users.models import User
+from project.local_cache import LocalCache, invalidator
+
+logger = logging.getLogger(__name__)
+
+USER_KEY_PREFIX = "user"
+INVALIDATION_CHANNEL = "users:invalidate"
+CACHED_FIELDS = (
+    "id",
+    "email",
+    "is_active",
+    "is_superuser",
+    "is_verified",
+    "date_created",
+    "date_deleted",
+)
+DATETIME_FIELDS = ("date_created", "date_deleted")
+
+local_users = LocalCache(settings.USER_CACHE_MAX_ENTRIES, settings.USER_CACHE_TTL)
+
+
+def user_key(user_id: Any) -> str:
+    return f"{USER_KEY_PREFIX}:{user_id}"
+
+
+def dump_user(user: User) -> Dict[str, Any]:
+    data = {field: getattr(user, field) for field in CACHED_FIELDS}
+    data["id"] = str(data["id"])
+    for field in DATETIME_FIELDS:
+        if data[field] is not None:
+            data[field] = data[field].isoformat()
+    return data
+
+
+def load_user(data: Dict[str, Any]) -> User:
+    fields = dict(data, id=uuid.UUID(data["id"]))
+    for field in DATETIME_FIELDS:
+        if fields[field] is not None:
+            fields[field] = datetime.fromisoformat(fields[field])
+    return User(**fields)
+
+
+async def get_cached_user(user_db: SQLAlchemyUserDatabase, user_id: uuid.UUID) -> Optional[User]:
+    """The user from local memory, Redis, then the database. None if it does not exist."""
+    key = user_key(user_id)
+    data = local_users.get(key)
+    if data is None:
+        try:
+            data = await redis_utils.aget_cache(key)
+        except redis.RedisError as e:
+            logger.warning(f"User cache unavailable: {e}")
+    if data is not None:
+        local_users.set(key, data)
+        # A new object per request, callers may modify it
+        return load_user(data)
+
+    user = await user_db.get(user_id)
+    if user is not None:
+        data = dump_user(user)
+        local_users.set(key, data)
+        try:
+            await redis_utils.aset_cache(key, data, expiration=int(settings.USER_CACHE_TTL))
+        except redis.RedisError as e:
+            logger.warning(f"User cache unavailable: {e}")
+    return user
+
+
+async def invalidate_user(user_id: Any):
+    key = user_key(user_id)
+    local_users.delete(key)
+    try:
+        await redis_utils.async_redis_client.delete(key)
+    except redis.RedisError as e:
+        # The Redis entry then expires after USER_CACHE_TTL
+        logger.warning(f"Could not invalidate cached user {user_id}: {e}")
+    await invalidator.apublish(INVALIDATION_CHANNEL, key)
+
+
+invalidator.register(INVALIDATION_CHANNEL, local_users.delete)
+
+
+class CachedUserDatabase(SQLAlchemyUserDatabase):
+    """Writes go to the row loaded in this session, the user may come from the cache."""
+
+    async def _attached(self, user: User) -> User:
+        if user in self.session:
+            return user
+        return await self.session.get(User, user.id)
+
+    async def update(self, user: User, update_dict: Dict[str, Any]) -> User:
+        return await super().update(await self._attached(user), update_dict)
+
+    async def delete(self, user: User) -> None:
+        await super().delete(await self._attached(user))
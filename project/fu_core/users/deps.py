@@ -1,16 +1,16 @@
 from fastapi import Depends
-from fastapi_users.db import SQLAlchemyUserDatabase
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from project.database import get_async_session
+from project.fu_core.users.cache import CachedUserDatabase
 from project.fu_core.users.models import User
 
 
 async def get_user_db(session: AsyncSession = Depends(get_async_session)):
-    return SQLAlchemyUserDatabase(session, User)
+    return CachedUserDatabase(session, User)
 
 
-async def get_user_manager(user_db: SQLAlchemyUserDatabase = Depends(get_user_db)):
+async def get_user_manager(user_db: CachedUserDatabase = Depends(get_user_db)):
     from project.fu_core.users import UserManager  # Import inside the function
 
     return UserManager(user_db)
\ No newline at end of file
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+BatchRunner = Callable[[List[Dict[str, Any]]], Awaitable[List[Any]]]
+
+
+class MicroBatcher:
+    """
+    Groups concurrent single predictions for one model into batches.
+
+    A batch is flushed as soon as `max_batch_size` inputs are pending, or
+    `max_wait_ms` after its first input arrived. `run_batch` receives the inputs
+    and returns one outcome per input: its result, or the exception raised for it,
+    which is then raised to that caller only.
+    """
+
+    def __init__(self, run_batch: BatchRunner, max_batch_size: int, max_wait_ms: float):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._running: Set[asyncio.Task] = set()
+
+    async def submit(self, input_data: Dict[str, Any]) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((input_data, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_ms / 1000, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._run(batch))
+        # Keep a reference until done, the loop only holds weak references to tasks
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        logger.debug(f"Running micro-batch of {len(batch)} inputs")
+        try:
+            outcomes = await self.run_batch([input_data for input_data, _ in batch])
+        except Exception as e:
+            outcomes = [e] * len(batch)
+
+        for (_, future), outcome in zip(batch, outcomes):
+            if future.done():
+                # The caller went away (request cancelled)
+                continue
+            if isinstance(outcome, BaseException):
+                future.set_exception(outcome)
+            else:
+                future.set_result(outcome)
@@ -0,0 +1,341 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import redis
+from pydantic import BaseModel
+
+from project import metrics, redis_utils
+from project.config import settings
+from project.local_cache import LocalCache, invalidator
+from project.inference.model_registry import model_registry
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY_PREFIX = "inference"
+CACHE_STATS_KEY = "inference:cache_stats"
+MODEL_VERSIONS_KEY = "inference:model_versions"
+INVALIDATION_CHANNEL = "inference:cache:invalidate"
+ENTRY_FIELDS = {"value", "delta", "expires_at"}
+
+# KEYS: lock. ARGV: token of the holder, so an expired lock taken over is not released
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def canonical_payload(input_data: Any) -> str:
+    """
+    Serialize a validated model input to a stable string: same fields and values
+    give the same string in every process, whatever the key order of the request.
+    """
+    if isinstance(input_data, BaseModel):
+        data = input_data.model_dump(mode="json")
+    elif isinstance(input_data, Mapping):
+        data = dict(input_data)
+    else:
+        data = vars(input_data)
+    return json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def make_cache_key(model_id: int, input_data: Any) -> str:
+    """
+    Content-addressed result key: `inference:<model name>:<version>:<sha256 of input>`.
+    Bumping the version in the registry moves the model to a fresh key space.
+    """
+    model_info = model_registry[model_id]
+    digest = hashlib.sha256(canonical_payload(input_data).encode("utf-8")).hexdigest()
+    return f"{CACHE_KEY_PREFIX}:{model_info['name']}:{model_info['version']}:{digest}"
+
+
+# Hot results served from memory, without the Redis round-trip and decoding
+local_results = LocalCache(settings.LOCAL_CACHE_MAX_ENTRIES, settings.LOCAL_CACHE_TTL)
+
+
+def model_key_prefix(model_name: str) -> str:
+    return f"{CACHE_KEY_PREFIX}:{model_name}:"
+
+
+def _local_ttl(cached: Any) -> Optional[float]:
+    # Never outlives the Redis entry
+    expires_at = read_entry(cached)[2]
+    return None if expires_at is None else expires_at - time.time()
+
+
+def get_cached(cache_key: str) -> Any:
+    """Cache entry of `cache_key` from local memory, then Redis."""
+    cached = local_results.get(cache_key)
+    if cached is None:
+        cached = redis_utils.get_cache(cache_key)
+        if cached:
+            local_results.set(cache_key, cached, _local_ttl(cached))
+    return cached
+
+
+async def aget_cached(cache_key: str) -> Any:
+    cached = local_results.get(cache_key)
+    if cached is None:
+        cached = await redis_utils.aget_cache(cache_key)
+        if cached:
+            local_results.set(cache_key, cached, _local_ttl(cached))
+    return cached
+
+
+def invalidate_model_results(model_name: str):
+    """Drop the results of a model from the local caches of every process."""
+    local_results.delete_prefix(model_key_prefix(model_name))
+    invalidator.publish(INVALIDATION_CHANNEL, model_key_prefix(model_name))
+
+
+def announce_model_versions():
+    """
+    Process startup: when the registry has a new version of a model, the processes
+    still running the previous one drop its results from memory.
+    """
+    try:
+        known = redis_utils.redis_client.hgetall(MODEL_VERSIONS_KEY)
+        for model_info in model_registry.values():
+            name, version = model_info["name"], str(model_info["version"])
+            previous = known.get(name.encode("utf-8"))
+            if previous is not None and previous.decode("utf-8") != version:
+                logger.info(
+                    f"Model {name} is now version {version}, invalidating its cached results"
+                )
+                invalidate_model_results(name)
+            redis_utils.redis_client.hset(MODEL_VERSIONS_KEY, name, version)
+    except redis.RedisError as e:
+        logger.warning(f"Could not announce model versions: {e}")
+
+
+invalidator.register(INVALIDATION_CHANNEL, local_results.delete_prefix)
+
+
+class CacheStats:
+    """
+    Hit / miss counts of this process, added to the fleet-wide counters in Redis
+    (`CACHE_STATS_KEY`) every `interval` seconds by a daemon thread: counting a
+    lookup never waits on Redis. Counts not flushed yet are kept on Redis errors.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._counts: Counter = Counter()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def record(self, model_id: int, outcome: str):
+        # A forked child inherits the object, not the flush thread
+        if self._pid != os.getpid():
+            self._start()
+        with self._lock:
+            self._counts[f"{model_id}:{outcome}"] += 1
+
+    def _start(self):
+        self._pid = os.getpid()
+        # The counts of the parent are flushed by the parent
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._thread = threading.Thread(target=self._run, name="cache-stats-flush", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def pending(self) -> Counter:
+        with self._lock:
+            return Counter(self._counts)
+
+    def flush(self):
+        """Add the counts of this process in Redis now, in the calling thread."""
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+        if not counts:
+            return
+        try:
+            pipeline = redis_utils.redis_client.pipeline(transaction=False)
+            for field, count in counts.items():
+                pipeline.hincrby(CACHE_STATS_KEY, field, count)
+            pipeline.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Could not record cache stats: {e}")
+            with self._lock:
+                self._counts.update(counts)
+
+
+cache_stats = CacheStats(settings.CACHE_STATS_FLUSH_INTERVAL)
+
+
+def record_cache_hit(model_id: int):
+    cache_stats.record(model_id, "hits")
+
+
+def record_cache_miss(model_id: int):
+    cache_stats.record(model_id, "misses")
+
+
+def get_cache_stats() -> Dict[int, Dict[str, Any]]:
+    """Fleet-wide hit / miss counters per model id, with the unflushed counts of this process."""
+    raw = redis_utils.redis_client.hgetall(CACHE_STATS_KEY)
+    counts = Counter({field.decode("utf-8"): int(value) for field, value in raw.items()})
+    counts.update(cache_stats.pending())
+    stats: Dict[int, Dict[str, Any]] = {}
+    for field, value in counts.items():
+        model_id, outcome = field.split(":")
+        model_stats = stats.setdefault(int(model_id), {"hits": 0, "misses": 0})
+        model_stats[outcome] = value
+    for model_stats in stats.values():
+        total = model_stats["hits"] + model_stats["misses"]
+        model_stats["hit_ratio"] = model_stats["hits"] / total if total else 0.0
+    return stats
+
+
+def cache_ttl(model_id: int) -> int:
+    """Seconds results of the model are cached for, 0 when they are not cached."""
+    ttl = model_registry[model_id].get("cache_ttl")
+    return settings.CACHE_EXPIRATION_TIME if ttl is None else ttl
+
+
+def make_entry(value: Any, delta: float, ttl: int) -> Dict[str, Any]:
+    """Cached value, with the time it took to compute and its expiry for early refresh."""
+    return {"value": value, "delta": delta, "expires_at": time.time() + ttl}
+
+
+def read_entry(cached: Any) -> Tuple[Any, Optional[float], Optional[float]]:
+    """(value, delta, expires_at) of a cache entry, (value, None, None) for bare values."""
+    if isinstance(cached, dict) and cached.keys() == ENTRY_FIELDS:
+        return cached["value"], cached["delta"], cached["expires_at"]
+    return cached, None, None
+
+
+def should_refresh(
+    delta: Optional[float], expires_at: Optional[float], beta: Optional[float] = None
+) -> bool:
+    """
+    Probabilistic early expiration (XFetch): each read recomputes ahead of the expiry
+    with a probability growing as it gets closer, and with the compute time `delta`,
+    so a hot key is refreshed once before it expires instead of by every reader after.
+    """
+    if delta is None or expires_at is None:
+        return False
+    beta = settings.CACHE_EARLY_REFRESH_BETA if beta is None else beta
+    return time.time() - delta * beta * math.log(1.0 - random.random()) >= expires_at
+
+
+def lock_key(cache_key: str) -> str:
+    return f"{cache_key}:lock"
+
+
+def acquire_lock(cache_key: str) -> Optional[str]:
+    """Token of the compute lock of `cache_key`, None if another worker holds it."""
+    token = uuid.uuid4().hex
+    acquired = redis_utils.redis_client.set(
+        lock_key(cache_key), token, nx=True, px=int(settings.CACHE_LOCK_TIMEOUT * 1000)
+    )
+    return token if acquired else None
+
+
+def release_lock(cache_key: str, token: str):
+    try:
+        redis_utils.redis_client.eval(RELEASE_LOCK_SCRIPT, 1, lock_key(cache_key), token)
+    except redis.RedisError as e:
+        # Expires on its own after CACHE_LOCK_TIMEOUT
+        logger.warning(f"Could not release the lock of {cache_key}: {e}")
+
+
+def compute_and_cache(model_id: int, cache_key: str, compute: Callable[[], Any], ttl: int) -> Any:
+    start = time.perf_counter()
+    value = compute()
+    entry = make_entry(value, time.perf_counter() - start, ttl)
+    try:
+        with metrics.timer("cache_set", model_id):
+            redis_utils.set_cache(cache_key, entry, ttl)
+        local_results.set(cache_key, entry, ttl)
+    except redis.RedisError as e:
+        logger.warning(f"Could not cache the result of {cache_key}: {e}")
+    return value
+
+
+def wait_for_value(cache_key: str) -> Tuple[bool, Any]:
+    """
+    Wait for the lock holder to cache its result: (True, value) once it is there,
+    (False, None) if the lock is released or expires without one.
+    """
+    deadline = time.monotonic() + settings.CACHE_LOCK_WAIT
+    interval = 0.01
+    while time.monotonic() < deadline:
+        time.sleep(interval)
+        cached = redis_utils.get_cache(cache_key)
+        if cached is not None:
+            return True, read_entry(cached)[0]
+        if not redis_utils.redis_client.exists(lock_key(cache_key)):
+            return False, None
+        interval = min(interval * 2, 0.2)
+    return False, None
+
+
+def get_or_compute(model_id: int, cache_key: str, compute: Callable[[], Any]) -> Any:
+    """
+    Cached result of `cache_key`, computed with `compute` on a miss.
+
+    Concurrent misses on the same key are coalesced: the worker taking the lock
+    computes the result, the others wait for it to be cached (at most
+    `CACHE_LOCK_WAIT` seconds, then they compute it themselves). Redis errors are
+    not fatal, the result is then computed without the cache.
+    """
+    ttl = cache_ttl(model_id)
+    if ttl <= 0:
+        return compute()
+
+    try:
+        with metrics.timer("cache_get", model_id):
+            cached = get_cached(cache_key)
+        if cached:
+            record_cache_hit(model_id)
+            return read_entry(cached)[0]
+        record_cache_miss(model_id)
+
+        token = acquire_lock(cache_key)
+        if token is None:
+            found, value = wait_for_value(cache_key)
+            if found:
+                return value
+            logger.info(f"No result cached by the holder of {lock_key(cache_key)}, computing it")
+    except redis.RedisError as e:
+        logger.warning(f"Cache unavailable for key {cache_key}: {e}")
+        return compute()
+
+    try:
+        return compute_and_cache(model_id, cache_key, compute, ttl)
+    finally:
+        if token is not None:
+            release_lock(cache_key, token)
+
+
+def refresh(model_id: int, cache_key: str, compute: Callable[[], Any]) -> bool:
+    """Recompute `cache_key` ahead of its expiry, unless another worker already is."""
+    ttl = cache_ttl(model_id)
+    if ttl <= 0:
+        return False
+    token = acquire_lock(cache_key)
+    if token is None:
+        return False
+    try:
+        compute_and_cache(model_id, cache_key, compute, ttl)
+        return True
+    finally:
+        release_lock(cache_key, token)
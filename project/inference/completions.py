@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from project.celery_utils import get_worker_loop
+from project.database import async_session_maker
+from project.inference.crud import update_service_calls_time_completed
+
+logger = logging.getLogger(__name__)
+
+Completion = Tuple[str, datetime]
+
+
+class CompletionWriter:
+    """
+    Per-worker-process writer of task completion times.
+
+    `submit` is called from the task_success signal, in the worker thread: it only
+    hands the completion to the worker event loop (see `celery_utils.get_worker_loop`),
+    which writes completions in batches of up to `max_rows`, waiting at most
+    `interval_ms` after the first one, with one UPDATE through the loop's
+    connection pool.
+    """
+
+    def __init__(self, max_rows: int, interval_ms: int):
+        self.max_rows = max_rows
+        self.interval_ms = interval_ms
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pid: Optional[int] = None
+
+    @property
+    def started(self) -> bool:
+        # A forked child inherits the object, not the loop thread
+        return self._task is not None and self._pid == os.getpid()
+
+    def start(self):
+        self._loop = get_worker_loop()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        self._pid = os.getpid()
+
+    async def _start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    def submit(self, task_id: str, time_completed: datetime):
+        if not self.started:
+            self.start()
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (task_id, time_completed))
+
+    async def _next_batch(self) -> List[Completion]:
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.interval_ms / 1000
+        while len(batch) < self.max_rows:
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self.write(batch)
+            except Exception as e:
+                logger.error(f"Failed to record completion of {len(batch)} tasks: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def write(self, batch: List[Completion]):
+        async with async_session_maker() as session:
+            await update_service_calls_time_completed(session, batch)
+        logger.debug(f"Recorded completion of {len(batch)} tasks")
+
+    def flush(self, timeout: Optional[float] = None):
+        """Block until every submitted completion is written, e.g. on worker shutdown."""
+        if self.started:
+            asyncio.run_coroutine_threadsafe(self._queue.join(), self._loop).result(timeout)
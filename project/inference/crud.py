@@ -1,6 +1,6 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import func, update
+from sqlalchemy import case, delete, func, insert, update
 from datetime import datetime, timedelta, timezone
 from uuid import UUID
 from dateutil.parser import isoparse
@@ -10,10 +10,16 @@ from project.inference.models import (
     UserAccess,
     AccessPolicy
 ) 
+from project import metrics, tracing
+from project.config import settings
+from project.inference import metadata, quota as quota_counters
+from collections import Counter
+import functools
 import logging
 
 logger = logging.getLogger(__name__)
 
+@tracing.traced()
 async def create_access_policy(
     session: AsyncSession,
     name: str,
@@ -31,11 +37,13 @@ async def create_access_policy(
     return new_policy
 
 
+@tracing.traced()
 async def get_access_policy_by_name(session: AsyncSession, name: str) -> AccessPolicy | None:
     result = await session.execute(select(AccessPolicy).where(AccessPolicy.name == name))
     return result.scalars().first()
 
 
+@tracing.traced()
 async def create_inference_model(
     session: AsyncSession,
     name: str,
@@ -58,6 +66,7 @@ async def create_inference_model(
 
 
 
+@tracing.traced()
 async def get_access_policy(
     session: AsyncSession, policy_id: int
 ) -> AccessPolicy | None:
@@ -76,6 +85,7 @@ def add_placeholder_model():
     )
     
     
+@tracing.traced()
 async def create_user_access(
     session: AsyncSession,
     user_id: UUID,
@@ -94,19 +104,27 @@ async def create_user_access(
 
 
     
+@tracing.traced()
 async def get_inference_model(session: AsyncSession, model_id: int) -> InferenceModel | None:
     result = await session.execute(select(InferenceModel).where(InferenceModel.id == model_id))
     return result.scalars().first()
 
 
+@tracing.traced()
 async def create_service_call(
     session: AsyncSession, 
     model_id: int, 
     user_id: UUID, 
-    celery_task_id: str | None = None
+    celery_task_id: str | None = None,
+    time_completed: datetime | None = None,
+    n_inputs: int = 1
 ) -> ServiceCall:
     new_service_call = ServiceCall(
-        model_id=model_id, user_id=user_id, celery_task_id=celery_task_id
+        model_id=model_id,
+        user_id=user_id,
+        celery_task_id=celery_task_id,
+        time_completed=time_completed,
+        n_inputs=n_inputs
     )
     session.add(new_service_call)
     await session.commit()
@@ -114,26 +132,53 @@ async def create_service_call(
     return new_service_call
 
 
+@tracing.traced()
 async def get_service_call(session: AsyncSession, service_call_id: int) -> ServiceCall | None:
     result = await session.execute(select(ServiceCall).where(ServiceCall.id == service_call_id))
     return result.scalars().first()
 
 
-async def update_service_call_time_completed(session: AsyncSession, task_id: str, time_completed: datetime):
-    async with session.begin():
-        logger.info(f"Fetching service call with task ID: {task_id}")
-        result = await session.execute(
-            select(ServiceCall).where(ServiceCall.celery_task_id == task_id)
+@tracing.traced()
+async def update_service_calls_time_completed(
+    session: AsyncSession, completions: list[tuple[str, datetime]]
+) -> list[int]:
+    """
+    Set `time_completed` for `(task_id, time_completed)` pairs with a single
+    `UPDATE ... WHERE celery_task_id IN (...) RETURNING id`, served by the unique
+    index on celery_task_id. Returns the ids of the updated service calls.
+    """
+    times_completed = dict(completions)
+    # Comparisons rather than a value lookup, so task ids are bound with the column type
+    time_completed = case(
+        *(
+            (ServiceCall.celery_task_id == task_id, time)
+            for task_id, time in times_completed.items()
         )
-        service_call = result.scalars().first()
-        if service_call:
-            logger.info(f"Service call found for task ID: {task_id}, updating time_completed")
-            service_call.time_completed = time_completed
-            session.add(service_call)
-            await session.commit()
-            logger.info(f"Service call with task ID: {task_id} updated successfully")
-        else:
-            logger.warning(f"No service call found for task ID: {task_id}")
+    )
+    result = await session.execute(
+        update(ServiceCall)
+        .where(ServiceCall.celery_task_id.in_(times_completed))
+        .values(time_completed=time_completed)
+        .returning(ServiceCall.id, ServiceCall.celery_task_id)
+        .execution_options(synchronize_session=False)
+    )
+    updated = result.all()
+    await session.commit()
+    if len(updated) < len(times_completed):
+        missing = set(times_completed) - {task_id for _, task_id in updated}
+        logger.warning(f"No service call found for task IDs: {sorted(missing)}")
+    return [service_call_id for service_call_id, _ in updated]
+
+
+@tracing.traced()
+async def update_service_call_time_completed(
+    session: AsyncSession, task_id: str, time_completed: datetime
+) -> int | None:
+    """Returns the id of the updated service call, None if no call has this task id."""
+    service_call_ids = await update_service_calls_time_completed(
+        session, [(task_id, time_completed)]
+    )
+    return service_call_ids[0] if service_call_ids else None
 
 
 # async def update_service_call_time_completed(
@@ -153,6 +198,7 @@ async def update_service_call_time_completed(session: AsyncSession, task_id: str
 #             logger.warning(f"ServiceCall with task_id {task_id} not found")
             
 
+@tracing.traced()
 async def get_user_access(
     session: AsyncSession, user_id: UUID, model_id: int
 ) -> UserAccess | None:
@@ -166,66 +212,270 @@ async def get_user_access(
     return result.scalars().first()
 
 
-async def check_daily_limit(
-    session: AsyncSession, user_id: UUID, model_id: int, access_policy: AccessPolicy
-) -> bool:
-    today = datetime.now(timezone.utc).date()
-    result = await session.execute(
-        select(func.count(ServiceCall.id)).where(
+def quota_windows(now: datetime | None = None) -> tuple[datetime, datetime]:
+    """Start of the current UTC day and month, the lower bounds of the quota ranges."""
+    now = now or datetime.now(timezone.utc)
+    start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start_of_day, start_of_day.replace(day=1)
+
+
+def _usage_since(user_id: UUID, model_id: int, since: datetime):
+    # Range predicate on the raw column, served by ix_service_call_user_model_time
+    return (
+        select(func.coalesce(func.sum(ServiceCall.n_inputs), 0))
+        .where(
             ServiceCall.user_id == user_id,
             ServiceCall.model_id == model_id,
-            func.date(ServiceCall.time_requested) == today
+            ServiceCall.time_requested >= since
         )
+        .scalar_subquery()
     )
-    daily_calls = result.scalar_one_or_none()
-    return (daily_calls or 0) < access_policy.daily_api_calls
+
+
+@tracing.traced()
+async def check_daily_limit(
+    session: AsyncSession,
+    user_id: UUID,
+    model_id: int,
+    access_policy: AccessPolicy,
+    n_calls: int = 1
+) -> bool:
+    start_of_day, _ = quota_windows()
+    daily_calls = await session.scalar(select(_usage_since(user_id, model_id, start_of_day)))
+    return (daily_calls or 0) + n_calls <= access_policy.daily_api_calls
 
 
 
+@tracing.traced()
 async def check_monthly_limit(
-    session: AsyncSession, user_id: UUID, model_id: int, access_policy: AccessPolicy
+    session: AsyncSession,
+    user_id: UUID,
+    model_id: int,
+    access_policy: AccessPolicy,
+    n_calls: int = 1
 ) -> bool:
-    first_day_of_month = datetime.now(timezone.utc).replace(day=1)
+    _, start_of_month = quota_windows()
+    monthly_calls = await session.scalar(select(_usage_since(user_id, model_id, start_of_month)))
+    return (monthly_calls or 0) + n_calls <= access_policy.monthly_api_calls
+
+
+@tracing.traced()
+async def get_usage(session: AsyncSession, user_id: UUID, model_id: int) -> tuple[int, int]:
+    """Calls recorded today and this month for a user / model pair."""
+    start_of_day, start_of_month = quota_windows()
     result = await session.execute(
-        select(func.count(ServiceCall.id)).where(
-            ServiceCall.user_id == user_id,
-            ServiceCall.model_id == model_id,
-            ServiceCall.time_requested >= first_day_of_month
+        select(
+            _usage_since(user_id, model_id, start_of_day),
+            _usage_since(user_id, model_id, start_of_month),
         )
     )
-    monthly_calls = result.scalar_one_or_none()
-    return (monthly_calls or 0) < access_policy.monthly_api_calls
+    daily_calls, monthly_calls = result.one()
+    return daily_calls, monthly_calls
 
 
-async def update_user_access(session: AsyncSession, user_access: UserAccess):
-    user_access.api_calls += 1
+@tracing.traced()
+async def get_usage_by_user_model(session: AsyncSession) -> list:
+    """`(user_id, model_id, daily_calls, monthly_calls)` for every pair active this month."""
+    start_of_day, start_of_month = quota_windows()
+    today = case((ServiceCall.time_requested >= start_of_day, ServiceCall.n_inputs), else_=0)
+    result = await session.execute(
+        select(
+            ServiceCall.user_id,
+            ServiceCall.model_id,
+            func.coalesce(func.sum(today), 0),
+            func.sum(ServiceCall.n_inputs),
+        )
+        .where(ServiceCall.time_requested >= start_of_month)
+        .group_by(ServiceCall.user_id, ServiceCall.model_id)
+    )
+    return result.all()
+
+
+@tracing.traced()
+async def get_quota_status(
+    session: AsyncSession, user_id: UUID, model_id: int, with_usage: bool = True
+):
+    """
+    Access grant, policy limits and current daily / monthly usage in one round-trip.
+    Returns None when the user has no granted access, `daily_api_calls` is None
+    when the access points to a missing policy.
+    `with_usage=False` skips the usage aggregates, when counters are kept in Redis.
+    """
+    columns = [UserAccess, AccessPolicy.daily_api_calls, AccessPolicy.monthly_api_calls]
+    if with_usage:
+        start_of_day, start_of_month = quota_windows()
+        columns += [
+            _usage_since(user_id, model_id, start_of_day).label("daily_calls"),
+            _usage_since(user_id, model_id, start_of_month).label("monthly_calls"),
+        ]
+    result = await session.execute(
+        select(*columns)
+        .outerjoin(AccessPolicy, AccessPolicy.id == UserAccess.access_policy_id)
+        .where(
+            UserAccess.user_id == user_id,
+            UserAccess.model_id == model_id,
+            UserAccess.access_granted == True
+        )
+    )
+    return result.first()
+
+
+@tracing.traced()
+async def update_user_access(session: AsyncSession, user_access: UserAccess, n_calls: int = 1):
+    user_access.api_calls += n_calls
     user_access.last_accessed = func.now() # datetime.utcnow()
     await session.commit()
+
+
+def access_counter_update(user_id: UUID, model_id: int, n_calls: int):
+    return (
+        update(UserAccess)
+        .where(
+            UserAccess.user_id == user_id,
+            UserAccess.model_id == model_id,
+            UserAccess.access_granted == True
+        )
+        .values(api_calls=UserAccess.api_calls + n_calls, last_accessed=func.now())
+        .execution_options(**metadata.METADATA_UNCHANGED)
+    )
+
+
+@tracing.traced()
+async def record_service_call(
+    session: AsyncSession,
+    model_id: int,
+    user_id: UUID,
+    celery_task_id: str | None = None,
+    time_completed: datetime | None = None,
+    n_inputs: int = 1
+) -> int:
+    """
+    Count the call on the access record and insert its ServiceCall in a single
+    transaction, with one commit and no refresh. Returns the new ServiceCall id.
+    Call it after `check_user_access`, before enqueueing the task.
+    """
+    await session.execute(access_counter_update(user_id, model_id, n_inputs))
+    result = await session.execute(
+        insert(ServiceCall)
+        .values(
+            model_id=model_id,
+            user_id=user_id,
+            celery_task_id=celery_task_id,
+            time_completed=time_completed,
+            n_inputs=n_inputs
+        )
+        .returning(ServiceCall.id)
+    )
+    service_call_id = result.scalar_one()
+    await session.commit()
+    return service_call_id
     
     
-    
-async def check_user_access_and_update(
-    session: AsyncSession, user_id: UUID, model_id: int
+@metrics.timed("quota_check")
+async def check_user_access(
+    session: AsyncSession, user_id: UUID, model_id: int, n_calls: int = 1
 ) -> tuple[bool, str]:
-    user_access = await get_user_access(session, user_id, model_id)
+    """
+    Check the access grant and the daily / monthly limits without writing to the
+    database. `n_calls` is the number of rows the request scores: a batch is
+    accounted against the limits in one go.
+    With Redis counters, a granted check has already counted `n_calls` there.
+    """
+    use_counters = settings.QUOTA_BACKEND == "redis"
+    # Grant and limits come from the metadata cache once read, with the usage the first time
+    key = metadata.quota_limits_key(user_id, model_id)
+    limits = metadata.metadata_cache.get(key)
+    usage = None
+    if limits is None:
+        version = metadata.metadata_cache.version
+        quota = await get_quota_status(session, user_id, model_id, with_usage=not use_counters)
+        limits = metadata.MISSING
+        if quota:
+            limits = {
+                "daily_api_calls": quota.daily_api_calls,
+                "monthly_api_calls": quota.monthly_api_calls,
+            }
+            if not use_counters:
+                usage = quota.daily_calls, quota.monthly_calls
+        metadata.metadata_cache.set(key, limits, version)
     
-    if not user_access:
+    if not limits:
         return False, "User does not have access to this model"
     
-    access_policy = await get_access_policy(session, user_access.access_policy_id)
-    
-    if not access_policy:
+    if limits["daily_api_calls"] is None:
         return False, "Access policy not found"
+    daily_limit, monthly_limit = limits["daily_api_calls"], limits["monthly_api_calls"]
+    
+    status = None
+    if use_counters:
+        status = await quota_counters.consume(
+            user_id,
+            model_id,
+            n_calls,
+            daily_limit,
+            monthly_limit,
+            load_usage=functools.partial(get_usage, session, user_id, model_id),
+        )
+    if status is None:
+        # Without Redis counters, or Redis unavailable: the database is the source of truth
+        daily_calls, monthly_calls = usage or await get_usage(session, user_id, model_id)
+        status = quota_counters.evaluate(
+            daily_calls, monthly_calls, n_calls, daily_limit, monthly_limit
+        )
     
-    if not await check_daily_limit(session, user_id, model_id, access_policy):
+    if status == quota_counters.DAILY_EXCEEDED:
         return False, "Daily API call limit exceeded"
     
-    if not await check_monthly_limit(session, user_id, model_id, access_policy):
+    if status == quota_counters.MONTHLY_EXCEEDED:
         return False, "Monthly API call limit exceeded"
     
-    await update_user_access(session, user_access)
-    
     return True, "Access granted"
 
 
+@tracing.traced()
+async def check_user_access_and_update(
+    session: AsyncSession, user_id: UUID, model_id: int, n_calls: int = 1
+) -> tuple[bool, str]:
+    """`check_user_access`, then count the granted calls on the access record."""
+    has_access, message = await check_user_access(session, user_id, model_id, n_calls)
+    if has_access:
+        await session.execute(access_counter_update(user_id, model_id, n_calls))
+        await session.commit()
+    return has_access, message
+
+
+async def refund_user_access(user_id: UUID, model_id: int, n_calls: int = 1):
+    """
+    Give back calls granted by `check_user_access` which were then neither recorded
+    nor enqueued. Only Redis counters count calls at check time.
+    """
+    if settings.QUOTA_BACKEND == "redis":
+        await quota_counters.refund(user_id, model_id, n_calls)
+
+
+@tracing.traced()
+async def withdraw_service_calls(
+    session: AsyncSession, task_ids: list[str], commit: bool = True
+) -> int:
+    """
+    Delete the service calls of tasks which could not be enqueued and uncount them
+    from their access records. Returns the number of calls withdrawn.
+    """
+    result = await session.execute(
+        delete(ServiceCall)
+        .where(ServiceCall.celery_task_id.in_(task_ids))
+        .returning(ServiceCall.user_id, ServiceCall.model_id, ServiceCall.n_inputs)
+        .execution_options(synchronize_session=False)
+    )
+    withdrawn = result.all()
+    calls = Counter()
+    for user_id, model_id, n_inputs in withdrawn:
+        calls[(user_id, model_id)] += n_inputs
+    for (user_id, model_id), n_calls in calls.items():
+        await session.execute(access_counter_update(user_id, model_id, -n_calls))
+    if commit:
+        await session.commit()
+    return len(withdrawn)
+
+
 
@@ -0,0 +1,128 @@
+import asyncio
+import contextvars
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from pydantic import ValidationError
+
+from project import metrics
+from project.config import settings
+from project.inference.batching import MicroBatcher
+from project.inference.model_pool import model_pool, predict_batch
+from project.inference.model_registry import model_registry
+
+logger = logging.getLogger(__name__)
+
+
+def predict_inline(model_id: int, input_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate and predict with the warm instance, runs in an executor thread."""
+    model = model_pool.get(model_id)
+    input_obj = model.Input(**input_data)
+    with metrics.timer("predict", model_id):
+        return model.predict(input_obj).dict()
+
+
+def predict_inline_batch(model_id: int, inputs: List[Dict[str, Any]]) -> List[Any]:
+    """
+    Batched counterpart of `predict_inline`: one outcome per input, either its
+    result or its ValidationError, so an invalid input only fails its own request.
+    """
+    model = model_pool.get(model_id)
+    outcomes: List[Any] = [None] * len(inputs)
+    valid = []
+    for index, input_data in enumerate(inputs):
+        try:
+            valid.append((index, model.Input(**input_data)))
+        except ValidationError as e:
+            outcomes[index] = e
+    if not valid:
+        return outcomes
+
+    with metrics.timer("predict", model_id):
+        results = predict_batch(model, [input_obj for _, input_obj in valid])
+    for (index, _), result in zip(valid, results):
+        outcomes[index] = result.dict()
+    return outcomes
+
+
+class InlineRunner:
+    """
+    Runs inline-capable models inside the API process, on a bounded thread pool
+    so predictions never block the event loop.
+
+    `run` returns None instead of queueing when the runner is saturated: the caller
+    then falls back to Celery.
+    Models registered with `max_batch_size > 1` go through a `MicroBatcher`:
+    concurrent requests share one executor slot and one vectorized predict.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="inline-inference"
+        )
+        # Only touched from the event loop thread, no lock needed.
+        # Requests accepted by `run`, waiting in a batcher, on the executor or predicting
+        self._in_flight = 0
+        # Jobs submitted to the executor, a batch counting as one
+        self._executing = 0
+        self._batchers: Dict[int, MicroBatcher] = {}
+
+    def saturated(self, model_id: int) -> bool:
+        """
+        Every executor thread is busy, or enough requests are accepted to fill one
+        batch of the model per thread: a new request would only wait in a queue.
+        """
+        batch_size = max(1, model_registry[model_id].get("max_batch_size", 1))
+        return (
+            self._executing >= self.max_concurrency
+            or self._in_flight >= self.max_concurrency * batch_size
+        )
+
+    async def _execute(self, func: Callable, *args) -> Any:
+        self._executing += 1
+        try:
+            loop = asyncio.get_running_loop()
+            # In the context of the request, as asyncio.to_thread does, so its trace continues
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(self._executor, context.run, func, *args)
+        finally:
+            self._executing -= 1
+
+    def _get_batcher(self, model_id: int) -> Optional[MicroBatcher]:
+        model_info = model_registry[model_id]
+        max_batch_size = model_info.get("max_batch_size", 1)
+        if max_batch_size <= 1:
+            return None
+
+        max_wait_ms = model_info.get("max_batch_wait_ms", 0.0)
+        batcher = self._batchers.get(model_id)
+        if batcher is None or (batcher.max_batch_size, batcher.max_wait_ms) != (
+            max_batch_size,
+            max_wait_ms,
+        ):
+            batcher = MicroBatcher(
+                functools.partial(self._execute, predict_inline_batch, model_id),
+                max_batch_size=max_batch_size,
+                max_wait_ms=max_wait_ms,
+            )
+            self._batchers[model_id] = batcher
+        return batcher
+
+    async def run(self, model_id: int, input_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if self.saturated(model_id):
+            logger.info(f"Inline runner saturated, model {model_id} falls back to Celery")
+            return None
+        self._in_flight += 1
+        try:
+            batcher = self._get_batcher(model_id)
+            if batcher is not None:
+                return await batcher.submit(input_data)
+            return await self._execute(predict_inline, model_id, input_data)
+        finally:
+            self._in_flight -= 1
+
+
+inline_runner = InlineRunner(settings.INLINE_INFERENCE_MAX_CONCURRENCY)
@@ -0,0 +1,171 @@
+"""
+Cache of the metadata read on every prediction, in the API process: the access
+grant of a user for a model with the limits of its access policy, and inference
+models.
+
+These rows change rarely, through the crud helpers, the superuser routes or an
+admin. Any commit changing one of them bumps `METADATA_VERSION_KEY` in Redis and
+publishes the new version on `INVALIDATION_CHANNEL`, and each process drops its
+whole cache. Entries are tagged with the version they were read at, so a read
+racing with a change is never cached past it. Without Redis, entries still expire
+after `METADATA_CACHE_TTL` seconds.
+"""
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Hashable, Optional, Set
+from uuid import UUID
+
+import redis
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, attributes
+
+from project import redis_utils
+from project.config import settings
+from project.inference.models import AccessPolicy, InferenceModel, UserAccess
+from project.local_cache import LocalCache, invalidator
+
+logger = logging.getLogger(__name__)
+
+METADATA_VERSION_KEY = "metadata:version"
+INVALIDATION_CHANNEL = "metadata:invalidate"
+# Cached "no such row", distinct from a miss
+MISSING = {}
+
+# Statements updating UserAccess without changing the grant, e.g. the call counter
+METADATA_UNCHANGED = {"metadata_unchanged": True}
+GRANT_COLUMNS = ("access_granted", "access_policy_id")
+
+
+def row_dict(row: Any) -> Dict[str, Any]:
+    return {column.key: getattr(row, column.key) for column in row.__table__.columns}
+
+
+class MetadataCache:
+    def __init__(self, max_entries: int, ttl: float):
+        self._entries = LocalCache(max_entries, ttl)
+        self.version = 0
+
+    def get(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        """The cached value, `MISSING` for a row known not to exist, None on a miss."""
+        return self._entries.get(key)
+
+    def set(self, key: Hashable, value: Dict[str, Any], version: int):
+        """Cache `value`, read at `version`: dropped if the metadata changed since."""
+        if version == self.version:
+            self._entries.set(key, value)
+
+    async def read_through(self, key: Hashable, load: Callable) -> Optional[Dict[str, Any]]:
+        cached = self.get(key)
+        if cached is None:
+            version = self.version
+            row = await load()
+            cached = MISSING if row is None else row_dict(row)
+            self.set(key, cached, version)
+        return cached or None
+
+    def invalidate(self, version: Optional[int] = None):
+        self.version = max(self.version + 1, version or 0)
+        self._entries.clear()
+
+    def clear(self):
+        self._entries.clear()
+
+
+metadata_cache = MetadataCache(settings.METADATA_CACHE_MAX_ENTRIES, settings.METADATA_CACHE_TTL)
+
+
+def quota_limits_key(user_id: UUID, model_id: int) -> Hashable:
+    """Key of the grant of a user for a model, with the limits of its access policy."""
+    return ("quota_limits", user_id, model_id)
+
+
+async def get_inference_model(session: AsyncSession, model_id: int) -> Optional[Dict[str, Any]]:
+    return await metadata_cache.read_through(
+        ("inference_model", model_id),
+        lambda: session.scalar(select(InferenceModel).where(InferenceModel.id == model_id)),
+    )
+
+
+def publish_invalidation():
+    """Drop the metadata cached by every process, this one first."""
+    try:
+        version = redis_utils.redis_client.incr(METADATA_VERSION_KEY)
+    except redis.RedisError as e:
+        logger.warning(f"Could not bump the metadata version: {e}")
+        metadata_cache.invalidate()
+        return
+    metadata_cache.invalidate(version)
+    invalidator.publish(INVALIDATION_CHANNEL, str(version))
+
+
+async def apublish_invalidation():
+    """`publish_invalidation` from the event loop, with the async client."""
+    try:
+        version = await redis_utils.async_redis_client.incr(METADATA_VERSION_KEY)
+    except redis.RedisError as e:
+        logger.warning(f"Could not bump the metadata version: {e}")
+        metadata_cache.invalidate()
+        return
+    metadata_cache.invalidate(version)
+    await invalidator.apublish(INVALIDATION_CHANNEL, str(version))
+
+
+# Publications scheduled from commits on the event loop, referenced until done
+_publications: Set[asyncio.Task] = set()
+
+
+invalidator.register(INVALIDATION_CHANNEL, lambda version: metadata_cache.invalidate(int(version)))
+
+
+def _changes_metadata(instance: Any) -> bool:
+    if isinstance(instance, (AccessPolicy, InferenceModel)):
+        return True
+    if isinstance(instance, UserAccess):
+        return any(
+            attributes.get_history(instance, column).has_changes() for column in GRANT_COLUMNS
+        )
+    return False
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flushed_metadata(session: Session, flush_context):
+    changed = [*session.new, *session.deleted]
+    metadata_types = (AccessPolicy, InferenceModel, UserAccess)
+    if any(isinstance(instance, metadata_types) for instance in changed) \
+            or any(_changes_metadata(instance) for instance in session.dirty):
+        session.info["metadata_changed"] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_bulk_metadata(orm_execute_state):
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    if orm_execute_state.execution_options.get("metadata_unchanged"):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and mapper.class_ in (AccessPolicy, InferenceModel, UserAccess):
+        orm_execute_state.session.info["metadata_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed_metadata(session: Session):
+    if not session.info.pop("metadata_changed", False):
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # Sync session outside of an event loop, e.g. the admin or a worker
+        publish_invalidation()
+        return
+    # AsyncSession commit, on the event loop: this process drops its cache now,
+    # the other ones once the publication, which must not block the loop, is sent
+    metadata_cache.invalidate()
+    publication = loop.create_task(apublish_invalidation())
+    _publications.add(publication)
+    publication.add_done_callback(_publications.discard)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_metadata_changes(session: Session):
+    session.info.pop("metadata_changed", None)
@@ -42,7 +42,17 @@ class TemperatureModel:
         X, y = self.Dataset.generate(self.np)
         self.model.fit(X, y)
 
+    @staticmethod
+    def _features(input_data: Input) -> list:
+        return [input_data.latitude, input_data.longitude, input_data.month, input_data.hour]
+
     def predict(self, input_data: Input) -> Output:
-        X_new = self.np.array([[input_data.latitude, input_data.longitude, input_data.month, input_data.hour]])
+        X_new = self.np.array([self._features(input_data)])
         temperature = self.model.predict(X_new)[0]
-        return self.Output(temperature=temperature)
\ No newline at end of file
+        return self.Output(temperature=temperature)
+
+    def predict_batch(self, inputs: List[Input]) -> List[Output]:
+        # One 2-D array and a single predict call for the whole batch
+        X_new = self.np.array([self._features(input_data) for input_data in inputs])
+        temperatures = self.model.predict(X_new)
+        return [self.Output(temperature=temperature) for temperature in temperatures]
\ No newline at end of file
@@ -0,0 +1,101 @@
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from project import metrics
+from project.inference.model_registry import model_registry
+
+logger = logging.getLogger(__name__)
+
+
+class ModelPool:
+    """
+    Process-resident pool of warm model instances.
+
+    Each registered model is built (loaded / fitted) once by calling its registry
+    `func`, then kept for the lifetime of the process. Entries remember the registry
+    version they were built from: when the registry entry changes, the next `get`
+    rebuilds the instance.
+    """
+
+    def __init__(self, registry: Dict[int, Dict[str, Any]]):
+        self._registry = registry
+        self._instances: Dict[int, Tuple[tuple, Any]] = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _fingerprint(model_info: Dict[str, Any]) -> tuple:
+        return (model_info["version"], model_info["func"])
+
+    def get(self, model_id: int) -> Any:
+        """
+        Return the warm instance for `model_id`, building it on first use.
+        Raises KeyError if the model is not registered.
+        """
+        model_info = self._registry[model_id]
+        fingerprint = self._fingerprint(model_info)
+
+        entry = self._instances.get(model_id)
+        if entry is not None and entry[0] == fingerprint:
+            return entry[1]
+
+        with self._lock:
+            # Another thread may have built the instance while we were waiting
+            entry = self._instances.get(model_id)
+            if entry is not None and entry[0] == fingerprint:
+                return entry[1]
+            if entry is not None:
+                logger.info(
+                    f"Registry entry for model {model_id} changed "
+                    f"(version {entry[0][0]} -> {fingerprint[0]}), reloading"
+                )
+            return self._load(model_id, model_info, fingerprint)
+
+    def _load(self, model_id: int, model_info: Dict[str, Any], fingerprint: tuple) -> Any:
+        logger.info(f"Loading model {model_id} ({model_info['name']} {model_info['version']})")
+        with metrics.timer("model_load", model_id):
+            instance = model_info["func"]()
+        self._instances[model_id] = (fingerprint, instance)
+        return instance
+
+    def reload(self, model_id: int) -> Any:
+        """Drop the current instance of `model_id` and build a fresh one."""
+        with self._lock:
+            self.evict(model_id)
+            return self.get(model_id)
+
+    def evict(self, model_id: int) -> bool:
+        """Drop the instance of `model_id`, returns True if one was loaded."""
+        with self._lock:
+            return self._instances.pop(model_id, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._instances.clear()
+
+    def warm_up(self, model_ids: Optional[Iterable[int]] = None):
+        """Build every registered model (or only `model_ids`) ahead of the first task."""
+        for model_id in list(model_ids if model_ids is not None else self._registry):
+            try:
+                self.get(model_id)
+            except Exception as e:
+                logger.error(f"Failed to warm up model {model_id}: {e}")
+
+    def loaded_versions(self) -> Dict[int, str]:
+        return {model_id: entry[0][0] for model_id, entry in self._instances.items()}
+
+    def __contains__(self, model_id: int) -> bool:
+        return model_id in self._instances
+
+
+def predict_batch(model: Any, input_objs: List[Any]) -> List[Any]:
+    """
+    Score several validated inputs at once. Models exposing `predict_batch` get the
+    whole list (one vectorized call), others are called row by row.
+    """
+    if hasattr(model, "predict_batch"):
+        return model.predict_batch(input_objs)
+    return [model.predict(input_obj) for input_obj in input_objs]
+
+
+model_pool = ModelPool(model_registry)
@@ -1,4 +1,4 @@
-from typing import Callable, Dict, Any
+from typing import Any, Callable, Dict, Optional
 
 # Define a type for model functions
 ModelFunction = Callable[..., list]
@@ -7,8 +7,26 @@ ModelFunction = Callable[..., list]
 model_registry: Dict[int, Dict[str, Any]] = {}
 
 def register_model(
-    index: int,name: str, problem: str, category: str, version: str, access_policy_id: int
+    index: int,
+    name: str,
+    problem: str,
+    category: str,
+    version: str,
+    access_policy_id: int,
+    inline: bool = False,
+    max_batch_size: int = 1,
+    max_batch_wait_ms: float = 0.0,
+    cache_ttl: Optional[int] = None,
 ):
+    """
+    `inline`: the model is cheap enough to be run inside the API process
+    (`/inference/predict-sync`) instead of going through Celery.
+    `max_batch_size` / `max_batch_wait_ms`: concurrent inline predictions are
+    grouped into one `predict_batch` call of up to `max_batch_size` inputs,
+    waiting at most `max_batch_wait_ms` for the batch to fill (1 disables batching).
+    `cache_ttl`: seconds results are cached for, `CACHE_EXPIRATION_TIME` when None
+    and not cached at all when 0.
+    """
     def decorator(func: ModelFunction):
         model_registry[index] = {
             "func": func,
@@ -16,7 +34,11 @@ def register_model(
             "problem": problem,
             "category": category,
             "version": version,
-            "access_policy_id": access_policy_id
+            "access_policy_id": access_policy_id,
+            "inline": inline,
+            "max_batch_size": max_batch_size,
+            "max_batch_wait_ms": max_batch_wait_ms,
+            "cache_ttl": cache_ttl,
         }
         return func
     return decorator
@@ -57,7 +79,10 @@ from project.inference.ml_models.tempertaure_predictor import TemperatureModel
     problem="regression",
     category="temperature",
     version="1.0.0",
-    access_policy_id=1
+    access_policy_id=1,
+    inline=True,
+    max_batch_size=32,
+    max_batch_wait_ms=1.0
 )
 def temperature_model_func():
     model = TemperatureModel()
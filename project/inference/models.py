@@ -3,11 +3,16 @@ from sqlalchemy import (
     Boolean, 
     DateTime, 
     ForeignKey, 
+    Index,
     Integer, 
+    PrimaryKeyConstraint,
     String,
     text,
-    UUID
+    UUID,
+    Uuid
 )
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.sql import func
 
@@ -61,9 +66,47 @@ class ServiceCall(Base):
     """Represents a service call made by a user."""
     
     __tablename__ = "service_call"
-    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    __table_args__ = (
+        # Quota checks: range scan per (user, model), n_inputs included for index-only SUM
+        Index(
+            "ix_service_call_user_model_time",
+            "user_id",
+            "model_id",
+            "time_requested",
+            postgresql_include=["n_inputs"],
+        ),
+        # Partition key included, as on the table partitioned by project/inference/partitions.py
+        PrimaryKeyConstraint("id", "time_requested"),
+    )
+    # id alone identifies a row, SERIAL on Postgres: numbered by service_call_id_seq
+    __mapper_args__ = {"primary_key": ["id"]}
+
+    id: Mapped[int] = mapped_column(Integer, autoincrement=True, index=True)
     model_id: Mapped[int] = mapped_column(Integer, ForeignKey("inference_model.id"))
     user_id: Mapped[UUID] = mapped_column(UUID, ForeignKey("user.id"))  # Ensure this is also UUID
     time_requested: Mapped[DateTime] = mapped_column(DateTime(timezone=True), server_default=text('CURRENT_TIMESTAMP'))
     time_completed: Mapped[DateTime] = mapped_column(DateTime(timezone=True), nullable=True)
-    celery_task_id: Mapped[str] = mapped_column(String, nullable=True)
\ No newline at end of file
+    # Native uuid on Postgres, unique index: completion updates look rows up by task id.
+    # Only a plain index once partitioned, see project/inference/partitions.py
+    celery_task_id: Mapped[str] = mapped_column(
+        Uuid(as_uuid=False), nullable=True, unique=True, index=True
+    )
+    # Rows scored by the call, counted against the quota
+    n_inputs: Mapped[int] = mapped_column(Integer, default=1, server_default="1", nullable=False)
+
+
+# SQLite (tests) has no partitions, and only numbers rows of a single INTEGER PRIMARY KEY
+@compiles(PrimaryKeyConstraint, "sqlite")
+def _sqlite_primary_key(constraint, compiler, **kw):
+    if constraint.table.name == ServiceCall.__tablename__:
+        return "PRIMARY KEY (id)"
+    return compiler.visit_primary_key_constraint(constraint, **kw)
+
+
+@compiles(CreateColumn, "sqlite")
+def _sqlite_column(create, compiler, **kw):
+    column = create.element
+    if column.table.name == ServiceCall.__tablename__ and column.name == "id":
+        # Not the composite primary key SQLite refuses to autoincrement
+        return "id INTEGER NOT NULL"
+    return compiler.visit_create_column(create, **kw)
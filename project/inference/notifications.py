@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+import redis
+from celery import states
+from celery.result import AsyncResult
+from starlette.concurrency import run_in_threadpool
+
+from project import redis_utils
+
+logger = logging.getLogger(__name__)
+
+RESULT_CHANNEL_PREFIX = "inference:results"
+
+
+def result_channel(task_id: str) -> str:
+    return f"{RESULT_CHANNEL_PREFIX}:{task_id}"
+
+
+def task_payload(
+    task_id: str, state: str, result: Any = None, error: Optional[str] = None
+) -> Dict[str, Any]:
+    """Same shape as the `task_status` response, plus the task id."""
+    if state == states.FAILURE:
+        return {"task_id": task_id, "state": state, "error": error}
+    return {"task_id": task_id, "state": state, "result": result}
+
+
+def publish_result(task_id: str, state: str, result: Any = None, error: Optional[str] = None):
+    """Worker side: notify the API processes waiting for this task, with the sync client."""
+    payload = task_payload(task_id, state, result, error)
+    try:
+        redis_utils.redis_client.publish(result_channel(task_id), json.dumps(payload, default=str))
+    except redis.RedisError as e:
+        # Waiting clients time out and fall back to task_status
+        logger.warning(f"Could not publish the result of task {task_id}: {e}")
+
+
+def ready_result(task_id: str) -> Optional[Dict[str, Any]]:
+    """The task payload if the result backend already has it, None while it runs."""
+    task = AsyncResult(task_id)
+    state = task.state
+    if state not in states.READY_STATES:
+        return None
+    if state == states.FAILURE:
+        return task_payload(task_id, state, error=str(task.result))
+    return task_payload(task_id, state, result=task.result)
+
+
+class ResultNotifier:
+    """
+    Fan-out of task result notifications inside one API process.
+
+    All waiting clients share a single pub/sub connection: a channel is subscribed
+    when its first waiter arrives and unsubscribed when its last waiter leaves, and
+    one listener task resolves the waiters of each published notification.
+    """
+
+    def __init__(self):
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+        self._waiters: Dict[str, Set[asyncio.Future]] = {}
+        self._subscriptions: Dict[str, asyncio.Future] = {}
+
+    @asynccontextmanager
+    async def subscribe(self, task_id: str) -> AsyncIterator[asyncio.Future]:
+        """Yields a future resolved with the payload published for `task_id`."""
+        channel = result_channel(task_id)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(channel, set()).add(future)
+        try:
+            subscription = self._subscriptions.get(channel)
+            if subscription is None:
+                subscription = asyncio.ensure_future(self._subscribe(channel))
+                self._subscriptions[channel] = subscription
+            try:
+                # Also awaited by later waiters: no notification can be missed once it is done
+                await asyncio.shield(subscription)
+            except redis.RedisError:
+                if self._subscriptions.get(channel) is subscription:
+                    del self._subscriptions[channel]
+                raise
+            yield future
+        finally:
+            waiters = self._waiters.get(channel, set())
+            waiters.discard(future)
+            if not waiters:
+                self._waiters.pop(channel, None)
+                self._subscriptions.pop(channel, None)
+                if self._pubsub is not None:
+                    try:
+                        await self._pubsub.unsubscribe(channel)
+                    except redis.RedisError as e:
+                        logger.warning(f"Could not unsubscribe from {channel}: {e}")
+
+    async def _subscribe(self, channel: str):
+        if self._pubsub is None:
+            self._pubsub = redis_utils.async_redis_client.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(channel)
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            try:
+                message = await self._pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=1.0
+                )
+            except redis.RedisError as e:
+                logger.error(f"Result notifications interrupted: {e}")
+                self._fail_waiters(e)
+                return
+            if message is None:
+                continue
+            channel = message["channel"].decode("utf-8")
+            payload = json.loads(message["data"])
+            for future in self._waiters.get(channel, ()):
+                if not future.done():
+                    future.set_result(payload)
+
+    def _fail_waiters(self, error: Exception):
+        for waiters in self._waiters.values():
+            for future in waiters:
+                if not future.done():
+                    future.set_exception(error)
+        # Subscribe again on a fresh connection next time
+        self._subscriptions.clear()
+        self._pubsub = None
+
+    async def wait(self, task_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        The payload of `task_id` as soon as it finishes, None after `timeout` seconds.
+        Tasks finished before the subscription are read from the result backend.
+        """
+        try:
+            async with self.subscribe(task_id) as notification:
+                payload = await run_in_threadpool(ready_result, task_id)
+                if payload is not None:
+                    return payload
+                try:
+                    return await asyncio.wait_for(notification, timeout)
+                except asyncio.TimeoutError:
+                    return None
+        except redis.RedisError as e:
+            logger.warning(f"Result notifications unavailable for task {task_id}: {e}")
+            return await run_in_threadpool(ready_result, task_id)
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+
+result_notifier = ResultNotifier()
@@ -0,0 +1,218 @@
+"""
+Monthly range partitioning of `service_call` on `time_requested` (Postgres only).
+
+The ORM model has the primary key of the partitioned table, (id, time_requested), but
+Alembic creates a plain table from it. On Postgres, `partition_service_call` turns it
+into a partitioned one, from the revision:
+
+    from project.inference.partitions import partition_service_call
+
+    def upgrade():
+        ...
+        partition_service_call(op.get_bind())
+
+`maintain_partitions` then runs daily from Celery beat: partitions are created
+`months_ahead` in advance and those older than `retention_months` are dropped, or
+detached and renamed `service_call_archive_YYYY_MM` to be dumped elsewhere.
+Quota queries filter on `time_requested >= start of day / month`, so Postgres only
+scans the current partition.
+
+Rows outside every monthly partition (beat stopped for longer than `months_ahead`,
+a skewed clock) land in the DEFAULT partition `service_call_default` instead of
+failing the insert. Creating the partition of their month moves them out of it,
+and `maintain_partitions` logs a warning while rows remain there, e.g. older than
+the retention, which never expire.
+
+Unique constraints of a partitioned table must include the partition key, and a
+unique (celery_task_id, time_requested) would reject next to nothing, so the unique
+index on celery_task_id becomes a plain one: the database no longer rejects a
+duplicate task id. The service call writer looks up the task ids of a batch before
+inserting it, which covers retried events.
+"""
+import logging
+import re
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+logger = logging.getLogger(__name__)
+
+TABLE = "service_call"
+DEFAULT_PARTITION = f"{TABLE}_default"
+PARTITION_NAME = re.compile(rf"^{TABLE}_(\d{{4}})_(\d{{2}})$")
+
+
+def month_start(moment: datetime) -> datetime:
+    moment = moment.astimezone(timezone.utc)
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month: datetime, n_months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + n_months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"{TABLE}_{month:%Y_%m}"
+
+
+def archive_name(month: datetime) -> str:
+    return f"{TABLE}_archive_{month:%Y_%m}"
+
+
+def is_partitioned(connection: Connection) -> bool:
+    return connection.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p "
+        "JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :table)"
+    ), {"table": TABLE}).scalar()
+
+
+def existing_partitions(connection: Connection) -> Dict[datetime, str]:
+    """Month -> partition name, for the partitions currently attached to the table."""
+    names = connection.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = :table"
+    ), {"table": TABLE}).scalars()
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            month = datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc)
+            partitions[month] = name
+    return partitions
+
+
+def create_partition(connection: Connection, month: datetime, parent: str = TABLE):
+    """Create the partition of `month`, with the rows of that month in the DEFAULT partition."""
+    name = partition_name(month)
+    bounds = f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    in_month = {"start": month, "end": add_months(month, 1)}
+    stranded = 0
+    if connection.execute(text("SELECT to_regclass(:name)"), {"name": DEFAULT_PARTITION}).scalar():
+        stranded = connection.execute(text(
+            f"SELECT count(*) FROM {DEFAULT_PARTITION} "
+            f"WHERE time_requested >= :start AND time_requested < :end"
+        ), in_month).scalar()
+    if not stranded:
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {parent} {bounds}"
+        ))
+        return
+    # Postgres refuses a new partition while the DEFAULT one holds rows of its range
+    connection.execute(text(f"CREATE TABLE {name} (LIKE {parent} INCLUDING DEFAULTS)"))
+    connection.execute(text(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+        f"WHERE time_requested >= :start AND time_requested < :end RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    ), in_month)
+    connection.execute(text(f"ALTER TABLE {parent} ATTACH PARTITION {name} {bounds}"))
+    logger.warning(f"Moved {stranded} rows from {DEFAULT_PARTITION} to the new partition {name}")
+
+
+def count_default_rows(connection: Connection) -> int:
+    return connection.execute(text(f"SELECT count(*) FROM {DEFAULT_PARTITION}")).scalar()
+
+
+def expire_partition(connection: Connection, month: datetime, archive: bool):
+    name = partition_name(month)
+    if archive:
+        connection.execute(text(f"ALTER TABLE {TABLE} DETACH PARTITION {name}"))
+        connection.execute(text(f"ALTER TABLE {name} RENAME TO {archive_name(month)}"))
+    else:
+        connection.execute(text(f"DROP TABLE {name}"))
+
+
+def maintain_partitions(
+    connection: Connection,
+    months_ahead: int,
+    retention_months: int,
+    archive: bool = False,
+    now: Optional[datetime] = None,
+) -> Tuple[List[str], List[str]]:
+    """
+    Create the partitions from the current month to `months_ahead` months ahead, and
+    expire those entirely older than `retention_months`. Returns (created, expired)
+    names, nothing to do until the table has been partitioned.
+    """
+    if not is_partitioned(connection):
+        return [], []
+
+    current = month_start(now or datetime.now(timezone.utc))
+    partitions = existing_partitions(connection)
+
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        if month not in partitions:
+            create_partition(connection, month)
+            created.append(partition_name(month))
+
+    expired = []
+    oldest_kept = add_months(current, -retention_months)
+    for month, name in sorted(partitions.items()):
+        if month < oldest_kept:
+            expire_partition(connection, month, archive)
+            expired.append(name)
+
+    stranded = count_default_rows(connection)
+    if stranded:
+        logger.warning(
+            f"{stranded} rows of {TABLE} are outside every monthly partition, "
+            f"in {DEFAULT_PARTITION}: moved out once the partition of their month is created, "
+            f"never expired until then"
+        )
+    return created, expired
+
+
+def partition_service_call(
+    connection: Connection, months_ahead: int = 3, now: Optional[datetime] = None
+):
+    """
+    One-off migration of a plain `service_call` table to a partitioned one, rows included.
+
+    Partitioned tables need the partition key in every unique constraint: the primary
+    key is (id, time_requested), as on the ORM model, and the celery_task_id index is
+    no longer unique, it still serves lookups by task id.
+    """
+    if is_partitioned(connection):
+        logger.info(f"{TABLE} is already partitioned")
+        return
+
+    staging = f"{TABLE}_partitioned"
+    connection.execute(text(
+        f"CREATE TABLE {staging} (LIKE {TABLE} INCLUDING DEFAULTS) "
+        f"PARTITION BY RANGE (time_requested)"
+    ))
+
+    current = month_start(now or datetime.now(timezone.utc))
+    oldest = connection.execute(text(f"SELECT min(time_requested) FROM {TABLE}")).scalar()
+    month = month_start(oldest) if oldest is not None else current
+    while month <= add_months(current, months_ahead):
+        create_partition(connection, month, parent=staging)
+        month = add_months(month, 1)
+    connection.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {staging} DEFAULT"))
+
+    connection.execute(text(f"INSERT INTO {staging} SELECT * FROM {TABLE}"))
+    # The id sequence belongs to the old table and would be dropped with it
+    connection.execute(text(f"ALTER SEQUENCE {TABLE}_id_seq OWNED BY {staging}.id"))
+    connection.execute(text(f"DROP TABLE {TABLE}"))
+    connection.execute(text(f"ALTER TABLE {staging} RENAME TO {TABLE}"))
+
+    connection.execute(text(f"ALTER TABLE {TABLE} ADD PRIMARY KEY (id, time_requested)"))
+    connection.execute(text(
+        f"ALTER TABLE {TABLE} ADD FOREIGN KEY (model_id) REFERENCES inference_model (id)"
+    ))
+    connection.execute(text(
+        f'ALTER TABLE {TABLE} ADD FOREIGN KEY (user_id) REFERENCES "user" (id)'
+    ))
+    connection.execute(text(f"CREATE INDEX ix_{TABLE}_id ON {TABLE} (id)"))
+    connection.execute(text(
+        f"CREATE INDEX ix_{TABLE}_user_model_time ON {TABLE} "
+        f"(user_id, model_id, time_requested) INCLUDE (n_inputs)"
+    ))
+    connection.execute(text(f"CREATE INDEX ix_{TABLE}_celery_task_id ON {TABLE} (celery_task_id)"))
+    logger.info(f"{TABLE} partitioned by month on time_requested")
@@ -0,0 +1,174 @@
+import calendar
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Iterable, Optional, Tuple
+from uuid import UUID
+
+import redis
+
+from project import redis_utils
+
+logger = logging.getLogger(__name__)
+
+QUOTA_KEY_PREFIX = "quota"
+# Counters outlive their window a little so a late reconciliation never recreates them
+QUOTA_KEY_GRACE_SECONDS = 3600
+
+GRANTED = 0
+DAILY_EXCEEDED = 1
+MONTHLY_EXCEEDED = 2
+# Returned by the script when a counter is missing and must be seeded from the database
+COUNTERS_MISSING = -1
+
+# KEYS: daily counter, monthly counter
+# ARGV: calls requested, daily limit, monthly limit
+CONSUME_SCRIPT = """
+local daily = redis.call('GET', KEYS[1])
+local monthly = redis.call('GET', KEYS[2])
+if not daily or not monthly then
+    return -1
+end
+local n = tonumber(ARGV[1])
+if tonumber(daily) + n > tonumber(ARGV[2]) then
+    return 1
+end
+if tonumber(monthly) + n > tonumber(ARGV[3]) then
+    return 2
+end
+redis.call('INCRBY', KEYS[1], n)
+redis.call('INCRBY', KEYS[2], n)
+return 0
+"""
+
+# KEYS: counter
+# ARGV: usage recorded in the database, ttl in seconds
+# Raises the counter to the database value, never lowers it: increments made
+# while the database was being read are kept.
+SYNC_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '-1')
+local recorded = tonumber(ARGV[1])
+if recorded > current then
+    redis.call('SET', KEYS[1], recorded, 'EX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# KEYS: daily counter, monthly counter
+# ARGV: calls to give back
+# Only existing counters are lowered, never below 0: a missing one is seeded
+# from the database, where the refunded calls are not recorded.
+REFUND_SCRIPT = """
+for _, key in ipairs(KEYS) do
+    local current = tonumber(redis.call('GET', key) or '-1')
+    if current > 0 then
+        redis.call('DECRBY', key, math.min(current, tonumber(ARGV[1])))
+    end
+end
+return 0
+"""
+
+UsageLoader = Callable[[], Awaitable[Tuple[int, int]]]
+
+
+def quota_keys(user_id: UUID, model_id: int, now: Optional[datetime] = None) -> Tuple[str, str]:
+    now = now or datetime.now(timezone.utc)
+    base = f"{QUOTA_KEY_PREFIX}:{user_id}:{model_id}"
+    return f"{base}:d:{now:%Y%m%d}", f"{base}:m:{now:%Y%m}"
+
+
+def quota_ttls(now: Optional[datetime] = None) -> Tuple[int, int]:
+    """Seconds until the end of the current UTC day and month, plus grace."""
+    now = now or datetime.now(timezone.utc)
+    start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    end_of_day = start_of_day + timedelta(days=1)
+    days_in_month = calendar.monthrange(now.year, now.month)[1]
+    end_of_month = start_of_day.replace(day=1) + timedelta(days=days_in_month)
+    return (
+        int((end_of_day - now).total_seconds()) + QUOTA_KEY_GRACE_SECONDS,
+        int((end_of_month - now).total_seconds()) + QUOTA_KEY_GRACE_SECONDS,
+    )
+
+
+def evaluate(
+    daily_calls: int, monthly_calls: int, n_calls: int, daily_limit: int, monthly_limit: int
+) -> int:
+    """Same decision as CONSUME_SCRIPT, from usage read in the database."""
+    if daily_calls + n_calls > daily_limit:
+        return DAILY_EXCEEDED
+    if monthly_calls + n_calls > monthly_limit:
+        return MONTHLY_EXCEEDED
+    return GRANTED
+
+
+async def consume(
+    user_id: UUID,
+    model_id: int,
+    n_calls: int,
+    daily_limit: int,
+    monthly_limit: int,
+    load_usage: UsageLoader,
+) -> Optional[int]:
+    """
+    Atomically check the limits and count `n_calls` in the Redis counters.
+
+    Missing counters (first call of the day, Redis restart) are seeded from the
+    database through `load_usage` before retrying. Returns None when Redis is
+    unavailable: the caller then checks the database instead.
+    """
+    client = redis_utils.async_redis_client
+    daily_key, monthly_key = quota_keys(user_id, model_id)
+    try:
+        consume_counters = client.register_script(CONSUME_SCRIPT)
+        status = await consume_counters(
+            keys=[daily_key, monthly_key], args=[n_calls, daily_limit, monthly_limit]
+        )
+        if status != COUNTERS_MISSING:
+            return status
+
+        daily_calls, monthly_calls = await load_usage()
+        daily_ttl, monthly_ttl = quota_ttls()
+        sync_counter = client.register_script(SYNC_SCRIPT)
+        await sync_counter(keys=[daily_key], args=[daily_calls, daily_ttl])
+        await sync_counter(keys=[monthly_key], args=[monthly_calls, monthly_ttl])
+        return await consume_counters(
+            keys=[daily_key, monthly_key], args=[n_calls, daily_limit, monthly_limit]
+        )
+    except redis.RedisError as e:
+        logger.warning(f"Quota counters unavailable, falling back to the database: {e}")
+        return None
+
+
+async def refund(user_id: UUID, model_id: int, n_calls: int):
+    """
+    Give back `n_calls` counted by `consume` for calls which were never recorded
+    or enqueued. Redis errors are logged: the counter is then set right by the
+    next reconciliation, if it is lower than the recorded usage.
+    """
+    daily_key, monthly_key = quota_keys(user_id, model_id)
+    try:
+        refund_counters = redis_utils.async_redis_client.register_script(REFUND_SCRIPT)
+        await refund_counters(keys=[daily_key, monthly_key], args=[n_calls])
+    except redis.RedisError as e:
+        logger.warning(
+            f"Could not refund {n_calls} calls of user {user_id} on model {model_id}: {e}"
+        )
+
+
+def sync_counters(usage: Iterable[Tuple[UUID, int, int, int]], now: Optional[datetime] = None):
+    """
+    Rebuild counters from `(user_id, model_id, daily_calls, monthly_calls)` rows
+    aggregated from service_call. Used by the reconciliation task, with the sync client.
+    """
+    now = now or datetime.now(timezone.utc)
+    daily_ttl, monthly_ttl = quota_ttls(now)
+    sync_counter = redis_utils.redis_client.register_script(SYNC_SCRIPT)
+    pipeline = redis_utils.redis_client.pipeline(transaction=False)
+    n_rows = 0
+    for user_id, model_id, daily_calls, monthly_calls in usage:
+        daily_key, monthly_key = quota_keys(user_id, model_id, now)
+        sync_counter(keys=[daily_key], args=[daily_calls, daily_ttl], client=pipeline)
+        sync_counter(keys=[monthly_key], args=[monthly_calls, monthly_ttl], client=pipeline)
+        n_rows += 1
+    pipeline.execute()
+    return n_rows
@@ -1,6 +1,9 @@
 from pydantic import BaseModel, Field
 from uuid import UUID
 from datetime import datetime
+from typing import Any, Dict, List
+
+from project.config import settings
 
 
 ########## SERVICE ACCESS SCHEMAS ##########
@@ -33,4 +36,9 @@ class TemperatureModelInput(BaseModel):
     hour: int
 
 class TemperatureModelOutput(BaseModel):
-    temperature: float
\ No newline at end of file
+    temperature: float
+
+
+class BatchPredictionInput(BaseModel):
+    # Rows are validated against the model input schema by the view, see `validate_batch_inputs`
+    inputs: List[Dict[str, Any]] = Field(..., min_length=1, max_length=settings.BATCH_MAX_SIZE)
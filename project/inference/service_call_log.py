@@ -0,0 +1,410 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+from uuid import UUID
+
+import redis
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from project import metrics, redis_utils
+from project.config import settings
+from project.database import async_session_maker
+from project.inference import crud
+from project.inference.models import ServiceCall
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY = "service_call:events"
+# Events the writer gave up on, with their entry id, for inspection and replay
+DEAD_LETTER_STREAM_KEY = "service_call:dead"
+CONSUMER_GROUP = "service_call_writer"
+CREATED = "created"
+COMPLETED = "completed"
+WITHDRAWN = "withdrawn"
+# A completion or withdrawal whose creation is still not in the table after this long is dropped
+ORPHAN_MAX_AGE = timedelta(minutes=10)
+
+Entry = Tuple[bytes, Dict[bytes, bytes]]
+
+
+def buffered() -> bool:
+    return settings.SERVICE_CALL_WRITE_MODE == "buffered"
+
+
+def _event(kind: str, **fields: Any) -> Dict[str, str]:
+    return {"type": kind, "data": json.dumps(fields, default=str)}
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+def _entry_time(entry_id: bytes) -> datetime:
+    # Stream ids start with the millisecond timestamp of the XADD
+    milliseconds = int(entry_id.decode("utf-8").split("-")[0])
+    return datetime.fromtimestamp(milliseconds / 1000, timezone.utc)
+
+
+Creation = Tuple[bytes, Dict[str, Any]]
+# Task id -> (entry id, time completed)
+Completions = Dict[str, Tuple[bytes, str]]
+# Task id -> entry id
+Withdrawals = Dict[str, bytes]
+
+
+def _classify(entries: List[Entry]) -> Tuple[List[Creation], Completions, Withdrawals]:
+    """Split a batch into its creations, and its completions and withdrawals by task id."""
+    created: List[Creation] = []
+    completed: Completions = {}
+    withdrawn: Withdrawals = {}
+    for entry_id, fields in entries:
+        data = json.loads(fields[b"data"])
+        kind = fields[b"type"].decode("utf-8")
+        if kind == CREATED:
+            created.append((entry_id, data))
+        elif kind == WITHDRAWN:
+            withdrawn[data["celery_task_id"]] = entry_id
+        else:
+            completed[data["celery_task_id"]] = (entry_id, data["time_completed"])
+    return created, completed, withdrawn
+
+
+async def _existing_task_ids(session: AsyncSession, task_ids: Set[str]) -> Set[str]:
+    if not task_ids:
+        return set()
+    result = await session.scalars(
+        select(ServiceCall.celery_task_id).where(ServiceCall.celery_task_id.in_(task_ids))
+    )
+    return set(result.all())
+
+
+def _creation_rows(
+    created: List[Creation], completed: Completions, withdrawn: Withdrawals, existing: Set[str]
+) -> Tuple[List[Dict[str, Any]], List[bytes]]:
+    """
+    Rows to insert for the creations of a batch, and the entries they settle.
+    Creations already in the table or in the batch are skipped. The completion or
+    withdrawal of a creation of the same batch is applied to it and popped from
+    `completed` / `withdrawn`.
+    """
+    rows = []
+    acknowledged = []
+    batch_task_ids = set()
+    for entry_id, data in created:
+        acknowledged.append(entry_id)
+        task_id = data["celery_task_id"]
+        if task_id in existing or task_id in batch_task_ids:
+            # Redelivered after its batch was committed, or twice in this batch
+            continue
+        if task_id:
+            batch_task_ids.add(task_id)
+        if task_id in withdrawn:
+            # Never enqueued: neither written nor counted
+            acknowledged.append(withdrawn.pop(task_id))
+            continue
+        time_completed = data["time_completed"]
+        if task_id in completed:
+            # Completed before being written: insert it complete
+            completion_id, time_completed = completed.pop(task_id)
+            acknowledged.append(completion_id)
+        rows.append({
+            "model_id": data["model_id"],
+            "user_id": UUID(data["user_id"]),
+            "celery_task_id": task_id,
+            "time_requested": _parse_time(data["time_requested"]),
+            "time_completed": _parse_time(time_completed),
+            "n_inputs": data["n_inputs"],
+        })
+    return rows, acknowledged
+
+
+def _settle(
+    kind: str, events: Dict[str, bytes], existing: Set[str]
+) -> Tuple[List[str], List[bytes]]:
+    """
+    Task ids of the completions / withdrawals to apply, those whose service call is
+    in the table, and the entries settled. The others are dropped after
+    `ORPHAN_MAX_AGE`, until then their creation may still be in flight with another
+    writer: left pending, they are claimed again after `claim_idle_ms`.
+    """
+    now = datetime.now(timezone.utc)
+    task_ids = []
+    acknowledged = []
+    for task_id, entry_id in events.items():
+        if task_id in existing:
+            task_ids.append(task_id)
+            acknowledged.append(entry_id)
+        elif now - _entry_time(entry_id) > ORPHAN_MAX_AGE:
+            logger.warning(f"Dropping {kind} of task {task_id}: no service call recorded")
+            acknowledged.append(entry_id)
+    return task_ids, acknowledged
+
+
+async def _persist(
+    session: AsyncSession,
+    rows: List[Dict[str, Any]],
+    updates: List[Tuple[str, datetime]],
+    withdrawals: List[str],
+):
+    """Insert, count, withdraw and complete service calls in one transaction."""
+    if rows:
+        await session.execute(insert(ServiceCall), rows)
+        calls = Counter()
+        for row in rows:
+            calls[(row["user_id"], row["model_id"])] += row["n_inputs"]
+        for (user_id, model_id), n_calls in calls.items():
+            await session.execute(crud.access_counter_update(user_id, model_id, n_calls))
+    if withdrawals:
+        await crud.withdraw_service_calls(session, withdrawals, commit=False)
+    if updates:
+        # Commits the transaction
+        await crud.update_service_calls_time_completed(session, updates)
+    else:
+        await session.commit()
+
+
+@metrics.timed("service_call_insert")
+async def record_service_call(
+    session: AsyncSession,
+    model_id: int,
+    user_id: UUID,
+    celery_task_id: str | None = None,
+    time_completed: datetime | None = None,
+    n_inputs: int = 1
+) -> Optional[int]:
+    """
+    Record a granted call, following `SERVICE_CALL_WRITE_MODE`.
+
+    "sync" writes the access counter and the ServiceCall row now, see
+    `crud.record_service_call`. "buffered" appends a creation event to the stream
+    for the `ServiceCallWriter` and returns None, the row id is not known yet.
+    If the stream is unavailable, the call is written synchronously.
+    """
+    if buffered():
+        event = _event(
+            CREATED,
+            model_id=model_id,
+            user_id=user_id,
+            celery_task_id=celery_task_id,
+            time_requested=datetime.now(timezone.utc).isoformat(),
+            time_completed=time_completed.isoformat() if time_completed else None,
+            n_inputs=n_inputs,
+        )
+        try:
+            await redis_utils.async_redis_client.xadd(STREAM_KEY, event)
+            return None
+        except redis.RedisError as e:
+            logger.warning(f"Service call stream unavailable, writing synchronously: {e}")
+    return await crud.record_service_call(
+        session, model_id, user_id,
+        celery_task_id=celery_task_id, time_completed=time_completed, n_inputs=n_inputs
+    )
+
+
+async def withdraw_service_call(session: AsyncSession, celery_task_id: str):
+    """
+    Undo `record_service_call` for a task which could not be enqueued: the call no
+    longer counts towards the quota recorded in the database. "buffered" appends a
+    withdrawal event, applied by the `ServiceCallWriter` once the creation is written.
+    """
+    if buffered():
+        try:
+            await redis_utils.async_redis_client.xadd(
+                STREAM_KEY, _event(WITHDRAWN, celery_task_id=celery_task_id)
+            )
+            return
+        except redis.RedisError as e:
+            logger.warning(f"Service call stream unavailable, withdrawing synchronously: {e}")
+    await crud.withdraw_service_calls(session, [celery_task_id])
+
+
+def record_completion(task_id: str, time_completed: datetime):
+    """Worker side: append a completion event, with the sync client."""
+    redis_utils.redis_client.xadd(
+        STREAM_KEY,
+        _event(COMPLETED, celery_task_id=task_id, time_completed=time_completed.isoformat()),
+    )
+
+
+class ServiceCallWriter:
+    """
+    Drains the service-call event stream into the database in bulk.
+
+    A batch is written once `max_rows` events are read, or `interval_ms` after the
+    first read: one multi-row INSERT for the creations, one access counter UPDATE per
+    user / model pair, one executemany UPDATE for the completions and one DELETE for
+    the withdrawals, in a single transaction. Events are acknowledged only after the
+    commit. Events left pending by a writer that died, or whose write failed, are
+    claimed again after `claim_idle_ms`, so delivery is at-least-once. Creations
+    carrying a task id are deduplicated within the batch and against the table. Calls
+    served without a task (cache hits, inline) can be counted twice if a writer dies
+    between the commit and the acknowledgement.
+
+    A batch rejected by the database (e.g. an event referencing a deleted user) is
+    written again event by event, so only the offending events stay pending. Events
+    claimed `max_deliveries` times are moved to `DEAD_LETTER_STREAM_KEY`.
+    """
+
+    def __init__(
+        self,
+        max_rows: int,
+        interval_ms: int,
+        claim_idle_ms: int = 60000,
+        consumer: Optional[str] = None,
+        max_deliveries: int = 5,
+    ):
+        self.max_rows = max_rows
+        self.interval_ms = interval_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.max_deliveries = max_deliveries
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self._stopping = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def ensure_group(self):
+        try:
+            await redis_utils.async_redis_client.xgroup_create(
+                STREAM_KEY, CONSUMER_GROUP, id="0", mkstream=True
+            )
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def read_batch(self) -> List[Entry]:
+        client = redis_utils.async_redis_client
+        # Pending events of dead writers and failed writes go first
+        claimed = await client.xautoclaim(
+            STREAM_KEY, CONSUMER_GROUP, self.consumer,
+            min_idle_time=self.claim_idle_ms, count=self.max_rows
+        )
+        entries = await self.dead_letter([entry for entry in claimed[1] if entry[1]])
+        if entries:
+            return entries
+
+        deadline = time.monotonic() + self.interval_ms / 1000
+        while len(entries) < self.max_rows and not self._stopping.is_set():
+            remaining_ms = int((deadline - time.monotonic()) * 1000)
+            if remaining_ms <= 0:
+                break
+            response = await client.xreadgroup(
+                CONSUMER_GROUP, self.consumer, {STREAM_KEY: ">"},
+                count=self.max_rows - len(entries), block=remaining_ms
+            )
+            if response:
+                entries.extend(response[0][1])
+        return entries
+
+    async def dead_letter(self, entries: List[Entry]) -> List[Entry]:
+        """
+        Move the claimed entries delivered `max_deliveries` times to the dead-letter
+        stream, returns the others.
+        """
+        if not entries:
+            return entries
+        client = redis_utils.async_redis_client
+        pipeline = client.pipeline(transaction=False)
+        for entry_id, _ in entries:
+            pipeline.xpending_range(
+                STREAM_KEY, CONSUMER_GROUP, min=entry_id, max=entry_id, count=1
+            )
+        deliveries = [
+            pending[0]["times_delivered"] if pending else 0 for pending in await pipeline.execute()
+        ]
+
+        retried = []
+        for (entry_id, fields), times_delivered in zip(entries, deliveries):
+            if times_delivered < self.max_deliveries:
+                retried.append((entry_id, fields))
+                continue
+            logger.error(
+                f"Service call event {entry_id.decode('utf-8')} failed "
+                f"{times_delivered} deliveries, "
+                f"moved to {DEAD_LETTER_STREAM_KEY}"
+            )
+            await client.xadd(DEAD_LETTER_STREAM_KEY, {**fields, b"entry_id": entry_id})
+            await client.xack(STREAM_KEY, CONSUMER_GROUP, entry_id)
+        return retried
+
+    async def write(self, session: AsyncSession, entries: List[Entry]) -> List[bytes]:
+        """Write a batch in one transaction, returns the ids of the entries to acknowledge."""
+        created, completed, withdrawn = _classify(entries)
+        task_ids = {data["celery_task_id"] for _, data in created if data["celery_task_id"]}
+        existing = await _existing_task_ids(session, task_ids | set(completed) | set(withdrawn))
+
+        rows, acknowledged = _creation_rows(created, completed, withdrawn, existing)
+        completion_ids = {task_id: entry_id for task_id, (entry_id, _) in completed.items()}
+        completions, settled = _settle("completion", completion_ids, existing)
+        acknowledged.extend(settled)
+        withdrawals, settled = _settle("withdrawal", withdrawn, existing)
+        acknowledged.extend(settled)
+
+        updates = [(task_id, _parse_time(completed[task_id][1])) for task_id in completions]
+        await _persist(session, rows, updates, withdrawals)
+        logger.debug(
+            f"Wrote {len(rows)} service calls, {len(updates)} completions "
+            f"and {len(withdrawals)} withdrawals"
+        )
+        return acknowledged
+
+    async def write_each(self, session: AsyncSession, entries: List[Entry]) -> List[bytes]:
+        """Write the events of a rejected batch one by one, the rejected ones stay pending."""
+        acknowledged = []
+        for entry_id, fields in entries:
+            try:
+                acknowledged.extend(await self.write(session, [(entry_id, fields)]))
+            except IntegrityError as e:
+                await session.rollback()
+                logger.error(f"Service call event {entry_id.decode('utf-8')} rejected: {e.orig}")
+        return acknowledged
+
+    async def flush(self) -> int:
+        entries = await self.read_batch()
+        if not entries:
+            return 0
+        async with async_session_maker() as session:
+            try:
+                acknowledged = await self.write(session, entries)
+            except IntegrityError as e:
+                await session.rollback()
+                if len(entries) == 1:
+                    entry_id = entries[0][0].decode("utf-8")
+                    logger.error(f"Service call event {entry_id} rejected: {e.orig}")
+                    return 0
+                logger.warning(
+                    f"Batch of {len(entries)} service call events rejected, "
+                    f"writing them one by one: {e.orig}"
+                )
+                acknowledged = await self.write_each(session, entries)
+        if acknowledged:
+            await redis_utils.async_redis_client.xack(STREAM_KEY, CONSUMER_GROUP, *acknowledged)
+        return len(acknowledged)
+
+    async def run(self):
+        await self.ensure_group()
+        logger.info(f"Service call writer {self.consumer} started")
+        while not self._stopping.is_set():
+            try:
+                await self.flush()
+            except Exception as e:
+                # Unacknowledged events stay pending and are claimed again
+                logger.error(f"Service call writer failed to flush: {e}")
+                await asyncio.sleep(self.interval_ms / 1000)
+
+    def start(self):
+        self._stopping.clear()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Finish the batch in progress, then stop."""
+        self._stopping.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
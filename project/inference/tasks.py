@@ -1,17 +1,35 @@
-import asyncio
-from celery.result import AsyncResult
-from celery import shared_task
-from project.celery_utils import custom_celery_task
-from celery.signals import task_failure, task_success
+from celery import shared_task, states
+from project.celery_utils import custom_celery_task, run_async
+from celery.signals import (
+    before_task_publish,
+    task_failure,
+    task_postrun,
+    task_prerun,
+    task_success,
+    worker_init,
+    worker_process_init,
+    worker_process_shutdown,
+)
+from project import metrics, tracing
+from project.config import settings
 from project.inference.model_registry import model_registry
-from project.database import get_async_session
-from project.inference.crud import update_service_call_time_completed
-from datetime import datetime
+from project.inference.model_pool import model_pool, predict_batch
+from project.database import engine, get_async_session
+from project.inference.crud import get_usage_by_user_model
+from project.inference import notifications, partitions, quota, service_call_log
+from project.inference.completions import CompletionWriter
+from project.local_cache import invalidator
+from datetime import datetime, timezone
 import logging
-import json
-from project.redis_utils import get_cache, set_cache
+import os
+from project.inference import cache
+from project.inference.cache import make_cache_key
 logger = logging.getLogger(__name__)
 
+completion_writer = CompletionWriter(
+    max_rows=settings.COMPLETION_WRITER_MAX_ROWS,
+    interval_ms=settings.COMPLETION_WRITER_INTERVAL_MS,
+)
 
 
 
@@ -45,40 +63,180 @@ def run_regression():
 #     return model_func()
 
 
+@worker_process_init.connect
+def warm_up_model_pool(**kwargs):
+    if settings.MODEL_POOL_PRELOAD:
+        logger.info("Warming up model pool for worker process")
+        model_pool.warm_up()
+
+
+@worker_process_init.connect
+def start_completion_writer(**kwargs):
+    # Connections inherited from the parent process must not be reused by the child
+    engine.sync_engine.dispose(close=False)
+    completion_writer.start()
+
+
+@worker_process_init.connect
+def start_cache_invalidations(**kwargs):
+    # The listener thread of the parent process is not inherited by the child
+    invalidator.start()
+
+
+@worker_init.connect
+def start_metrics_exporter(**kwargs):
+    metrics.start_worker_exporter()
+
+
+@worker_process_shutdown.connect
+def mark_metrics_process_dead(pid=None, **kwargs):
+    metrics.mark_process_dead(pid or os.getpid())
+
+
+@before_task_publish.connect
+def stamp_task_published_at(headers=None, **kwargs):
+    # Read back by the worker to measure the queue wait
+    if headers is not None:
+        metrics.stamp_published_at(headers)
+
+
+@before_task_publish.connect
+def inject_trace_context(headers=None, **kwargs):
+    # The task continues the trace of the request / task publishing it
+    if headers is not None:
+        tracing.inject(headers)
+
+
+@task_prerun.connect
+def start_task_span(task_id=None, task=None, **kwargs):
+    task.request.trace = tracing.start_span(
+        task.name,
+        tracing.CONSUMER,
+        attributes={"task_id": task_id},
+        **tracing.extract(task.request),
+    )
+
+
+@task_postrun.connect
+def end_task_span(task=None, retval=None, state=None, **kwargs):
+    trace = getattr(task.request, "trace", None)
+    if trace is not None:
+        trace[0].set_attribute("state", state)
+    tracing.end_span(trace, retval if isinstance(retval, BaseException) else None)
+
+
+@worker_process_shutdown.connect
+def flush_traces(**kwargs):
+    tracing.flush()
+
+
+@worker_process_shutdown.connect
+def flush_cache_stats(**kwargs):
+    cache.cache_stats.flush()
+
+
+@worker_process_shutdown.connect
+def flush_completion_writer(**kwargs):
+    try:
+        completion_writer.flush(timeout=settings.COMPLETION_WRITER_SHUTDOWN_TIMEOUT)
+    except Exception as e:
+        logger.error(f"Completion writer not flushed on shutdown: {e}")
+
+
 @custom_celery_task(bind=True, max_retries=3, retry_backoff=True)
 def run_model(self, model_id: int, input_data: dict):
-    logger.info(f"Running model with id {model_id}")
+    logger.debug(f"Running model with id {model_id}")
     if model_id not in model_registry:
         logger.error(f"Model with id {model_id} not found")
         return {"error": f"Model with id {model_id} not found"}
     
-    model_func = model_registry[model_id]['func']
-    model = model_func()
+    # Warm instance, built once per worker process
+    model = model_pool.get(model_id)
     
-    # Generate a cache key based on model_id and input parameters
-    cache_key = f"model_{model_id}_result_{hash(frozenset(input_data.items()))}"
-    logger.info(f"Generated cache key: {cache_key}")
+    # Validate the input first: the cache key is derived from the validated fields
+    input_obj = model.Input(**input_data)
+    cache_key = make_cache_key(model_id, input_obj)
+    logger.debug(f"Generated cache key: {cache_key}")
     
-    # Check if result is already cached
-    cached_result = get_cache(cache_key)
-    if cached_result:
-        logger.info(f"Returning cached result for model {model_id}")
-        return cached_result
+    def predict():
+        with metrics.timer("predict", model_id):
+            return model.predict(input_obj).dict()
     
     try:
-        input_obj = model.Input(**input_data)
-        result = model.predict(input_obj)
-        logger.info(f"Model {model_id} executed successfully with result: {result}")
-        
-        # Cache the result with an expiration time
-        set_cache(cache_key, result.dict())
-        logger.info(f"Cached result for model {model_id} with key {cache_key}")
-        
-        return result.dict()
+        # Concurrent misses on the same key are computed once, by the worker holding its lock
+        result = cache.get_or_compute(model_id, cache_key, predict)
+        logger.debug(f"Model {model_id} executed successfully")
+        return result
     except Exception as e:
         logger.error(f"Error executing model {model_id}: {e}")
         raise self.retry(exc=e)
 
+
+@custom_celery_task(bind=True, max_retries=3, retry_backoff=True)
+def run_model_batch(self, model_id: int, inputs: list):
+    logger.debug(f"Running model with id {model_id} on a batch of {len(inputs)} inputs")
+    if model_id not in model_registry:
+        logger.error(f"Model with id {model_id} not found")
+        return {"error": f"Model with id {model_id} not found"}
+    
+    model = model_pool.get(model_id)
+    input_objs = [model.Input(**input_data) for input_data in inputs]
+    
+    try:
+        with metrics.timer("predict", model_id):
+            results = predict_batch(model, input_objs)
+        logger.debug(f"Model {model_id} executed successfully on {len(results)} inputs")
+        return {"results": [result.dict() for result in results]}
+    except Exception as e:
+        logger.error(f"Error executing model {model_id} on batch: {e}")
+        raise self.retry(exc=e)
+
+@shared_task
+def refresh_cached_result(model_id: int, input_data: dict):
+    """Recompute a hot cached result ahead of its expiry, requested by the API on a cache hit."""
+    model = model_pool.get(model_id)
+    input_obj = model.Input(**input_data)
+    return cache.refresh(
+        model_id, make_cache_key(model_id, input_obj), lambda: model.predict(input_obj).dict()
+    )
+
+@shared_task
+def reconcile_quota_counters():
+    """
+    Rebuild the Redis quota counters from service_call, which stays the source of
+    truth: recreates counters lost with Redis and catches up on missed increments.
+    """
+    if settings.QUOTA_BACKEND != "redis":
+        return 0
+
+    async def load_usage():
+        async for session in get_async_session():
+            return await get_usage_by_user_model(session)
+
+    usage = run_async(load_usage())
+    n_rows = quota.sync_counters(usage)
+    logger.info(f"Reconciled quota counters for {n_rows} user / model pairs")
+    return n_rows
+
+@shared_task
+def maintain_service_call_partitions():
+    """Create the upcoming monthly partitions of service_call and expire the old ones."""
+    if engine.dialect.name != "postgresql":
+        return None
+
+    async def maintain():
+        async with engine.begin() as conn:
+            return await conn.run_sync(
+                partitions.maintain_partitions,
+                months_ahead=settings.SERVICE_CALL_PARTITIONS_AHEAD,
+                retention_months=settings.SERVICE_CALL_RETENTION_MONTHS,
+                archive=settings.SERVICE_CALL_ARCHIVE_EXPIRED,
+            )
+
+    created, expired = run_async(maintain())
+    logger.info(f"service_call partitions created: {created}, expired: {expired}")
+    return {"created": created, "expired": expired}
+
 # @shared_task
 # def run_model(model_id: int):
 #     if model_id not in model_registry:
@@ -101,25 +259,31 @@ def run_model(self, model_id: int, input_data: dict):
 #     asyncio.run(update_task())
   
     
+@task_prerun.connect(sender=run_model)
+@task_prerun.connect(sender=run_model_batch)
+def task_prerun_handler(sender, task_id, task, args, **kwargs):
+    metrics.observe_queue_wait(task.request, args[0] if args else None)
+
+
 @task_success.connect(sender=run_model)
+@task_success.connect(sender=run_model_batch)
+@tracing.traced()
 def task_success_handler(sender, result, **kwargs):
     task_id = sender.request.id
-    task_result = AsyncResult(task_id)
-    time_completed = task_result.date_done
-
-    async def update_task():
-        async for session in get_async_session():
-            await update_service_call_time_completed(session, task_id, time_completed)
-    
-    try:
-        loop = asyncio.get_event_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    
-    if loop.is_running():
-        # If there's an existing event loop, create a task
-        loop.create_task(update_task())
+    metrics.observe_result_backend_write(sender.request, (sender.request.args or [None])[0])
+    # Timestamped here, without reading the task back from the result backend
+    time_completed = datetime.now(timezone.utc)
+    if service_call_log.buffered():
+        # Written in bulk by the service call writer
+        service_call_log.record_completion(task_id, time_completed)
     else:
-        # Otherwise, run the coroutine
-        loop.run_until_complete(update_task())
\ No newline at end of file
+        completion_writer.submit(task_id, time_completed)
+    # Push the result to clients waiting on /results/{task_id}/stream
+    notifications.publish_result(task_id, states.SUCCESS, result=result)
+
+
+@task_failure.connect(sender=run_model)
+@task_failure.connect(sender=run_model_batch)
+def task_failure_handler(sender, task_id, exception, **kwargs):
+    notifications.publish_result(task_id, states.FAILURE, error=str(exception))
+
@@ -1,20 +1,146 @@
 from celery.result import AsyncResult
-from fastapi import Depends, FastAPI, File, HTTPException, UploadFile
-from fastapi.responses import JSONResponse
+from fastapi import (
+    Depends,
+    FastAPI,
+    File,
+    HTTPException,
+    Query,
+    UploadFile,
+    WebSocket,
+    WebSocketDisconnect,
+)
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from redis.exceptions import RedisError
 from sqlalchemy.ext.asyncio import AsyncSession
-from uuid import UUID
+from starlette.concurrency import run_in_threadpool
+from uuid import UUID, uuid4
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+import asyncio
+import json
 
 from project.database import get_async_session
 from project.fu_core.users import current_superuser, current_active_user, models
-from project.inference import crud, inference_router, schemas, tasks
+from project.inference import crud, inference_router, metadata, schemas, service_call_log, tasks
 from project.inference.model_registry import model_registry
+from project.inference.cache import (
+    aget_cached,
+    get_cache_stats,
+    local_results,
+    make_cache_key,
+    read_entry,
+    record_cache_hit,
+    should_refresh,
+)
+from project.inference.inline import inline_runner
+from project.inference.model_pool import model_pool
+from project.inference.notifications import result_notifier
+from project import metrics
+from project.config import settings
 
-from project.inference.schemas import TemperatureModelInput
+from project.inference.schemas import TemperatureModelInput, TemperatureModelOutput
 
 
 import logging
 logger = logging.getLogger(__name__)
 
+async def get_cached_output(model_id: int, input_data: BaseModel, output_schema: type[BaseModel]):
+    """
+    Return the cached result for this input as `output_schema`, or None on a miss.
+    Cache errors are not fatal: the request then goes through Celery as usual.
+    """
+    cache_key = make_cache_key(model_id, input_data)
+    try:
+        with metrics.timer("cache_get", model_id):
+            cached_result = await aget_cached(cache_key)
+    except RedisError as e:
+        logger.warning(f"Cache lookup failed for key {cache_key}: {e}")
+        return None
+    if not cached_result:
+        return None
+    value, delta, expires_at = read_entry(cached_result)
+    try:
+        output = output_schema(**value)
+    except ValidationError:
+        logger.warning(
+            f"Cached result for key {cache_key} does not match {output_schema.__name__}"
+        )
+        return None
+    if should_refresh(delta, expires_at):
+        # Served from cache all the same, a worker recomputes it before it expires
+        try:
+            tasks.refresh_cached_result.delay(model_id, input_data.model_dump(mode="json"))
+        except Exception as e:
+            logger.warning(f"Could not schedule the refresh of {cache_key}: {e}")
+        # Read the refreshed entry from Redis next time
+        local_results.delete(cache_key)
+    return output
+
+
+async def record_granted_call(
+    session: AsyncSession, model_id: int, user_id: UUID, n_inputs: int = 1, **fields
+):
+    """`service_call_log.record_service_call`, refunding the checked quota if it fails."""
+    try:
+        await service_call_log.record_service_call(
+            session, model_id, user_id, n_inputs=n_inputs, **fields
+        )
+    except Exception:
+        await crud.refund_user_access(user_id, model_id, n_inputs)
+        raise
+
+
+async def enqueue_granted_call(
+    session: AsyncSession, task: Any, args: tuple, model_id: int, user_id: UUID, n_inputs: int = 1
+) -> str:
+    """
+    Record a granted call under a new task id, then enqueue its task. The task id is
+    generated here so the service call is inserted with it, before the task can
+    complete. If the broker is unavailable the call is withdrawn and refunded.
+    """
+    task_id = str(uuid4())
+    await record_granted_call(session, model_id, user_id, n_inputs, celery_task_id=task_id)
+    try:
+        with metrics.timer("broker_enqueue", model_id):
+            task.apply_async(args, task_id=task_id)
+    except Exception:
+        await crud.refund_user_access(user_id, model_id, n_inputs)
+        try:
+            await service_call_log.withdraw_service_call(session, task_id)
+        except Exception as e:
+            logger.error(f"Could not withdraw the service call of task {task_id}: {e}")
+        raise
+    return task_id
+
+
+def input_errors(model: Any, input_data: Dict[str, Any], loc: List[Any]) -> List[Dict[str, Any]]:
+    """Validation errors of an input against the model input schema, located under `loc`."""
+    try:
+        model.Input(**input_data)
+    except ValidationError as e:
+        return [dict(error, loc=[*loc, *error["loc"]]) for error in json.loads(e.json())]
+    return []
+
+
+def validate_input(model_id: int, input_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Validation errors of a request body against the model input schema, located as
+    FastAPI locates request errors. Loads the model on first use: run in a thread.
+    """
+    return input_errors(model_pool.get(model_id), input_data, ["body"])
+
+
+def validate_batch_inputs(model_id: int, inputs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """`validate_input` of each row of a batch."""
+    model = model_pool.get(model_id)
+    return [
+        error
+        for index, input_data in enumerate(inputs)
+        for error in input_errors(model, input_data, ["body", "inputs", index])
+    ]
+
+
 @inference_router.get("/health")
 async def health_check():
     return JSONResponse({"status": "ok"})
@@ -35,6 +161,13 @@ async def get_model_info(
 
 
 
+@inference_router.get("/cache_stats")
+def cache_stats(superuser: models.User = Depends(current_superuser)):
+    # Hit / miss counters shared by the whole worker fleet, keyed by model id
+    return JSONResponse({str(model_id): stats for model_id, stats in get_cache_stats().items()})
+
+
+
 @inference_router.get("/predict/{model_id}")
 async def predict(
     model_id: int,
@@ -46,22 +179,16 @@ async def predict(
     if model_id not in model_registry:
         raise HTTPException(status_code=404, detail=f"Model with id {model_id} not found")
     
-     # Check if the user has access to the model and update their access record
-    has_access, message = await crud.check_user_access_and_update(
+     # Check if the user has access to the model
+    has_access, message = await crud.check_user_access(
         session, user_id, model_id
     )
     if not has_access:
         raise HTTPException(status_code=403, detail=message)
     
-    # Create a service call record
-    service_call = await crud.create_service_call(session, model_id, user_id)
-    
-    task = tasks.run_model.delay(model_id)
-    service_call.celery_task_id = task.task_id
-    await session.commit()
+    task_id = await enqueue_granted_call(session, tasks.run_model, (model_id,), model_id, user_id)
     
-    
-    return JSONResponse({"task_id": task.task_id})
+    return JSONResponse({"task_id": task_id})
 
 
 
@@ -77,25 +204,192 @@ async def predict_temperature(
     if model_id not in model_registry:
         raise HTTPException(status_code=404, detail=f"Model with id {model_id} not found")
     
-    # Check if the user has access to the model and update their access record
-    has_access, message = await crud.check_user_access_and_update(
+    # Check if the user has access to the model, before a cache lookup can schedule a refresh
+    has_access, message = await crud.check_user_access(
         session, user_id, model_id
     )
     if not has_access:
         raise HTTPException(status_code=403, detail=message)
     
-    # Create a service call record
-    service_call = await crud.create_service_call(session, model_id, user_id)
+    # Look the result up before enqueueing: same key scheme as the worker
+    cached_output = await get_cached_output(model_id, input_data, TemperatureModelOutput)
     
-    task = tasks.run_model.delay(model_id, input_data.dict())
-    service_call.celery_task_id = task.task_id
-    await session.commit()
+    if cached_output is not None:
+        # Served from cache: the call still counts towards the quota
+        await record_granted_call(
+            session, model_id, user_id, time_completed=datetime.now(timezone.utc)
+        )
+        record_cache_hit(model_id)
+        return JSONResponse({"task_id": None, "state": "SUCCESS", "result": cached_output.dict()})
     
-    return JSONResponse({"task_id": task.task_id})
+    # Record the call with its task id, then enqueue
+    task_id = await enqueue_granted_call(
+        session, tasks.run_model, (model_id, input_data.dict()), model_id, user_id
+    )
+    
+    return JSONResponse({"task_id": task_id})
 
 
-@inference_router.get("/task_status/{task_id}")
-def task_status(task_id: str):
+@inference_router.post("/predict-sync/{model_id}")
+async def predict_sync(
+    model_id: int,
+    input_data: Dict[str, Any],
+    current_user: models.User = Depends(current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    Run an inline-capable model in the API process and return its result directly.
+    Models not flagged `inline` in the registry, or requests arriving while the
+    inline runner is saturated, are enqueued on Celery like `/predict-temp`.
+    """
+    user_id: UUID = current_user.id
+    
+    if model_id not in model_registry:
+        raise HTTPException(status_code=404, detail=f"Model with id {model_id} not found")
+    
+    # Either way the input reaches the model after the quota was charged
+    errors = await run_in_threadpool(validate_input, model_id, input_data)
+    if errors:
+        raise HTTPException(status_code=422, detail=errors)
+    
+    has_access, message = await crud.check_user_access(
+        session, user_id, model_id
+    )
+    if not has_access:
+        raise HTTPException(status_code=403, detail=message)
+    
+    result = None
+    if model_registry[model_id].get("inline", False):
+        try:
+            result = await inline_runner.run(model_id, input_data)
+        except Exception:
+            # No service call is recorded for a failed inline prediction
+            await crud.refund_user_access(user_id, model_id)
+            raise
+    
+    if result is not None:
+        await record_granted_call(
+            session, model_id, user_id, time_completed=datetime.now(timezone.utc)
+        )
+        return JSONResponse({"task_id": None, "state": "SUCCESS", "result": result})
+    
+    task_id = await enqueue_granted_call(
+        session, tasks.run_model, (model_id, input_data), model_id, user_id
+    )
+    
+    return JSONResponse({"task_id": task_id, "state": "PENDING"})
+
+
+@inference_router.post("/predict-batch/{model_id}")
+async def predict_batch(
+    model_id: int,
+    batch: schemas.BatchPredictionInput,
+    current_user: models.User = Depends(current_active_user),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    Score a list of inputs with a single task: one ServiceCall row and one quota
+    update for the whole batch, each input counting as one API call.
+    """
+    user_id: UUID = current_user.id
+    n_inputs = len(batch.inputs)
+    
+    if model_id not in model_registry:
+        raise HTTPException(status_code=404, detail=f"Model with id {model_id} not found")
+    
+    # One bad row would fail the whole task, after the quota was charged for every row
+    errors = await run_in_threadpool(validate_batch_inputs, model_id, batch.inputs)
+    if errors:
+        raise HTTPException(status_code=422, detail=errors)
+    
+    has_access, message = await crud.check_user_access(
+        session, user_id, model_id, n_calls=n_inputs
+    )
+    if not has_access:
+        raise HTTPException(status_code=403, detail=message)
+    
+    task_id = await enqueue_granted_call(
+        session, tasks.run_model_batch, (model_id, batch.inputs), model_id, user_id, n_inputs
+    )
+    
+    return JSONResponse({"task_id": task_id, "n_inputs": n_inputs})
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@inference_router.get("/results/{task_id}/stream")
+async def stream_result(task_id: str, timeout: float = settings.RESULT_STREAM_TIMEOUT):
+    """
+    Server-sent events alternative to polling `task_status`: a single `result` event
+    is sent as soon as the task finishes, or a `timeout` event after `timeout` seconds.
+    """
+    timeout = min(timeout, settings.RESULT_STREAM_TIMEOUT)
+
+    async def events():
+        waiter = asyncio.ensure_future(result_notifier.wait(task_id, timeout))
+        try:
+            while True:
+                done, _ = await asyncio.wait({waiter}, timeout=settings.RESULT_STREAM_KEEPALIVE)
+                if done:
+                    break
+                # Keeps proxies from closing the idle connection
+                yield ": keepalive\n\n"
+            payload = waiter.result()
+            if payload is None:
+                yield sse_event("timeout", {"task_id": task_id, "state": "PENDING"})
+            else:
+                yield sse_event("result", payload)
+        finally:
+            waiter.cancel()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@inference_router.websocket("/results/ws")
+async def results_websocket(websocket: WebSocket):
+    """
+    Push channel for task results: send `{"task_id": ...}` messages, each one is
+    answered with the task payload as soon as the task finishes (or `"state": "PENDING"`
+    after RESULT_STREAM_TIMEOUT), in completion order.
+    """
+    await websocket.accept()
+    send_lock = asyncio.Lock()
+    waiters = set()
+
+    async def push(task_id: str):
+        payload = await result_notifier.wait(task_id, settings.RESULT_STREAM_TIMEOUT)
+        try:
+            async with send_lock:
+                await websocket.send_json(payload or {"task_id": task_id, "state": "PENDING"})
+        except (WebSocketDisconnect, RuntimeError):
+            # Client gone while its task was running
+            pass
+
+    try:
+        while True:
+            message = await websocket.receive_json()
+            task_id = message.get("task_id") if isinstance(message, dict) else None
+            if not task_id:
+                async with send_lock:
+                    await websocket.send_json({"error": "Expected {\"task_id\": ...}"})
+                continue
+            waiter = asyncio.create_task(push(str(task_id)))
+            waiters.add(waiter)
+            waiter.add_done_callback(waiters.discard)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for waiter in waiters:
+            waiter.cancel()
+
+
+def get_task_status(task_id: str) -> Dict[str, Any]:
     task = AsyncResult(task_id)
     state = task.state
     if state == 'FAILURE':
@@ -103,7 +397,23 @@ def task_status(task_id: str):
         response = {'state': state, 'error': error}
     else:
         response = {'state': state, 'result': task.result}
-    return JSONResponse(response)
+    return response
+
+
+@inference_router.get("/task_status/{task_id}")
+async def task_status(task_id: str, wait: float = Query(0.0, ge=0)):
+    """
+    `?wait=<seconds>` long-polls: the request is parked, without holding a thread,
+    until the task finishes or the wait (capped at TASK_STATUS_MAX_WAIT) elapses,
+    then answered as usual.
+    """
+    if wait > 0:
+        payload = await result_notifier.wait(task_id, min(wait, settings.TASK_STATUS_MAX_WAIT))
+        if payload is not None:
+            payload.pop("task_id", None)
+            return JSONResponse(payload)
+    # The result backend client is blocking
+    return JSONResponse(await run_in_threadpool(get_task_status, task_id))
 
 
 
@@ -121,7 +431,7 @@ async def pair_user_model(
         raise HTTPException(status_code=403, detail="Not enough permissions")
     
     # Check if the model exists
-    model = await crud.get_inference_model(session, user_access.model_id)
+    model = await metadata.get_inference_model(session, user_access.model_id)
     if not model:
         raise HTTPException(status_code=404, detail="Model not found")
 
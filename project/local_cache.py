@@ -0,0 +1,131 @@
+"""
+In-process caches in front of Redis / the database, kept coherent across processes
+with Redis pub/sub: a process changing the underlying data publishes the keys to
+drop on a channel, and every process listening on it drops them from its caches.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import redis
+
+from project import redis_utils
+
+logger = logging.getLogger(__name__)
+
+
+class LocalCache:
+    """Bounded LRU with a TTL per entry, shared by the threads of one process."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_prefix(self, prefix: str):
+        with self._lock:
+            matching = [
+                key for key in self._entries if isinstance(key, str) and key.startswith(prefix)
+            ]
+            for key in matching:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class Invalidator:
+    """
+    Listens to invalidation channels in a daemon thread, with the sync client: the
+    same code runs in the API and in Celery worker processes. Handlers receive the
+    published message, decoded.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, Callable[[str], None]] = {}
+        self._thread = None
+        self._pid: Optional[int] = None
+
+    def register(self, channel: str, handler: Callable[[str], None]):
+        self._handlers[channel] = handler
+
+    def _dispatch(self, message: Dict[str, Any]):
+        handler = self._handlers.get(message["channel"].decode("utf-8"))
+        if handler is not None:
+            handler(message["data"].decode("utf-8"))
+
+    def start(self):
+        # A forked child inherits the object, not the listener thread
+        if (self._thread is not None and self._pid == os.getpid()) or not self._handlers:
+            return
+        try:
+            pubsub = redis_utils.redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{channel: self._dispatch for channel in self._handlers})
+            self._thread = pubsub.run_in_thread(
+                sleep_time=1.0, daemon=True, exception_handler=self._on_error
+            )
+            self._pid = os.getpid()
+        except redis.RedisError as e:
+            # Local entries then only expire with their TTL
+            logger.warning(f"Cache invalidations unavailable: {e}")
+
+    def _on_error(self, error: Exception, pubsub, thread):
+        logger.error(f"Cache invalidations interrupted: {error}")
+        thread.stop()
+        pubsub.close()
+        self._thread = None
+
+    def stop(self):
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread = None
+
+    def publish(self, channel: str, message: str):
+        try:
+            redis_utils.redis_client.publish(channel, message)
+        except redis.RedisError as e:
+            logger.warning(f"Could not publish invalidation of {message} on {channel}: {e}")
+
+    async def apublish(self, channel: str, message: str):
+        """`publish` from the event loop, with the async client."""
+        try:
+            await redis_utils.async_redis_client.publish(channel, message)
+        except redis.RedisError as e:
+            logger.warning(f"Could not publish invalidation of {message} on {channel}: {e}")
+
+
+invalidator = Invalidator()
@@ -1,24 +1,116 @@
+"""
+Logging of the API and the workers, configured per environment by the `LOG_*`
+settings (see project/config.py):
+
+- `LOG_FORMAT`: `text` for reading in a terminal, `json` for one JSON object per
+  record, with the `extra` fields and the trace / request id of the record
+- `LOG_QUEUE`: the calling thread only enqueues records, a `QueueListener` thread
+  formats and writes them, so requests and tasks never wait on stderr
+- `LOG_TASK_SUCCESS_SAMPLE_RATE`: share of successful tasks logged
+- `LOG_MAX_VALUE_LENGTH`: longest payload (task args, results) logged
+
+The last two apply to `custom_celery_task`, see project/celery_utils.py.
+"""
+import atexit
+import json
 import logging
 import logging.config
+import logging.handlers
+import os
+import queue
+from datetime import datetime, timezone
+from typing import Optional
+
+from project import tracing
+from project.config import settings
+
+# Attributes of every LogRecord, the others come from `extra`
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message",
+    "asctime",
+}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class TraceContextFilter(logging.Filter):
+    """Stamp records with the trace of the calling thread, before they leave it."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        span = tracing.current_span()
+        if span is not None:
+            record.trace_id = span.trace_id
+            record.request_id = span.request_id
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES:
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+def _restart_listener():
+    # A forked child (Celery prefork) inherits the queue, not the listener thread
+    global _listener
+    if _listener is not None:
+        _listener.queue = queue.SimpleQueue()
+        for handler in logging.getLogger().handlers + logging.getLogger("project").handlers:
+            if isinstance(handler, logging.handlers.QueueHandler):
+                handler.queue = _listener.queue
+        _listener._thread = None
+        _listener.start()
+
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(_stop_listener)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_listener)
+
 
 def configure_logging():
+    _stop_listener()
+
     logging_dict = {
         "version": 1,
         "disable_existing_loggers": False,
+        "filters": {
+            "trace_context": {"()": TraceContextFilter},
+        },
         "formatters": {
-            "verbose": {
-                "format": "[%(asctime)s: %(levelname)s] [%(pathname)s:%(lineno)d] %(message)s",
+            "text": {
+                "format": "[%(asctime)s: %(levelname)s] [%(name)s] %(message)s",
+            },
+            "json": {
+                "()": JsonFormatter,
             },
         },
         "handlers": {
             "console": {
                 "class": "logging.StreamHandler",
-                "formatter": "verbose",
+                "formatter": settings.LOG_FORMAT,
+                "filters": ["trace_context"],
             },
         },
         "root": {
             "handlers": ["console"],
-            "level": "INFO",
+            "level": settings.LOG_LEVEL,
         },
         "loggers": {
             "project": {
@@ -32,3 +124,23 @@ def configure_logging():
     }
 
     logging.config.dictConfig(logging_dict)
+
+    if settings.LOG_QUEUE:
+        _use_queue()
+
+
+def _use_queue():
+    """Put the console handler behind a queue, written by a listener thread."""
+    global _listener
+    root, project = logging.getLogger(), logging.getLogger("project")
+    console = root.handlers[0]
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # Read in the calling thread, the listener has no trace context
+    queue_handler.addFilter(TraceContextFilter())
+    console.removeFilter(console.filters[0])
+    for logger in (root, project):
+        logger.removeHandler(console)
+        logger.addHandler(queue_handler)
+    _listener = logging.handlers.QueueListener(log_queue, console, respect_handler_level=True)
+    _listener.start()
@@ -0,0 +1,187 @@
+"""
+Prometheus metrics of the API and the Celery workers.
+
+`inference_stage_seconds` times each stage of a prediction, labeled by stage and
+model id (empty when the stage does not know the model yet, e.g. `auth`):
+
+    API:     auth, quota_check, service_call_insert, broker_enqueue, cache_get
+    Worker:  queue_wait, model_load, cache_get, predict, cache_set, result_backend_write
+
+The API serves them on `/metrics`. Each worker node serves them on
+`WORKER_METRICS_PORT`, from its main process. Metrics of several processes (Celery
+prefork children, several API workers) are aggregated through
+`PROMETHEUS_MULTIPROC_DIR`, which must then be set to an empty directory.
+"""
+import functools
+import inspect
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
+
+from fastapi import Request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,  # noqa: F401, served by the API with the metrics
+    REGISTRY,
+    CollectorRegistry,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+
+from project import tracing
+from project.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Sub-millisecond cache hits up to multi-second model loads
+STAGE_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+STAGE_SECONDS = Histogram(
+    "inference_stage_seconds",
+    "Time spent in each stage of a prediction",
+    ["stage", "model_id"],
+    buckets=STAGE_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Latency of the API requests, by route template",
+    ["method", "route", "status"],
+    buckets=STAGE_BUCKETS,
+)
+
+# Message header stamped when a task is published, read back by the worker
+PUBLISHED_AT_HEADER = "published_at"
+
+
+def observe(stage: str, model_id: Any, seconds: float):
+    model_label = "" if model_id is None else str(model_id)
+    STAGE_SECONDS.labels(stage=stage, model_id=model_label).observe(seconds)
+
+
+@contextmanager
+def timer(stage: str, model_id: Any = None):
+    """Time a stage, also traced as a span of the current request / task."""
+    start = time.perf_counter()
+    try:
+        with tracing.span(stage, model_id=model_id):
+            yield
+    finally:
+        observe(stage, model_id, time.perf_counter() - start)
+
+
+def timed(stage: str):
+    """Time a function, sync or async, labeled by its `model_id` argument if it has one."""
+
+    def decorator(func: Callable):
+        signature = inspect.signature(func)
+
+        def model_id_of(args, kwargs):
+            try:
+                return signature.bind_partial(*args, **kwargs).arguments.get("model_id")
+            except TypeError:
+                return None
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with timer(stage, model_id_of(args, kwargs)):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(stage, model_id_of(args, kwargs)):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+async def observe_request(request: Request, call_next):
+    """HTTP middleware of the API: times each request by route template, and traces it."""
+    start = time.perf_counter()
+    # Continues the trace of the caller, if it sent one
+    trace = tracing.start_span(
+        f"{request.method} {request.url.path}",
+        tracing.SERVER,
+        traceparent=request.headers.get(tracing.TRACEPARENT_HEADER),
+        request_id=request.headers.get(tracing.HTTP_REQUEST_ID_HEADER),
+    )
+    try:
+        response = await call_next(request)
+    except Exception as e:
+        tracing.end_span(trace, e)
+        raise
+    route = request.scope.get("route")
+    # Route templates, not paths: task ids would make one series per request
+    route_path = route.path if route is not None else "unmatched"
+    REQUEST_SECONDS.labels(
+        method=request.method,
+        route=route_path,
+        status=response.status_code,
+    ).observe(time.perf_counter() - start)
+    if trace is not None:
+        span = trace[0]
+        span.name = f"{request.method} {route_path}"
+        span.set_attribute("http.status_code", response.status_code)
+        response.headers[tracing.HTTP_REQUEST_ID_HEADER] = span.request_id
+        tracing.end_span(trace)
+    return response
+
+
+def stamp_published_at(headers: dict):
+    headers[PUBLISHED_AT_HEADER] = time.time()
+
+
+def observe_queue_wait(request: Any, model_id: Any):
+    """Time between the publication of the task and the start of its execution."""
+    # Message headers are attributes of the task request
+    published_at = getattr(request, PUBLISHED_AT_HEADER, None)
+    if isinstance(published_at, float):
+        observe("queue_wait", model_id, max(0.0, time.time() - float(published_at)))
+
+
+def observe_result_backend_write(request: Any, model_id: Any):
+    """Time from the return of the task to its success signal, sent once its result is stored."""
+    returned_at = getattr(request, "returned_at", None)
+    if isinstance(returned_at, float):
+        observe("result_backend_write", model_id, time.perf_counter() - returned_at)
+
+
+def multiprocess_enabled() -> bool:
+    return bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+
+def _registry() -> CollectorRegistry:
+    """The metrics of this process, or of all processes in multiprocess mode."""
+    if not multiprocess_enabled():
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def collect() -> bytes:
+    return generate_latest(_registry())
+
+
+def start_worker_exporter(port: Optional[int] = None):
+    """Serve the metrics of this worker node over HTTP, from its main process."""
+    port = settings.WORKER_METRICS_PORT if port is None else port
+    if not port:
+        return
+    try:
+        start_http_server(port, registry=_registry())
+        logger.info(f"Serving worker metrics on port {port}")
+    except OSError as e:
+        logger.warning(f"Could not serve worker metrics on port {port}: {e}")
+
+
+def mark_process_dead(pid: int):
+    if multiprocess_enabled():
+        multiprocess.mark_process_dead(pid)
@@ -1,16 +1,136 @@
 import redis
+import redis.asyncio as aioredis
+from project import codecs, tracing
 from project.config import settings
-import json
+from typing import Dict, List, Optional
+import logging
 
+logger = logging.getLogger(__name__)
 
-redis_client = redis.StrictRedis.from_url(settings.REDIS_URL)
+
+class TracedPipeline(redis.client.Pipeline):
+    def execute(self, raise_on_error=True):
+        with tracing.span("redis PIPELINE", tracing.CLIENT, commands=len(self.command_stack)):
+            return super().execute(raise_on_error)
+
+
+class TracedRedis(redis.StrictRedis):
+    """Traces each command as a span of the current request / task, named after the command."""
+
+    def execute_command(self, *args, **options):
+        with tracing.span(f"redis {args[0]}", tracing.CLIENT):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return TracedPipeline(
+            self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
+
+
+class TracedAsyncPipeline(aioredis.client.Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        with tracing.span("redis PIPELINE", tracing.CLIENT, commands=len(self.command_stack)):
+            return await super().execute(raise_on_error)
+
+
+class TracedAsyncRedis(aioredis.Redis):
+    async def execute_command(self, *args, **options):
+        with tracing.span(f"redis {args[0]}", tracing.CLIENT):
+            return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction: bool = True, shard_hint=None):
+        return TracedAsyncPipeline(
+            self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
+
+
+redis_client = TracedRedis.from_url(settings.REDIS_URL)
+
+# Encodes cached values, any codec (or plain JSON) is decoded whatever this one is
+cache_codec = codecs.codec_from_settings("CACHE")
+
+
+def create_async_redis_client() -> aioredis.Redis:
+    """
+    Non-blocking client for the FastAPI process, the sync client above stays for Celery.
+    Requests share one pool: when `REDIS_MAX_CONNECTIONS` are in use, callers wait up
+    to `REDIS_POOL_TIMEOUT` for a free connection instead of opening more.
+    """
+    pool = aioredis.BlockingConnectionPool.from_url(
+        settings.REDIS_URL,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT,
+        health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+        socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+    )
+    return TracedAsyncRedis(connection_pool=pool)
+
+
+# Connections are opened lazily, on the loop of the request using them
+async_redis_client = create_async_redis_client()
+
+
+async def open_async_redis():
+    """App startup: check Redis is reachable, the API still starts if it is not."""
+    try:
+        await async_redis_client.ping()
+    except redis.RedisError as e:
+        logger.warning(f"Redis unreachable at startup, cache and counters degraded: {e}")
+        return
+    if settings.REDIS_MAXMEMORY:
+        await apply_memory_budget(settings.REDIS_MAXMEMORY, settings.REDIS_MAXMEMORY_POLICY)
+
+
+async def apply_memory_budget(maxmemory: str, policy: str):
+    """Cap the memory of Redis, cached results being evicted past it according to `policy`."""
+    try:
+        await async_redis_client.config_set("maxmemory", maxmemory)
+        await async_redis_client.config_set("maxmemory-policy", policy)
+    except redis.RedisError as e:
+        # Managed Redis services often disable CONFIG: set it on the server instead
+        logger.warning(f"Could not set maxmemory {maxmemory} / {policy}: {e}")
+
+
+async def close_async_redis():
+    """App shutdown: close the pooled connections, they are bound to the app event loop."""
+    await async_redis_client.connection_pool.disconnect()
 
 
 def get_cache(key: str):
     cached_result = redis_client.get(key)
     if cached_result:
-        return json.loads(cached_result.decode('utf-8'))
+        return codecs.loads(cached_result)
     return None
 
 def set_cache(key: str, value: dict, expiration: int = settings.CACHE_EXPIRATION_TIME):
-    redis_client.setex(key, expiration, json.dumps(value))
\ No newline at end of file
+    redis_client.setex(key, expiration, cache_codec.dumps(value))
+
+
+async def aget_cache(key: str):
+    cached_result = await async_redis_client.get(key)
+    if cached_result:
+        return codecs.loads(cached_result)
+    return None
+
+
+async def aset_cache(key: str, value: dict, expiration: int = settings.CACHE_EXPIRATION_TIME):
+    await async_redis_client.setex(key, expiration, cache_codec.dumps(value))
+
+
+async def amget_cache(keys: List[str]) -> List[Optional[dict]]:
+    """Cached values of `keys` in one round-trip, None for misses."""
+    if not keys:
+        return []
+    cached_results = await async_redis_client.mget(keys)
+    return [codecs.loads(value) if value else None for value in cached_results]
+
+
+async def amset_cache(values: Dict[str, dict], expiration: int = settings.CACHE_EXPIRATION_TIME):
+    """Cache several values, each with its own expiration, in one pipelined round-trip."""
+    if not values:
+        return
+    async with async_redis_client.pipeline(transaction=False) as pipeline:
+        for key, value in values.items():
+            pipeline.setex(key, expiration, cache_codec.dumps(value))
+        await pipeline.execute()
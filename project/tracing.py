@@ -0,0 +1,396 @@
+"""
+Request tracing, from the API request to the Celery task running its prediction.
+
+Spans nest through a context variable: `span()` / `traced()` open a child of the
+current span, or a new trace. The API opens one span per request, the workers
+one per task, continuing the trace of the request which published the task: the
+W3C `traceparent` and the `request_id` of the request travel in the task headers.
+
+Spans are exported in batches, from a daemon thread, by `TRACING_EXPORTER`:
+
+- `none`: tracing is disabled, the default
+- `json`: one span per line, appended to `TRACING_FILE`, for offline analysis
+- `otlp`: OTLP/HTTP with JSON payloads, to a collector at `TRACING_OTLP_ENDPOINT`
+
+`TRACING_SAMPLE_RATE` is the share of new traces recorded, traces continued from
+a `traceparent` follow the decision of their parent.
+"""
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional
+
+import requests
+
+from project.config import settings
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_HEADER = "traceparent"
+REQUEST_ID_HEADER = "request_id"
+HTTP_REQUEST_ID_HEADER = "X-Request-ID"
+
+# OTLP span kinds
+INTERNAL, SERVER, CLIENT, PRODUCER, CONSUMER = 1, 2, 3, 4, 5
+
+
+class Span:
+    __slots__ = (
+        "name", "trace_id", "span_id", "parent_id", "request_id", "kind", "sampled",
+        "start_ns", "end_ns", "attributes", "error",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_id: Optional[str],
+        request_id: str,
+        kind: int = INTERNAL,
+        sampled: bool = True,
+        attributes: Optional[Dict[str, Any]] = None,
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.request_id = request_id
+        self.kind = kind
+        self.sampled = sampled
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = {
+            key: value for key, value in (attributes or {}).items() if value is not None
+        }
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any):
+        if value is not None:
+            self.attributes[key] = value
+
+    def record_error(self, error: BaseException):
+        self.error = f"{type(error).__name__}: {error}"
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "request_id": self.request_id,
+            "kind": self.kind,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6 if self.end_ns else None,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+def parse_traceparent(traceparent: Optional[str]) -> Optional[tuple]:
+    """(trace id, parent span id, sampled) of a W3C traceparent, None if it is invalid."""
+    if not traceparent:
+        return None
+    parts = traceparent.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    return parts[1], parts[2], sampled
+
+
+class JsonFileExporter:
+    """Appends spans to a file, one JSON object per line."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: List[Span]):
+        lines = "".join(json.dumps(span.to_dict(), default=str) + "\n" for span in spans)
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(lines)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+class OtlpHttpExporter:
+    """Posts spans to an OpenTelemetry collector, OTLP/HTTP with JSON payloads."""
+
+    def __init__(self, endpoint: str, service_name: str, timeout: float = 5.0):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.service_name = service_name
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def payload(self, spans: List[Span]) -> Dict[str, Any]:
+        resource = {"service.name": self.service_name, "process.pid": os.getpid()}
+        return {"resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes(resource)},
+            "scopeSpans": [{
+                "scope": {"name": "project"},
+                "spans": [self._span(span) for span in spans],
+            }],
+        }]}
+
+    def _span(self, span: Span) -> Dict[str, Any]:
+        attributes = dict(span.attributes, request_id=span.request_id)
+        otlp_span = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": span.kind,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": _otlp_attributes(attributes),
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+        return otlp_span
+
+    def export(self, spans: List[Span]):
+        response = self._session.post(self.url, json=self.payload(spans), timeout=self.timeout)
+        response.raise_for_status()
+
+
+class BatchProcessor:
+    """
+    Queues ended spans and exports them in batches from a daemon thread, so requests
+    and tasks never wait for the exporter. Spans are dropped once `max_queue_size`
+    are waiting, e.g. while the collector is down.
+    """
+
+    def __init__(
+        self,
+        exporter,
+        max_batch_size: int = 512,
+        interval: float = 1.0,
+        max_queue_size: int = 10000,
+    ):
+        self.exporter = exporter
+        self.max_batch_size = max_batch_size
+        self.interval = interval
+        self._queue: queue.Queue = queue.Queue(max_queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def on_end(self, span: Span):
+        # A forked child inherits the object, not the export thread
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        self._pid = os.getpid()
+        # The export thread of the parent may have held the lock when it forked
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(self._queue.maxsize)
+        self._thread = threading.Thread(target=self._run, name="trace-export", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        """Export the queued spans now, in the calling thread."""
+        with self._lock:
+            while True:
+                batch = []
+                while len(batch) < self.max_batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if not batch:
+                    return
+                try:
+                    self.exporter.export(batch)
+                except Exception as e:
+                    logger.warning(f"Could not export {len(batch)} spans: {e}")
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+_processor: Optional[BatchProcessor] = None
+_sample_rate: float = 1.0
+
+
+def configure(exporter=None, sample_rate: float = 1.0, **batch_options):
+    """Export spans with `exporter`, None disables tracing."""
+    global _processor, _sample_rate
+    if _processor is not None:
+        _processor.flush()
+    _processor = BatchProcessor(exporter, **batch_options) if exporter is not None else None
+    _sample_rate = sample_rate
+
+
+def configure_from_settings():
+    exporters = {
+        "none": lambda: None,
+        "json": lambda: JsonFileExporter(settings.TRACING_FILE),
+        "otlp": lambda: OtlpHttpExporter(
+            settings.TRACING_OTLP_ENDPOINT, settings.TRACING_SERVICE_NAME
+        ),
+    }
+    if settings.TRACING_EXPORTER not in exporters:
+        raise ValueError(
+            f"Unknown TRACING_EXPORTER {settings.TRACING_EXPORTER!r}, "
+            f"expected one of {sorted(exporters)}"
+        )
+    configure(exporters[settings.TRACING_EXPORTER](), settings.TRACING_SAMPLE_RATE)
+
+
+def enabled() -> bool:
+    return _processor is not None
+
+
+def flush():
+    if _processor is not None:
+        _processor.flush()
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def _new_span(
+    name: str,
+    kind: int = INTERNAL,
+    traceparent: Optional[str] = None,
+    request_id: Optional[str] = None,
+    attributes: Optional[Dict[str, Any]] = None,
+) -> Span:
+    """A child of the current span, else of `traceparent`, else the root of a new trace."""
+    parent = _current_span.get()
+    if parent is not None:
+        return Span(
+            name,
+            parent.trace_id,
+            parent.span_id,
+            parent.request_id,
+            kind,
+            parent.sampled,
+            attributes,
+        )
+    request_id = request_id or uuid.uuid4().hex
+    remote = parse_traceparent(traceparent)
+    if remote is not None:
+        trace_id, parent_id, sampled = remote
+        return Span(name, trace_id, parent_id, request_id, kind, sampled, attributes)
+    sampled = random.random() < _sample_rate
+    return Span(name, os.urandom(16).hex(), None, request_id, kind, sampled, attributes)
+
+
+def start_span(name: str, kind: int = INTERNAL, **options) -> Optional[tuple]:
+    """Open a span and make it current, to close with `end_span` (e.g. across two signals)."""
+    if _processor is None:
+        return None
+    span = _new_span(name, kind, **options)
+    return span, _current_span.set(span)
+
+
+def end_span(started: Optional[tuple], error: Optional[BaseException] = None):
+    if started is None:
+        return
+    span, token = started
+    if error is not None:
+        span.record_error(error)
+    span.end_ns = time.time_ns()
+    try:
+        _current_span.reset(token)
+    except ValueError:
+        # Ended from another context than the one it started in
+        _current_span.set(None)
+    if span.sampled and _processor is not None:
+        _processor.on_end(span)
+
+
+@contextmanager
+def span(name: str, kind: int = INTERNAL, **attributes) -> Iterator[Optional[Span]]:
+    """Trace the block as a child of the current span. Yields None when tracing is disabled."""
+    if _processor is None:
+        yield None
+        return
+    started = start_span(name, kind, attributes=attributes)
+    try:
+        yield started[0]
+    except BaseException as e:
+        end_span(started, e)
+        raise
+    end_span(started)
+
+
+def traced(name: Optional[str] = None):
+    """Trace a function, sync or async, as `module.function` unless named."""
+
+    def decorator(func: Callable):
+        span_name = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__qualname__}"
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def inject(headers: Dict[str, Any]):
+    """Add the context of the current span to outgoing (e.g. Celery task) headers."""
+    current = _current_span.get()
+    if current is not None:
+        headers[TRACEPARENT_HEADER] = current.traceparent
+        headers[REQUEST_ID_HEADER] = current.request_id
+
+
+def extract(carrier: Any) -> Dict[str, Optional[str]]:
+    """`start_span` options continuing the trace of incoming headers.
+
+    The carrier is a mapping of headers or a Celery request.
+    """
+    if isinstance(carrier, Mapping):
+        get = carrier.get
+    else:
+        def get(key):
+            return getattr(carrier, key, None)
+    return {"traceparent": get(TRACEPARENT_HEADER), "request_id": get(REQUEST_ID_HEADER)}
@@ -16,7 +16,7 @@ logger = logging.getLogger(__name__)
 
 # Set the environment variable to use the testing configuration
 os.environ["FASTAPI_CONFIG"] = "testing"
-from tests.inference.fixtures import setup_inference_objects, mock_run_model
+from tests.inference.fixtures import setup_inference_objects, mock_run_model, mock_async_redis, fake_redis
 from project.config import settings as _settings
 from project.database import Base, engine, async_session_maker
 from project import create_app
@@ -68,6 +68,19 @@ def apply_migrations():
     
     # The database file will remain after the tests for inspection
 
+
+@pytest.fixture(autouse=True)
+def clear_local_caches():
+    """In-process caches must not carry entries from one test to the next."""
+    from project.fu_core.users.cache import local_users
+    from project.inference.cache import local_results
+    from project.inference.metadata import metadata_cache
+    for local_cache in (local_results, local_users, metadata_cache):
+        local_cache.clear()
+    yield
+    for local_cache in (local_results, local_users, metadata_cache):
+        local_cache.clear()
+
     
 
 @pytest.fixture
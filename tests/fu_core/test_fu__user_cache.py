@@ -0,0 +1,69 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from uuid import uuid4
+from fastapi import status
+from sqlalchemy import update
+from tests.factories import UserFactory
+from project import redis_utils
+from project.fu_core.security import auth_backend
+from project.fu_core.users.cache import INVALIDATION_CHANNEL, invalidate_user, user_key
+from project.fu_core.users.models import User
+
+
+async def create_user_and_token(db_session):
+    async with db_session() as session:
+        UserFactory._meta.sqlalchemy_session = session
+        user = UserFactory(is_active=True)
+        session.add(user)
+        await session.commit()
+        token = await auth_backend.get_strategy().write_token(user)
+        UserFactory._meta.sqlalchemy_session = None
+    return user, {"Authorization": f"Bearer {token}"}
+
+
+@pytest.mark.asyncio
+async def test_authenticated_user_is_cached(client, db_session, fake_redis):
+    user, headers = await create_user_and_token(db_session)
+
+    assert client.get("/api/v1/users/me", headers=headers).status_code == status.HTTP_200_OK
+
+    cached = redis_utils.get_cache(user_key(user.id))
+    assert cached["email"] == user.email
+    assert "hashed_password" not in cached
+
+    # Changed behind the cache: still served from it
+    async with db_session() as session:
+        await session.execute(update(User).where(User.id == user.id).values(email="changed@camelot.bt"))
+        await session.commit()
+    assert client.get("/api/v1/users/me", headers=headers).json()["email"] == user.email
+
+
+@pytest.mark.asyncio
+async def test_update_through_manager_invalidates_cached_user(client, db_session, fake_redis):
+    user, headers = await create_user_and_token(db_session)
+    client.get("/api/v1/users/me", headers=headers)
+
+    # The cached user is updated through its row, then dropped from the cache
+    response = client.patch("/api/v1/users/me", headers=headers, json={"email": "lancelot@camelot.bt"})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert redis_utils.get_cache(user_key(user.id)) is None
+    assert client.get("/api/v1/users/me", headers=headers).json()["email"] == "lancelot@camelot.bt"
+    async with db_session() as session:
+        db_user = await session.get(User, user.id)
+        assert db_user.hashed_password == user.hashed_password
+
+
+@pytest.mark.asyncio
+async def test_invalidate_user_publishes_with_the_async_client(fake_redis, monkeypatch):
+    # The sync client would block the event loop
+    sync_publish = MagicMock()
+    monkeypatch.setattr(redis_utils.redis_client, "publish", sync_publish)
+    async_publish = AsyncMock()
+    monkeypatch.setattr(redis_utils.async_redis_client, "publish", async_publish)
+    user_id = uuid4()
+
+    await invalidate_user(user_id)
+
+    async_publish.assert_awaited_once_with(INVALIDATION_CHANNEL, user_key(user_id))
+    sync_publish.assert_not_called()
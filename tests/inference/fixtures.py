@@ -1,5 +1,8 @@
 
+import fakeredis
+import fakeredis.aioredis
 import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
 from project.inference.models import AccessPolicy, InferenceModel, UserAccess
 from project.fu_core.users.models import User
 from uuid import uuid4
@@ -18,12 +21,30 @@ class FakeModelOutput(BaseModel):
 
 
 @pytest.fixture()
-def mock_run_model(monkeypatch, mock_celery_task):
-    def mock_delay(model_id, input_data):
-        return mock_celery_task
+def mock_run_model(monkeypatch):
+    # Views generate the task id themselves and pass it to apply_async
+    mock_apply_async = MagicMock()
+    monkeypatch.setattr(views.tasks.run_model, "apply_async", mock_apply_async)
+    return mock_apply_async
 
-    monkeypatch.setattr(views.tasks.run_model, "delay", mock_delay)
-    return mock_delay
+
+
+@pytest.fixture()
+def fake_redis():
+    """In-memory Redis shared by the sync (worker) and async (API) clients."""
+    server = fakeredis.FakeServer()
+    sync_client = fakeredis.FakeRedis(server=server)
+    async_client = fakeredis.aioredis.FakeRedis(server=server)
+    with patch("project.redis_utils.redis_client", sync_client), \
+            patch("project.redis_utils.async_redis_client", async_client):
+        yield sync_client
+
+
+@pytest.fixture()
+def mock_async_redis():
+    with patch("project.redis_utils.async_redis_client") as mock_client:
+        mock_client.get = AsyncMock(return_value=None)
+        yield mock_client
 
         
 @pytest.fixture
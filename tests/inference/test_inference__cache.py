@@ -0,0 +1,168 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+from unittest.mock import MagicMock, patch
+from project import redis_utils
+from project.inference import cache
+from project.inference.cache import (
+    canonical_payload,
+    get_cache_stats,
+    make_cache_key,
+    record_cache_hit,
+    record_cache_miss,
+)
+from project.inference.model_registry import model_registry
+from project.inference.schemas import TemperatureModelInput
+
+
+TEMPERATURE_MODEL_ID = 2
+
+
+def test_canonical_payload_ignores_key_order():
+    first = canonical_payload({"latitude": 40, "longitude": -74, "month": 6, "hour": 14})
+    second = canonical_payload({"hour": 14, "month": 6, "longitude": -74, "latitude": 40})
+    assert first == second
+
+
+def test_cache_key_same_for_model_and_dict_input():
+    input_data = {"latitude": 40, "longitude": -74, "month": 6, "hour": 14}
+    assert make_cache_key(TEMPERATURE_MODEL_ID, input_data) == make_cache_key(
+        TEMPERATURE_MODEL_ID, TemperatureModelInput(**input_data)
+    )
+
+
+def test_cache_key_contains_model_name_and_version():
+    key = make_cache_key(TEMPERATURE_MODEL_ID, {"latitude": 40})
+    model_info = model_registry[TEMPERATURE_MODEL_ID]
+    assert key.startswith(f"inference:{model_info['name']}:{model_info['version']}:")
+
+
+def test_cache_key_changes_with_version(monkeypatch):
+    input_data = {"latitude": 40, "longitude": -74, "month": 6, "hour": 14}
+    before = make_cache_key(TEMPERATURE_MODEL_ID, input_data)
+
+    monkeypatch.setitem(model_registry[TEMPERATURE_MODEL_ID], "version", "9.9.9")
+    after = make_cache_key(TEMPERATURE_MODEL_ID, input_data)
+
+    assert before != after
+
+
+def test_cache_key_stable_across_processes():
+    input_data = {"latitude": 40, "longitude": -74, "month": 6, "hour": 14}
+    script = (
+        "from project.inference.cache import make_cache_key;"
+        f"print(make_cache_key({TEMPERATURE_MODEL_ID}, {input_data!r}))"
+    )
+    keys = {
+        subprocess.run(
+            [sys.executable, "-c", script],
+            env={**os.environ, "PYTHONHASHSEED": seed},
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        for seed in ("1", "2")
+    }
+    assert keys == {make_cache_key(TEMPERATURE_MODEL_ID, input_data)}
+
+
+def test_cache_stats(fake_redis, monkeypatch):
+    monkeypatch.setattr(cache, "cache_stats", cache.CacheStats(interval=3600))
+    fake_redis.hset("inference:cache_stats", "1:hits", 2)
+
+    record_cache_hit(1)
+    record_cache_miss(1)
+
+    # Counted in memory, not in Redis until flushed
+    assert fake_redis.hgetall("inference:cache_stats") == {b"1:hits": b"2"}
+    assert get_cache_stats() == {1: {"hits": 3, "misses": 1, "hit_ratio": 0.75}}
+
+    cache.cache_stats.flush()
+    assert fake_redis.hgetall("inference:cache_stats") == {b"1:hits": b"3", b"1:misses": b"1"}
+    assert get_cache_stats() == {1: {"hits": 3, "misses": 1, "hit_ratio": 0.75}}
+
+
+def test_cache_ttl_from_registry(monkeypatch):
+    assert cache.cache_ttl(TEMPERATURE_MODEL_ID) == cache.settings.CACHE_EXPIRATION_TIME
+
+    monkeypatch.setitem(model_registry[TEMPERATURE_MODEL_ID], "cache_ttl", 60)
+    assert cache.cache_ttl(TEMPERATURE_MODEL_ID) == 60
+
+
+def test_get_or_compute_caches_with_model_ttl(fake_redis, monkeypatch):
+    monkeypatch.setitem(model_registry[TEMPERATURE_MODEL_ID], "cache_ttl", 60)
+    compute = MagicMock(return_value={"temperature": 21.5})
+
+    assert cache.get_or_compute(TEMPERATURE_MODEL_ID, "key:1", compute) == {"temperature": 21.5}
+    assert cache.get_or_compute(TEMPERATURE_MODEL_ID, "key:1", compute) == {"temperature": 21.5}
+
+    compute.assert_called_once()
+    assert 0 < fake_redis.ttl("key:1") <= 60
+    assert not fake_redis.exists(cache.lock_key("key:1"))
+    value, delta, expires_at = cache.read_entry(redis_utils.get_cache("key:1"))
+    assert value == {"temperature": 21.5} and delta >= 0 and expires_at > time.time()
+
+
+def test_get_or_compute_waits_for_the_lock_holder(fake_redis):
+    token = cache.acquire_lock("key:2")
+    compute = MagicMock(return_value={"temperature": 0.0})
+    # Another worker finishes computing the value while this one waits
+    threading.Timer(0.1, redis_utils.set_cache, ("key:2", cache.make_entry({"temperature": 21.5}, 0.1, 60))).start()
+
+    assert cache.get_or_compute(TEMPERATURE_MODEL_ID, "key:2", compute) == {"temperature": 21.5}
+    compute.assert_not_called()
+    cache.release_lock("key:2", token)
+
+
+def test_get_or_compute_after_failed_lock_holder(fake_redis):
+    token = cache.acquire_lock("key:3")
+    # The lock holder fails, releasing the lock without caching a value
+    threading.Timer(0.1, cache.release_lock, ("key:3", token)).start()
+
+    assert cache.get_or_compute(TEMPERATURE_MODEL_ID, "key:3", lambda: {"temperature": 21.5}) == {"temperature": 21.5}
+
+
+def test_should_refresh():
+    now = time.time()
+    # Bare values written without an entry are never refreshed early
+    assert not cache.should_refresh(None, None)
+    assert cache.should_refresh(0.1, now - 1)
+    assert not cache.should_refresh(0.001, now + 3600)
+    # Earlier with a longer compute time: -log(0.5) * delta must reach the expiry
+    with patch.object(cache.random, "random", return_value=0.5):
+        assert cache.should_refresh(10.0, now + 5)
+        assert not cache.should_refresh(1.0, now + 5)
+
+
+def test_get_cached_serves_hot_keys_from_memory(fake_redis):
+    redis_utils.set_cache("key:4", cache.make_entry({"temperature": 21.5}, 0.1, 60))
+
+    assert cache.get_cached("key:4")["value"] == {"temperature": 21.5}
+    fake_redis.delete("key:4")
+    assert cache.get_cached("key:4")["value"] == {"temperature": 21.5}
+
+
+def test_local_entries_never_outlive_redis(fake_redis):
+    redis_utils.set_cache("key:5", cache.make_entry({"temperature": 21.5}, 0.1, 0.05))
+    cache.get_cached("key:5")
+
+    time.sleep(0.1)
+    assert cache.local_results.get("key:5") is None
+
+
+def test_new_model_version_invalidates_local_results(fake_redis):
+    model_name = model_registry[TEMPERATURE_MODEL_ID]["name"]
+    key = make_cache_key(TEMPERATURE_MODEL_ID, {"latitude": 40})
+    cache.local_results.set(key, {"temperature": 21.5})
+    cache.local_results.set("inference:other_model:1:abc", {"temperature": 0.0})
+    fake_redis.hset(cache.MODEL_VERSIONS_KEY, model_name, "0.0.1")
+
+    with patch.object(cache.invalidator, "publish") as mock_publish:
+        cache.announce_model_versions()
+
+    assert cache.local_results.get(key) is None
+    assert cache.local_results.get("inference:other_model:1:abc") is not None
+    mock_publish.assert_called_once_with(cache.INVALIDATION_CHANNEL, f"inference:{model_name}:")
+    assert fake_redis.hget(cache.MODEL_VERSIONS_KEY, model_name).decode() == model_registry[TEMPERATURE_MODEL_ID]["version"]
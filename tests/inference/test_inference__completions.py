@@ -0,0 +1,32 @@
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, patch
+from project.celery_utils import get_worker_loop
+from project.inference.completions import CompletionWriter
+
+
+def test_completions_are_written_in_batches():
+    writer = CompletionWriter(max_rows=3, interval_ms=50)
+    now = datetime.now(timezone.utc)
+
+    with patch.object(CompletionWriter, "write", new_callable=AsyncMock) as mock_write:
+        for i in range(4):
+            writer.submit(f"task-{i}", now)
+        writer.flush(timeout=5)
+
+    # Runs on the worker loop thread, not in the caller
+    assert writer._loop is get_worker_loop()
+    assert [len(call.args[0]) for call in mock_write.await_args_list] == [3, 1]
+    assert mock_write.await_args_list[0].args[0][0] == ("task-0", now)
+
+
+def test_failed_write_does_not_stop_the_writer():
+    writer = CompletionWriter(max_rows=10, interval_ms=10)
+    now = datetime.now(timezone.utc)
+
+    with patch.object(CompletionWriter, "write", new_callable=AsyncMock, side_effect=[Exception("db down"), None]) as mock_write:
+        writer.submit("task-0", now)
+        writer.flush(timeout=5)
+        writer.submit("task-1", now)
+        writer.flush(timeout=5)
+
+    assert mock_write.await_count == 2
@@ -1,5 +1,8 @@
 import pytest
+from datetime import datetime, timedelta, timezone
 from uuid import uuid4
+from sqlalchemy import event
+from project.database import engine
 from project.inference import crud
 from tests.factories import AccessPolicyFactory, InferenceModelFactory, UserFactory, UserAccessFactory, ServiceCallFactory
 
@@ -155,10 +158,11 @@ async def test_create_service_call(db_session):
         await session.refresh(user)
 
         # Create ServiceCall
-        service_call = await crud.create_service_call(session, model.id, user.id, "test_task_id")
+        task_id = str(uuid4())
+        service_call = await crud.create_service_call(session, model.id, user.id, task_id)
         assert service_call.model_id == model.id
         assert service_call.user_id == user.id
-        assert service_call.celery_task_id == "test_task_id"
+        assert service_call.celery_task_id == task_id
         
         
 
@@ -205,4 +209,188 @@ async def test_check_user_access_and_update(db_session):
         
         access_granted, message = await crud.check_user_access_and_update(session, user.id, model.id)
         assert access_granted is False
-        assert message == "Daily API call limit exceeded"
\ No newline at end of file
+        assert message == "Daily API call limit exceeded"
+
+
+@pytest.mark.asyncio
+async def test_check_user_access_and_update_batch(db_session):
+    async with db_session() as session:
+        policy = AccessPolicyFactory.build(daily_api_calls=10, monthly_api_calls=100)
+        session.add(policy)
+        await session.commit()
+        await session.refresh(policy)
+
+        model = InferenceModelFactory.build(access_policy_id=policy.id)
+        session.add(model)
+        await session.commit()
+        await session.refresh(model)
+
+        user = UserFactory.build()
+        session.add(user)
+        await session.commit()
+        await session.refresh(user)
+
+        user_access = UserAccessFactory.build(
+            user_id=user.id,
+            model_id=model.id,
+            access_policy_id=policy.id
+        )
+        session.add(user_access)
+        await session.commit()
+
+        # A batch larger than the daily limit is refused as a whole
+        access_granted, message = await crud.check_user_access_and_update(
+            session, user.id, model.id, n_calls=11
+        )
+        assert access_granted is False
+        assert message == "Daily API call limit exceeded"
+
+        access_granted, message = await crud.check_user_access_and_update(
+            session, user.id, model.id, n_calls=8
+        )
+        assert access_granted is True
+        retrieved_user_access = await crud.get_user_access(session, user.id, model.id)
+        assert retrieved_user_access.api_calls == 8
+
+        # Batch rows count against the limit
+        await crud.create_service_call(session, model.id, user.id, n_inputs=8)
+        access_granted, message = await crud.check_user_access_and_update(
+            session, user.id, model.id, n_calls=3
+        )
+        assert access_granted is False
+        assert message == "Daily API call limit exceeded"
+
+
+
+@pytest.mark.asyncio
+async def test_check_user_access_and_update_single_query(db_session):
+    async with db_session() as session:
+        policy = AccessPolicyFactory.build(daily_api_calls=10, monthly_api_calls=14)
+        session.add(policy)
+        await session.commit()
+        await session.refresh(policy)
+
+        model = InferenceModelFactory.build(access_policy_id=policy.id)
+        session.add(model)
+        await session.commit()
+        await session.refresh(model)
+
+        user = UserFactory.build()
+        session.add(user)
+        await session.commit()
+        await session.refresh(user)
+
+        session.add(UserAccessFactory.build(user_id=user.id, model_id=model.id, access_policy_id=policy.id))
+        await session.commit()
+
+        # Calls from last month only count against the monthly limit of that month
+        last_month = crud.quota_windows()[1] - timedelta(days=1)
+        for _ in range(5):
+            session.add(ServiceCallFactory.build(user_id=user.id, model_id=model.id, time_requested=last_month))
+        await session.commit()
+
+        statements = []
+        def record_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(engine.sync_engine, "before_cursor_execute", record_statement)
+        try:
+            access_granted, message = await crud.check_user_access_and_update(session, user.id, model.id)
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", record_statement)
+
+        assert access_granted is True
+        assert len([statement for statement in statements if statement.lstrip().upper().startswith("SELECT")]) == 1
+
+        await crud.create_service_call(session, model.id, user.id, n_inputs=9)
+        access_granted, message = await crud.check_user_access_and_update(session, user.id, model.id, n_calls=2)
+        assert access_granted is False
+        assert message == "Daily API call limit exceeded"
+
+        await crud.create_service_call(session, model.id, user.id, n_inputs=1)
+        policy.daily_api_calls = 100
+        await session.commit()
+        access_granted, message = await crud.check_user_access_and_update(session, user.id, model.id, n_calls=4)
+        assert access_granted is True
+
+        access_granted, message = await crud.check_user_access_and_update(session, user.id, model.id, n_calls=5)
+        assert access_granted is False
+        assert message == "Monthly API call limit exceeded"
+
+
+@pytest.mark.asyncio
+async def test_record_service_call_single_transaction(db_session):
+    async with db_session() as session:
+        policy = AccessPolicyFactory.build(daily_api_calls=10, monthly_api_calls=100)
+        session.add(policy)
+        await session.commit()
+        await session.refresh(policy)
+
+        model = InferenceModelFactory.build(access_policy_id=policy.id)
+        session.add(model)
+        await session.commit()
+        await session.refresh(model)
+
+        user = UserFactory.build()
+        session.add(user)
+        await session.commit()
+        await session.refresh(user)
+
+        user_access = UserAccessFactory.build(user_id=user.id, model_id=model.id, access_policy_id=policy.id, api_calls=0)
+        session.add(user_access)
+        await session.commit()
+
+        statements = []
+        commits = []
+        def record_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement.lstrip().split()[0].upper())
+        def record_commit(conn):
+            commits.append(conn)
+
+        event.listen(engine.sync_engine, "before_cursor_execute", record_statement)
+        event.listen(engine.sync_engine, "commit", record_commit)
+        try:
+            task_id = str(uuid4())
+            access_granted, message = await crud.check_user_access(session, user.id, model.id, n_calls=3)
+            assert access_granted is True
+            service_call_id = await crud.record_service_call(
+                session, model.id, user.id, celery_task_id=task_id, n_inputs=3
+            )
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", record_statement)
+            event.remove(engine.sync_engine, "commit", record_commit)
+
+        # Check, access counter update and insert ... RETURNING, committed once
+        assert statements == ["SELECT", "UPDATE", "INSERT"]
+        assert len(commits) == 1
+
+        service_call = await crud.get_service_call(session, service_call_id)
+        assert service_call.celery_task_id == task_id
+        assert service_call.n_inputs == 3
+        await session.refresh(user_access)
+        assert user_access.api_calls == 3
+
+
+@pytest.mark.asyncio
+async def test_update_service_call_time_completed(db_session):
+    async with db_session() as session:
+        model = InferenceModelFactory.build()
+        user = UserFactory.build()
+        session.add_all([model, user])
+        await session.commit()
+
+        task_ids = [str(uuid4()) for _ in range(3)]
+        service_calls = [await crud.create_service_call(session, model.id, user.id, task_id) for task_id in task_ids]
+        now = datetime.now(timezone.utc)
+
+        service_call_id = await crud.update_service_call_time_completed(session, task_ids[0], now)
+        assert service_call_id == service_calls[0].id
+        assert await crud.update_service_call_time_completed(session, str(uuid4()), now) is None
+
+        # One statement for several completions, each row gets its own time
+        later = now + timedelta(seconds=1)
+        updated = await crud.update_service_calls_time_completed(session, [(task_ids[1], now), (task_ids[2], later)])
+        assert sorted(updated) == sorted(service_call.id for service_call in service_calls[1:])
+        for service_call, expected in zip(service_calls, [now, now, later]):
+            await session.refresh(service_call)
+            assert service_call.time_completed.replace(tzinfo=timezone.utc) == expected
@@ -0,0 +1,110 @@
+import asyncio
+import pytest
+from pydantic import BaseModel, ValidationError
+from project.inference.batching import MicroBatcher
+from project.inference.inline import InlineRunner
+from project.inference.model_registry import model_registry
+
+
+class CountingModel:
+    class Input(BaseModel):
+        x: int
+
+    class Output(BaseModel):
+        y: int
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def predict(self, input_data):
+        self.batch_sizes.append(1)
+        return self.Output(y=input_data.x * 2)
+
+    def predict_batch(self, inputs):
+        self.batch_sizes.append(len(inputs))
+        return [self.Output(y=input_data.x * 2) for input_data in inputs]
+
+
+@pytest.fixture
+def counting_model(monkeypatch):
+    model = CountingModel()
+    monkeypatch.setitem(model_registry, 999, {
+        "name": "counting_model",
+        "version": "1.0.0",
+        "func": lambda: model,
+        "inline": True,
+        "max_batch_size": 4,
+        "max_batch_wait_ms": 50.0,
+    })
+    return model
+
+
+@pytest.mark.asyncio
+async def test_concurrent_predictions_are_batched(counting_model):
+    runner = InlineRunner(max_concurrency=2)
+
+    results = await asyncio.gather(*(runner.run(999, {"x": x}) for x in range(6)))
+
+    assert results == [{"y": x * 2} for x in range(6)]
+    # Full batch flushed on size, the remainder on timeout
+    assert counting_model.batch_sizes == [4, 2]
+
+
+@pytest.mark.asyncio
+async def test_requests_waiting_in_the_batcher_saturate_the_runner(counting_model):
+    runner = InlineRunner(max_concurrency=1)
+
+    # Accepted before any batch reaches the executor
+    results = await asyncio.gather(*(runner.run(999, {"x": x}) for x in range(12)))
+
+    # One batch per executor thread, the other requests fall back to Celery
+    assert results[:4] == [{"y": x * 2} for x in range(4)]
+    assert results[4:] == [None] * 8
+    assert counting_model.batch_sizes == [4]
+
+
+@pytest.mark.asyncio
+async def test_invalid_input_only_fails_its_request(counting_model):
+    runner = InlineRunner(max_concurrency=2)
+
+    results = await asyncio.gather(
+        runner.run(999, {"x": 1}),
+        runner.run(999, {"x": "not a number"}),
+        return_exceptions=True,
+    )
+
+    assert results[0] == {"y": 2}
+    assert isinstance(results[1], ValidationError)
+
+
+@pytest.mark.asyncio
+async def test_batch_of_invalid_inputs_is_not_predicted():
+    # The real temperature model: sklearn raises on an empty batch
+    runner = InlineRunner(max_concurrency=2)
+
+    with pytest.raises(ValidationError):
+        await runner.run(2, {"latitude": "north", "longitude": 0, "month": 1, "hour": 0})
+
+
+@pytest.mark.asyncio
+async def test_batching_disabled(counting_model, monkeypatch):
+    monkeypatch.setitem(model_registry[999], "max_batch_size", 1)
+    runner = InlineRunner(max_concurrency=3)
+
+    await asyncio.gather(*(runner.run(999, {"x": x}) for x in range(3)))
+
+    assert counting_model.batch_sizes == [1, 1, 1]
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_propagates_batch_failure():
+    async def failing_batch(inputs):
+        raise RuntimeError("model crashed")
+
+    batcher = MicroBatcher(failing_batch, max_batch_size=2, max_wait_ms=10.0)
+
+    results = await asyncio.gather(
+        batcher.submit({"x": 1}), batcher.submit({"x": 2}), return_exceptions=True
+    )
+
+    assert all(isinstance(result, RuntimeError) for result in results)
@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+from unittest.mock import MagicMock
+from sqlalchemy import event
+from project.database import engine
+from project.inference import crud, metadata
+from project.inference.metadata import metadata_cache
+from tests.factories import AccessPolicyFactory, InferenceModelFactory, UserFactory, UserAccessFactory
+
+
+async def create_access(session, daily_api_calls=10):
+    policy = AccessPolicyFactory.build(daily_api_calls=daily_api_calls, monthly_api_calls=100)
+    session.add(policy)
+    await session.commit()
+    model = InferenceModelFactory.build(access_policy_id=policy.id)
+    user = UserFactory.build()
+    session.add_all([model, user])
+    await session.commit()
+    user_access = UserAccessFactory.build(user_id=user.id, model_id=model.id, access_policy_id=policy.id)
+    session.add(user_access)
+    await session.commit()
+    return policy, model, user, user_access
+
+
+@pytest.mark.asyncio
+async def test_grant_and_limits_read_once(db_session, fake_redis):
+    async with db_session() as session:
+        policy, model, user, _ = await create_access(session)
+        await crud.check_user_access(session, user.id, model.id)
+
+        statements = []
+        def record_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(engine.sync_engine, "before_cursor_execute", record_statement)
+        try:
+            access_granted, _ = await crud.check_user_access(session, user.id, model.id)
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", record_statement)
+
+        assert access_granted is True
+        # Usage only, the grant and its policy come from the cache
+        assert len(statements) == 1
+        assert "access_policy" not in statements[0]
+
+
+@pytest.mark.asyncio
+async def test_committed_changes_invalidate_every_process(db_session, fake_redis, monkeypatch):
+    # Commits of an AsyncSession run on the event loop: never with the blocking client
+    sync_incr = MagicMock()
+    monkeypatch.setattr(fake_redis, "incr", sync_incr)
+    async with db_session() as session:
+        policy, model, user, user_access = await create_access(session)
+        assert (await crud.check_user_access(session, user.id, model.id))[0] is True
+        version = metadata_cache.version
+
+        # Counting calls does not touch the metadata
+        await crud.record_service_call(session, model.id, user.id)
+        assert metadata_cache.version == version
+
+        policy.daily_api_calls = 0
+        await session.commit()
+
+        assert metadata_cache.version > version
+        # Bumped in Redis, for the other processes, once the publication ran
+        await asyncio.gather(*metadata._publications)
+        sync_incr.assert_not_called()
+        assert int(fake_redis.get(metadata.METADATA_VERSION_KEY)) >= 1
+        assert await crud.check_user_access(session, user.id, model.id) == (False, "Daily API call limit exceeded")
+
+        user_access.access_granted = False
+        await session.commit()
+        assert await crud.check_user_access(session, user.id, model.id) == (False, "User does not have access to this model")
+
+
+def test_reads_racing_with_a_change_are_not_cached():
+    version = metadata_cache.version
+    metadata_cache.invalidate()
+
+    metadata_cache.set("key", {"daily_api_calls": 10}, version)
+    assert metadata_cache.get("key") is None
+
+    metadata_cache.invalidate(version + 100)
+    assert metadata_cache.version == version + 100
@@ -0,0 +1,84 @@
+import pytest
+from unittest.mock import MagicMock, patch
+from project.inference.model_pool import ModelPool
+from project.inference.tasks import run_model
+from project.inference.model_registry import model_registry
+
+
+@pytest.fixture
+def registry():
+    return {
+        1: {
+            "name": "test_model",
+            "version": "1.0.0",
+            "func": MagicMock(side_effect=lambda: object()),
+        }
+    }
+
+
+def test_model_built_once(registry):
+    pool = ModelPool(registry)
+
+    first = pool.get(1)
+    second = pool.get(1)
+
+    assert first is second
+    registry[1]["func"].assert_called_once()
+
+
+def test_model_reloaded_on_version_change(registry):
+    pool = ModelPool(registry)
+    first = pool.get(1)
+
+    registry[1]["version"] = "1.1.0"
+    second = pool.get(1)
+
+    assert first is not second
+    assert registry[1]["func"].call_count == 2
+    assert pool.loaded_versions() == {1: "1.1.0"}
+
+
+def test_model_evict_and_reload(registry):
+    pool = ModelPool(registry)
+    first = pool.get(1)
+
+    assert pool.evict(1) is True
+    assert 1 not in pool
+    assert pool.evict(1) is False
+
+    second = pool.reload(1)
+    assert second is not first
+    assert 1 in pool
+
+
+def test_unknown_model_raises(registry):
+    pool = ModelPool(registry)
+    with pytest.raises(KeyError):
+        pool.get(9999)
+
+
+def test_warm_up_skips_failing_models(registry):
+    registry[2] = {"name": "broken", "version": "0.0.1", "func": MagicMock(side_effect=ValueError)}
+    pool = ModelPool(registry)
+
+    pool.warm_up()
+
+    assert 1 in pool
+    assert 2 not in pool
+
+
+@pytest.mark.asyncio
+async def test_run_model_reuses_warm_instance(db_session, setup_inference_objects):
+    objects = await setup_inference_objects
+    model_id = objects['model'].id
+
+    model_func = MagicMock(wraps=model_registry[model_id]['func'])
+    model_registry[model_id]['func'] = model_func
+
+    with patch('project.redis_utils.redis_client') as mock_redis_client:
+        mock_redis_client.get.return_value = None
+
+        run_model(model_id, {"param1": "value1"})
+        run_model(model_id, {"param1": "value2"})
+
+    model_func.assert_called_once()
@@ -108,10 +108,11 @@ async def test_create_service_call(db_session):
         session.add_all([model, user])
         await session.commit()
         
-        service_call = await crud.create_service_call(session, model.id, user.id, "test_task_id")
+        task_id = str(uuid4())
+        service_call = await crud.create_service_call(session, model.id, user.id, task_id)
         assert service_call.model_id == model.id
         assert service_call.user_id == user.id
-        assert service_call.celery_task_id == "test_task_id"
+        assert service_call.celery_task_id == task_id
 
 @pytest.mark.asyncio
 async def test_check_user_access_and_update(db_session):
@@ -0,0 +1,73 @@
+import asyncio
+import json
+import pytest
+from project.inference import notifications, views
+from project.inference.notifications import ResultNotifier, publish_result
+
+
+@pytest.mark.asyncio
+async def test_wait_receives_published_result(fake_redis, monkeypatch):
+    monkeypatch.setattr(notifications, "ready_result", lambda task_id: None)
+    notifier = ResultNotifier()
+
+    async def finish_task():
+        # Published by the worker once the client is subscribed
+        while not fake_redis.pubsub_numsub(notifications.result_channel("task-1"))[0][1]:
+            await asyncio.sleep(0.01)
+        publish_result("task-1", "SUCCESS", result={"temperature": 21.5})
+
+    waiters = [notifier.wait("task-1", timeout=5), notifier.wait("task-1", timeout=5)]
+    *payloads, _ = await asyncio.gather(*waiters, finish_task())
+
+    assert payloads == [{"task_id": "task-1", "state": "SUCCESS", "result": {"temperature": 21.5}}] * 2
+    # Unsubscribed once the last waiter is served
+    assert fake_redis.pubsub_numsub(notifications.result_channel("task-1"))[0][1] == 0
+    await notifier.close()
+
+
+@pytest.mark.asyncio
+async def test_wait_reads_tasks_finished_before_subscribing(fake_redis, monkeypatch):
+    payload = {"task_id": "task-2", "state": "FAILURE", "error": "boom"}
+    monkeypatch.setattr(notifications, "ready_result", lambda task_id: payload)
+    notifier = ResultNotifier()
+
+    assert await notifier.wait("task-2", timeout=5) == payload
+    assert await notifier.wait("task-3", timeout=0.05) == payload
+    await notifier.close()
+
+
+@pytest.mark.asyncio
+async def test_wait_times_out(fake_redis, monkeypatch):
+    monkeypatch.setattr(notifications, "ready_result", lambda task_id: None)
+    notifier = ResultNotifier()
+
+    assert await notifier.wait("task-4", timeout=0.05) is None
+    await notifier.close()
+
+
+def test_stream_result(client, monkeypatch):
+    async def wait(task_id, timeout):
+        return {"task_id": task_id, "state": "SUCCESS", "result": {"temperature": 21.5}}
+    monkeypatch.setattr(views.result_notifier, "wait", wait)
+
+    response = client.get("/api/v1/inference/results/task-5/stream")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    event, data = response.text.strip().split("\n")
+    assert event == "event: result"
+    assert json.loads(data.removeprefix("data: ")) == {"task_id": "task-5", "state": "SUCCESS", "result": {"temperature": 21.5}}
+
+
+def test_results_websocket(client, monkeypatch):
+    async def wait(task_id, timeout):
+        return None if task_id == "pending" else {"task_id": task_id, "state": "SUCCESS", "result": 1}
+    monkeypatch.setattr(views.result_notifier, "wait", wait)
+
+    with client.websocket_connect("/api/v1/inference/results/ws") as websocket:
+        websocket.send_json({"task_id": "task-6"})
+        assert websocket.receive_json() == {"task_id": "task-6", "state": "SUCCESS", "result": 1}
+        websocket.send_json({"task_id": "pending"})
+        assert websocket.receive_json() == {"task_id": "pending", "state": "PENDING"}
+        websocket.send_json(["task-7"])
+        assert "error" in websocket.receive_json()
@@ -0,0 +1,148 @@
+import asyncio
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock
+from uuid import uuid4
+from redis.exceptions import ConnectionError
+from project.config import settings
+from project.inference import crud, quota
+from project.inference.tasks import reconcile_quota_counters
+from tests.factories import AccessPolicyFactory, InferenceModelFactory, UserFactory, UserAccessFactory, ServiceCallFactory
+
+
+def test_quota_keys_are_bucketed_by_day_and_month():
+    user_id = uuid4()
+    now = datetime(2024, 2, 29, 13, 30, tzinfo=timezone.utc)
+
+    daily_key, monthly_key = quota.quota_keys(user_id, 2, now)
+
+    assert daily_key == f"quota:{user_id}:2:d:20240229"
+    assert monthly_key == f"quota:{user_id}:2:m:202402"
+
+
+def test_quota_ttls_end_with_their_window():
+    now = datetime(2024, 2, 29, 23, 0, tzinfo=timezone.utc)
+
+    daily_ttl, monthly_ttl = quota.quota_ttls(now)
+
+    assert daily_ttl == 3600 + quota.QUOTA_KEY_GRACE_SECONDS
+    assert monthly_ttl == 3600 + quota.QUOTA_KEY_GRACE_SECONDS
+
+
+@pytest.mark.asyncio
+async def test_consume_seeds_missing_counters(fake_redis):
+    user_id = uuid4()
+    load_usage = AsyncMock(return_value=(3, 7))
+
+    status = await quota.consume(user_id, 1, 2, daily_limit=10, monthly_limit=10, load_usage=load_usage)
+
+    assert status == quota.GRANTED
+    load_usage.assert_awaited_once()
+    daily_key, monthly_key = quota.quota_keys(user_id, 1)
+    assert int(fake_redis.get(daily_key)) == 5
+    assert int(fake_redis.get(monthly_key)) == 9
+    assert fake_redis.ttl(daily_key) > 0
+
+    # Counters exist now: no more database reads
+    status = await quota.consume(user_id, 1, 1, daily_limit=10, monthly_limit=10, load_usage=load_usage)
+    assert status == quota.GRANTED
+    load_usage.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_consume_refuses_without_counting(fake_redis):
+    user_id = uuid4()
+    load_usage = AsyncMock(return_value=(0, 8))
+
+    status = await quota.consume(user_id, 1, 3, daily_limit=10, monthly_limit=10, load_usage=load_usage)
+
+    assert status == quota.MONTHLY_EXCEEDED
+    daily_key, monthly_key = quota.quota_keys(user_id, 1)
+    assert int(fake_redis.get(daily_key)) == 0
+    assert int(fake_redis.get(monthly_key)) == 8
+
+
+@pytest.mark.asyncio
+async def test_consume_returns_none_when_redis_is_down(monkeypatch):
+    client = MagicMock()
+    client.register_script.return_value = AsyncMock(side_effect=ConnectionError("down"))
+    monkeypatch.setattr("project.redis_utils.async_redis_client", client)
+
+    status = await quota.consume(uuid4(), 1, 1, 10, 10, load_usage=AsyncMock())
+
+    assert status is None
+
+
+def test_sync_counters_never_lowers_a_counter(fake_redis):
+    user_id = uuid4()
+    daily_key, monthly_key = quota.quota_keys(user_id, 1)
+    fake_redis.set(daily_key, 6)
+
+    quota.sync_counters([(user_id, 1, 4, 9)])
+
+    assert int(fake_redis.get(daily_key)) == 6
+    assert int(fake_redis.get(monthly_key)) == 9
+
+
+@pytest.mark.asyncio
+async def test_refund_lowers_existing_counters(fake_redis):
+    user_id = uuid4()
+    daily_key, monthly_key = quota.quota_keys(user_id, 1)
+    fake_redis.set(daily_key, 1)
+    fake_redis.set(monthly_key, 5)
+
+    await quota.refund(user_id, 1, 2)
+
+    # Never below 0, and a missing counter is left to be seeded
+    assert int(fake_redis.get(daily_key)) == 0
+    assert int(fake_redis.get(monthly_key)) == 3
+    await quota.refund(user_id, 2, 1)
+    assert fake_redis.get(quota.quota_keys(user_id, 2)[0]) is None
+
+
+async def create_access(session, daily_api_calls=10, monthly_api_calls=100):
+    policy = AccessPolicyFactory.build(daily_api_calls=daily_api_calls, monthly_api_calls=monthly_api_calls)
+    session.add(policy)
+    await session.commit()
+    model = InferenceModelFactory.build(access_policy_id=policy.id)
+    session.add(model)
+    await session.commit()
+    user = UserFactory.build()
+    session.add(user)
+    await session.commit()
+    session.add(UserAccessFactory.build(user_id=user.id, model_id=model.id, access_policy_id=policy.id))
+    await session.commit()
+    return user, model
+
+
+@pytest.mark.asyncio
+async def test_check_user_access_with_redis_counters(db_session, fake_redis, monkeypatch):
+    monkeypatch.setattr(settings, "QUOTA_BACKEND", "redis")
+    async with db_session() as session:
+        user, model = await create_access(session, daily_api_calls=3)
+        session.add(ServiceCallFactory.build(user_id=user.id, model_id=model.id))
+        await session.commit()
+
+        # Seeded with the call already recorded in service_call
+        assert await crud.check_user_access_and_update(session, user.id, model.id, n_calls=2) == (True, "Access granted")
+        assert await crud.check_user_access_and_update(session, user.id, model.id) == (False, "Daily API call limit exceeded")
+
+        daily_key, _ = quota.quota_keys(user.id, model.id)
+        assert int(fake_redis.get(daily_key)) == 3
+
+
+@pytest.mark.asyncio
+async def test_reconcile_quota_counters(db_session, fake_redis, monkeypatch):
+    monkeypatch.setattr(settings, "QUOTA_BACKEND", "redis")
+    async with db_session() as session:
+        user, model = await create_access(session)
+        for n_inputs in (1, 4):
+            session.add(ServiceCallFactory.build(user_id=user.id, model_id=model.id, n_inputs=n_inputs))
+        await session.commit()
+
+    # Sync Celery task, runs its own event loop
+    assert await asyncio.to_thread(reconcile_quota_counters) == 1
+
+    daily_key, monthly_key = quota.quota_keys(user.id, model.id)
+    assert int(fake_redis.get(daily_key)) == 5
+    assert int(fake_redis.get(monthly_key)) == 5
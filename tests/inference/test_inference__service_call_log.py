@@ -0,0 +1,160 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+from sqlalchemy import select
+from project.config import settings
+from project.inference import service_call_log
+from project.inference.models import ServiceCall, UserAccess
+from project.inference.service_call_log import ServiceCallWriter
+from tests.factories import AccessPolicyFactory, InferenceModelFactory, UserFactory, UserAccessFactory
+
+
+async def create_access(session):
+    policy = AccessPolicyFactory.build()
+    session.add(policy)
+    await session.commit()
+    model = InferenceModelFactory.build(access_policy_id=policy.id)
+    session.add(model)
+    user = UserFactory.build()
+    session.add(user)
+    await session.commit()
+    session.add(UserAccessFactory.build(user_id=user.id, model_id=model.id, access_policy_id=policy.id, api_calls=0))
+    await session.commit()
+    return user, model
+
+
+def pending(fake_redis):
+    return fake_redis.xpending(service_call_log.STREAM_KEY, service_call_log.CONSUMER_GROUP)["pending"]
+
+
+@pytest.mark.asyncio
+async def test_buffered_calls_are_written_in_bulk(db_session, fake_redis, monkeypatch):
+    monkeypatch.setattr(settings, "SERVICE_CALL_WRITE_MODE", "buffered")
+    writer = ServiceCallWriter(max_rows=10, interval_ms=50)
+    await writer.ensure_group()
+    async with db_session() as session:
+        user, model = await create_access(session)
+
+        task_ids = [str(uuid4()) for _ in range(3)]
+        for task_id in task_ids:
+            assert await service_call_log.record_service_call(session, model.id, user.id, celery_task_id=task_id) is None
+        await service_call_log.record_service_call(
+            session, model.id, user.id, time_completed=datetime.now(timezone.utc), n_inputs=2
+        )
+        service_call_log.record_completion(task_ids[0], datetime.now(timezone.utc))
+
+        # Nothing written until the writer flushes
+        assert (await session.scalars(select(ServiceCall))).all() == []
+
+        assert await writer.flush() == 5
+        assert pending(fake_redis) == 0
+
+        service_calls = (await session.scalars(select(ServiceCall))).all()
+        assert len(service_calls) == 4
+        completed = {service_call.celery_task_id for service_call in service_calls if service_call.time_completed}
+        assert completed == {task_ids[0], None}
+        user_access = await session.scalar(select(UserAccess).where(UserAccess.user_id == user.id))
+        assert user_access.api_calls == 5
+
+        # A completion arriving after its creation was written is an UPDATE
+        service_call_log.record_completion(task_ids[1], datetime.now(timezone.utc))
+        assert await writer.flush() == 1
+        service_call = await session.scalar(
+            select(ServiceCall).where(ServiceCall.celery_task_id == task_ids[1]).execution_options(populate_existing=True)
+        )
+        assert service_call.time_completed is not None
+
+
+@pytest.mark.asyncio
+async def test_redelivered_creations_are_not_inserted_twice(db_session, fake_redis, monkeypatch):
+    monkeypatch.setattr(settings, "SERVICE_CALL_WRITE_MODE", "buffered")
+    # A writer that committed but died before acknowledging
+    crashed = ServiceCallWriter(max_rows=10, interval_ms=50, consumer="crashed")
+    await crashed.ensure_group()
+    async with db_session() as session:
+        user, model = await create_access(session)
+        await service_call_log.record_service_call(session, model.id, user.id, celery_task_id=str(uuid4()))
+
+        entries = await crashed.read_batch()
+        await crashed.write(session, entries)
+        assert pending(fake_redis) == 1
+
+        writer = ServiceCallWriter(max_rows=10, interval_ms=50, claim_idle_ms=0)
+        assert await writer.flush() == 1
+        assert pending(fake_redis) == 0
+        assert len((await session.scalars(select(ServiceCall))).all()) == 1
+
+
+@pytest.mark.asyncio
+async def test_orphan_completion_stays_pending(db_session, fake_redis, monkeypatch):
+    monkeypatch.setattr(settings, "SERVICE_CALL_WRITE_MODE", "buffered")
+    writer = ServiceCallWriter(max_rows=10, interval_ms=50)
+    await writer.ensure_group()
+    service_call_log.record_completion(str(uuid4()), datetime.now(timezone.utc))
+
+    # Its creation may still be written by another writer
+    assert await writer.flush() == 0
+    assert pending(fake_redis) == 1
+
+    # Dropped once too old to ever match
+    monkeypatch.setattr(service_call_log, "ORPHAN_MAX_AGE", timedelta(0))
+    writer.claim_idle_ms = 0
+    assert await writer.flush() == 1
+    assert pending(fake_redis) == 0
+
+
+@pytest.mark.asyncio
+async def test_withdrawn_calls_are_not_counted(db_session, fake_redis, monkeypatch):
+    monkeypatch.setattr(settings, "SERVICE_CALL_WRITE_MODE", "buffered")
+    writer = ServiceCallWriter(max_rows=10, interval_ms=50)
+    await writer.ensure_group()
+    async with db_session() as session:
+        user, model = await create_access(session)
+        task_ids = [str(uuid4()) for _ in range(2)]
+        for task_id in task_ids:
+            await service_call_log.record_service_call(session, model.id, user.id, celery_task_id=task_id)
+
+        # Withdrawn before its creation is written: never inserted
+        await service_call_log.withdraw_service_call(session, task_ids[0])
+        assert await writer.flush() == 3
+
+        # Withdrawn once written: deleted and uncounted
+        await service_call_log.withdraw_service_call(session, task_ids[1])
+        assert await writer.flush() == 1
+        assert pending(fake_redis) == 0
+
+        assert (await session.scalars(select(ServiceCall))).all() == []
+        user_access = await session.scalar(
+            select(UserAccess).where(UserAccess.user_id == user.id).execution_options(populate_existing=True)
+        )
+        assert user_access.api_calls == 0
+
+
+@pytest.mark.asyncio
+async def test_rejected_event_does_not_block_its_batch(db_session, fake_redis, monkeypatch):
+    monkeypatch.setattr(settings, "SERVICE_CALL_WRITE_MODE", "buffered")
+    writer = ServiceCallWriter(max_rows=10, interval_ms=50, claim_idle_ms=0, max_deliveries=3)
+    await writer.ensure_group()
+    async with db_session() as session:
+        user, model = await create_access(session)
+        task_id = str(uuid4())
+        await service_call_log.record_service_call(session, model.id, user.id, celery_task_id=task_id)
+        # Published twice, e.g. by a retried request
+        await service_call_log.record_service_call(session, model.id, user.id, celery_task_id=task_id)
+        # Violates NOT NULL on model_id
+        await service_call_log.record_service_call(session, None, user.id, celery_task_id=str(uuid4()))
+
+        # The valid events are written, the rejected one stays pending
+        assert await writer.flush() == 2
+        assert pending(fake_redis) == 1
+        service_calls = (await session.scalars(select(ServiceCall))).all()
+        assert [service_call.celery_task_id for service_call in service_calls] == [task_id]
+
+        # Claimed again until its last delivery, then dead-lettered
+        assert await writer.flush() == 0
+        assert pending(fake_redis) == 1
+        await writer.flush()
+        assert pending(fake_redis) == 0
+        dead = fake_redis.xrange(service_call_log.DEAD_LETTER_STREAM_KEY)
+        assert len(dead) == 1
+        assert dead[0][1][b"type"] == b"created"
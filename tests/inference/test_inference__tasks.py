@@ -2,13 +2,16 @@ import pytest
 import asyncio
 from unittest.mock import MagicMock, patch, ANY
 from celery.result import AsyncResult
-from project.inference.tasks import run_model, task_success_handler
+from project.inference.tasks import completion_writer, run_model, run_model_batch, task_success_handler
+from project.inference.model_pool import model_pool
 from project.inference.models import ServiceCall
 from sqlalchemy import select
 from project.inference.model_registry import model_registry
 from datetime import datetime, timezone
+from uuid import uuid4
 from tests.factories import ServiceCallFactory
 from project.inference.crud import create_service_call
+from project.inference.cache import make_cache_key
 import logging
 logger = logging.getLogger(__name__)
 
@@ -57,20 +60,25 @@ async def test_run_model_not_found(db_session, setup_inference_objects):
         
         
 @pytest.mark.asyncio
-async def test_task_success_handler():
+async def test_task_success_handler(db_session, setup_inference_objects):
+    objects = await setup_inference_objects
+    async with db_session() as session:
+        service_call = await create_service_call(session, objects['model'].id, objects['user'].id, str(uuid4()))
+
     # Mock the sender and result
     mock_sender = MagicMock()
-    mock_sender.request.id = "mocked_task_id"
+    mock_sender.request.id = service_call.celery_task_id
     mock_result = {"result": "success"}
 
-    # Mock the update_service_call_time_completed function
-    with patch("project.inference.tasks.update_service_call_time_completed", new_callable=MagicMock) as mock_update:
-        # Call the success handler
-        task_success_handler(sender=mock_sender, result=mock_result)
+    # Timestamped in the handler, no result backend (Redis) round-trip
+    task_success_handler(sender=mock_sender, result=mock_result)
 
-        # Ensure the update_service_call_time_completed function was called with the correct arguments
-        await asyncio.sleep(0.1)  # Give the event loop a chance to run the task
-        mock_update.assert_called_once_with(ANY, "mocked_task_id", ANY)
+    # Written by the worker event loop thread
+    await asyncio.to_thread(completion_writer.flush, 5)
+
+    async with db_session() as session:
+        service_call = await session.get(ServiceCall, service_call.id)
+        assert service_call.time_completed is not None
         
         
 @pytest.mark.asyncio
@@ -100,6 +108,32 @@ async def test_run_model_cache_hit(db_session, setup_inference_objects):
         assert result == {"result": "cached_success"}
 
         # Ensure the cache was checked but not set
-        cache_key = f"model_{model_id}_result_{hash(frozenset(input_data.items()))}"
+        cache_key = make_cache_key(model_id, input_data)
         mock_redis_client.get.assert_called_once_with(cache_key)
-        mock_redis_client.set.assert_not_called()
\ No newline at end of file
+        mock_redis_client.set.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_run_model_batch(db_session, setup_inference_objects):
+    objects = await setup_inference_objects
+    model_id = objects['model'].id
+
+    result = run_model_batch(model_id, [{"param1": "value1"}, {"param1": "value2"}])
+
+    assert result == {"results": [{"result": "success"}, {"result": "success"}]}
+
+
+def test_run_model_batch_matches_single_predictions():
+    inputs = [
+        {"latitude": 40, "longitude": -74, "month": 6, "hour": 14},
+        {"latitude": -33, "longitude": 151, "month": 1, "hour": 3},
+    ]
+    model = model_pool.get(2)
+
+    result = run_model_batch(2, inputs)
+
+    expected = [model.predict(model.Input(**input_data)).dict() for input_data in inputs]
+    assert result["results"] == pytest.approx(expected)
+
+
+def test_run_model_batch_not_found():
+    assert run_model_batch(9999, [{"param1": "value1"}]) == {"error": "Model with id 9999 not found"}
@@ -1,15 +1,18 @@
 import pytest
+import json
 import logging
+import time
 from fastapi import Depends
 from fastapi.testclient import TestClient
 from uuid import uuid4
-from sqlalchemy import select
+from sqlalchemy import select, text
 from project.fu_core.users.models import User
 from tests.factories import UserFactory, InferenceModelFactory, AccessPolicyFactory, UserAccessFactory
 from project.inference import views
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock, MagicMock
 from project.inference.models import InferenceModel, ServiceCall
-from project.inference.ml_models.schemas import TemperatureModelInput
+from project.inference.schemas import TemperatureModelInput
+from project.inference.cache import make_cache_key
 
 @pytest.fixture
 def override_current_active_user():
@@ -45,7 +48,7 @@ def override_current_non_superuser():
 @pytest.fixture(autouse=True)
 async def clear_db(db_session):
     async with db_session() as session:
-        await session.execute("DELETE FROM user")
+        await session.execute(text("DELETE FROM user"))
         await session.commit()
 
 logger = logging.getLogger(__name__)
@@ -225,12 +228,6 @@ async def test_task_status(
     # Mock the model_registry with the correct model ID
     monkeypatch.setattr(views, "model_registry", {objects['model'].id: objects['model_registry_entry']})
 
-    # Mock the task ID to ensure consistency
-    mock_task_id = "mocked_task_id"
-    mock_task = MagicMock()
-    mock_task.task_id = mock_task_id
-    monkeypatch.setattr(views.tasks.run_model, "delay", lambda model_id: mock_task)
-
     # Create a task
     response = client.get(f"/api/v1/inference/predict/{objects['model'].id}")
     assert response.status_code == 200
@@ -239,10 +236,11 @@ async def test_task_status(
     # Log the task ID
     logger.info(f"Task ID: {task_id}")
 
-    # Ensure the task ID matches the mocked task ID
-    assert task_id == mock_task_id
+    # The task is enqueued under the id returned to the client
+    mock_run_model.assert_called_once_with((objects['model'].id,), task_id=task_id)
 
     # Mock the AsyncResult to return a successful state and result
+    mock_task = MagicMock()
     mock_task.state = "SUCCESS"
     mock_task.result = {"status": "completed"}
     monkeypatch.setattr(views, "AsyncResult", lambda task_id: mock_task)
@@ -255,7 +253,38 @@ async def test_task_status(
     logger.info(f"Response Content: {response.json()}")
 
     assert response.status_code == 200
-    
+    assert response.json() == {"state": "SUCCESS", "result": {"status": "completed"}}
+
+
+def test_task_status_wait(client, monkeypatch):
+    waits = []
+    async def wait(task_id, timeout):
+        waits.append(timeout)
+        return {"task_id": task_id, "state": "SUCCESS", "result": {"temperature": 21.5}}
+    monkeypatch.setattr(views.result_notifier, "wait", wait)
+    monkeypatch.setattr(views, "AsyncResult", MagicMock(side_effect=AssertionError("no backend read")))
+
+    response = client.get("/api/v1/inference/task_status/task-1?wait=600")
+
+    assert response.status_code == 200
+    assert response.json() == {"state": "SUCCESS", "result": {"temperature": 21.5}}
+    # Capped server-side
+    assert waits == [views.settings.TASK_STATUS_MAX_WAIT]
+
+
+def test_task_status_wait_timeout(client, monkeypatch):
+    async def wait(task_id, timeout):
+        return None
+    monkeypatch.setattr(views.result_notifier, "wait", wait)
+    mock_task = MagicMock(state="PENDING", result=None)
+    monkeypatch.setattr(views, "AsyncResult", lambda task_id: mock_task)
+
+    response = client.get("/api/v1/inference/task_status/task-1?wait=0.1")
+
+    assert response.status_code == 200
+    assert response.json() == {"state": "PENDING", "result": None}
+    assert client.get("/api/v1/inference/task_status/task-1?wait=-1").status_code == 422
+
 
 
 @pytest.mark.asyncio
@@ -386,6 +415,7 @@ async def test_predict_temperature_success(
     client: TestClient,
     db_session,
     mock_run_model,
+    mock_async_redis,
     monkeypatch,
     setup_inference_objects,
     override_current_active_user,
@@ -413,16 +443,19 @@ async def test_predict_temperature_success(
 
     assert response.status_code == 200
     assert "task_id" in response.json()
-    assert response.json()["task_id"] == "mocked_task_id"
+    task_id = response.json()["task_id"]
+    mock_run_model.assert_called_once_with(
+        (objects['model'].id, temperature_model_input.dict()), task_id=task_id
+    )
 
-    # Verify that a ServiceCall was created
+    # Verify that a ServiceCall was created with the task id already set
     async with db_session() as session:
         result = await session.execute(
             select(ServiceCall).where(ServiceCall.model_id == objects['model'].id)
         )
         service_call = result.scalar_one_or_none()
         assert service_call is not None
-        assert service_call.celery_task_id == "mocked_task_id"
+        assert service_call.celery_task_id == task_id
 
     # Clean up the dependency override
     client.app.dependency_overrides.clear()
@@ -492,4 +525,348 @@ async def test_predict_temperature_unauthorized(
     assert "access" in response.json()["detail"].lower()
 
     # Clean up the dependency override
-    client.app.dependency_overrides.clear()
\ No newline at end of file
+    client.app.dependency_overrides.clear()
+
+
+@pytest.mark.asyncio
+async def test_predict_temperature_cache_hit(
+    client: TestClient,
+    db_session,
+    mock_async_redis,
+    monkeypatch,
+    setup_inference_objects,
+    override_current_active_user,
+    temperature_model_input
+):
+    objects = await setup_inference_objects
+    model_id = objects['model'].id
+    client.app.dependency_overrides[views.current_active_user] = override_current_active_user(objects['user'])
+    monkeypatch.setattr(views, "model_registry", {model_id: objects['model_registry_entry']})
+
+    # A cached result means no task is enqueued
+    mock_async_redis.get.return_value = b'{"temperature": 21.5}'
+    mock_apply_async = MagicMock()
+    monkeypatch.setattr(views.tasks.run_model, "apply_async", mock_apply_async)
+
+    response = client.post(f"/api/v1/inference/predict-temp/{model_id}", json=temperature_model_input.dict())
+
+    assert response.status_code == 200
+    assert response.json() == {"task_id": None, "state": "SUCCESS", "result": {"temperature": 21.5}}
+    mock_apply_async.assert_not_called()
+    mock_async_redis.get.assert_awaited_once_with(make_cache_key(model_id, temperature_model_input))
+
+    # The call is still recorded for quota purposes
+    async with db_session() as session:
+        result = await session.execute(select(ServiceCall).where(ServiceCall.model_id == model_id))
+        service_call = result.scalar_one_or_none()
+        assert service_call is not None
+        assert service_call.celery_task_id is None
+        assert service_call.time_completed is not None
+
+    client.app.dependency_overrides.clear()
+
+
+@pytest.mark.asyncio
+async def test_predict_temperature_cache_hit_refreshes_hot_key(
+    client: TestClient,
+    mock_async_redis,
+    monkeypatch,
+    setup_inference_objects,
+    override_current_active_user,
+    temperature_model_input
+):
+    objects = await setup_inference_objects
+    model_id = objects['model'].id
+    client.app.dependency_overrides[views.current_active_user] = override_current_active_user(objects['user'])
+    monkeypatch.setattr(views, "model_registry", {model_id: objects['model_registry_entry']})
+
+    # Entry about to expire: served, and recomputed in the background
+    entry = {"value": {"temperature": 21.5}, "delta": 1.0, "expires_at": time.time() - 1}
+    mock_async_redis.get.return_value = json.dumps(entry).encode()
+    mock_refresh = MagicMock()
+    monkeypatch.setattr(views.tasks.refresh_cached_result, "delay", mock_refresh)
+
+    response = client.post(f"/api/v1/inference/predict-temp/{model_id}", json=temperature_model_input.dict())
+
+    assert response.json()["result"] == {"temperature": 21.5}
+    mock_refresh.assert_called_once_with(model_id, temperature_model_input.model_dump(mode="json"))
+
+    client.app.dependency_overrides.clear()
+
+
+@pytest.mark.asyncio
+async def test_predict_temperature_cache_hit_unauthorized(
+    client: TestClient,
+    db_session,
+    mock_async_redis,
+    monkeypatch,
+    setup_inference_objects,
+    override_unauthorized_user,
+    temperature_model_input
+):
+    objects = await setup_inference_objects
+    model_id = objects['model'].id
+    client.app.dependency_overrides[views.current_active_user] = override_unauthorized_user
+    monkeypatch.setattr(views, "model_registry", {model_id: objects['model_registry_entry']})
+
+    # Entry about to expire: a user without access must not get it recomputed
+    entry = {"value": {"temperature": 21.5}, "delta": 1.0, "expires_at": time.time() - 1}
+    mock_async_redis.get.return_value = json.dumps(entry).encode()
+    mock_refresh = MagicMock()
+    monkeypatch.setattr(views.tasks.refresh_cached_result, "delay", mock_refresh)
+
+    response = client.post(f"/api/v1/inference/predict-temp/{model_id}", json=temperature_model_input.dict())
+
+    assert response.status_code == 403
+    mock_async_redis.get.assert_not_awaited()
+    mock_refresh.assert_not_called()
+
+    client.app.dependency_overrides.clear()
+
+
+@pytest.mark.asyncio
+async def test_predict_sync_inline(
+    client: TestClient,
+    db_session,
+    monkeypatch,
+    setup_inference_objects,
+    override_current_active_user
+):
+    objects = await setup_inference_objects
+    model_id = objects['model'].id
+    client.app.dependency_overrides[views.current_active_user] = override_current_active_user(objects['user'])
+    monkeypatch.setitem(objects['model_registry_entry'], "inline", True)
+    monkeypatch.setattr(views, "model_registry", {model_id: objects['model_registry_entry']})
+    mock_apply_async = MagicMock()
+    monkeypatch.setattr(views.tasks.run_model, "apply_async", mock_apply_async)
+
+    response = client.post(f"/api/v1/inference/predict-sync/{model_id}", json={"param1": "value1"})
+
+    assert response.status_code == 200
+    assert response.json() == {"task_id": None, "state": "SUCCESS", "result": {"result": "success"}}
+    mock_apply_async.assert_not_called()
+
+    async with db_session() as session:
+        result = await session.execute(select(ServiceCall).where(ServiceCall.model_id == model_id))
+        service_call = result.scalar_one_or_none()
+        assert service_call is not None
+        assert service_call.time_completed is not None
+
+    client.app.dependency_overrides.clear()
+
+
+@pytest.mark.asyncio
+async def test_predict_sync_falls_back_to_celery_when_saturated(
+    client: TestClient,
+    db_session,
+    mock_run_model,
+    monkeypatch,
+    setup_inference_objects,
+    override_current_active_user
+):
+    objects = await setup_inference_objects
+    model_id = objects['model'].id
+    client.app.dependency_overrides[views.current_active_user] = override_current_active_user(objects['user'])
+    monkeypatch.setitem(objects['model_registry_entry'], "inline", True)
+    monkeypatch.setattr(views, "model_registry", {model_id: objects['model_registry_entry']})
+    monkeypatch.setattr(views.inline_runner, "_in_flight", views.inline_runner.max_concurrency)
+
+    response = client.post(f"/api/v1/inference/predict-sync/{model_id}", json={"param1": "value1"})
+
+    assert response.status_code == 200
+    task_id = response.json()["task_id"]
+    assert response.json() == {"task_id": task_id, "state": "PENDING"}
+    mock_run_model.assert_called_once_with((model_id, {"param1": "value1"}), task_id=task_id)
+
+    client.app.dependency_overrides.clear()
+
+
+@pytest.mark.asyncio
+async def test_predict_sync_not_inline_uses_celery(
+    client: TestClient,
+    db_session,
+    mock_run_model,
+    monkeypatch,
+    setup_inference_objects,
+    override_current_active_user
+):
+    objects = await setup_inference_objects
+    model_id = objects['model'].id
+    client.app.dependency_overrides[views.current_active_user] = override_current_active_user(objects['user'])
+    monkeypatch.setattr(views, "model_registry", {model_id: objects['model_registry_entry']})
+
+    response = client.post(f"/api/v1/inference/predict-sync/{model_id}", json={"param1": "value1"})
+
+    assert response.status_code == 200
+    assert response.json()["task_id"] == mock_run_model.call_args.kwargs["task_id"]
+
+    client.app.dependency_overrides.clear()
+
+
+@pytest.mark.asyncio
+async def test_predict_sync_invalid_input(
+    client: TestClient,
+    db_session,
+    monkeypatch,
+    setup_inference_objects,
+    override_current_active_user
+):
+    objects = await setup_inference_objects
+    model_id = objects['model'].id
+    client.app.dependency_overrides[views.current_active_user] = override_current_active_user(objects['user'])
+    # The temperature model, not inline: the input would otherwise only fail in the task
+    monkeypatch.setitem(objects['model_registry_entry'], "func", views.model_registry[2]["func"])
+    monkeypatch.setattr(views, "model_registry", {model_id: objects['model_registry_entry']})
+    mock_check_user_access = MagicMock()
+    monkeypatch.setattr(views.crud, "check_user_access", mock_check_user_access)
+    mock_apply_async = MagicMock()
+    monkeypatch.setattr(views.tasks.run_model, "apply_async", mock_apply_async)
+
+    input_data = {"latitude": 45, "longitude": 5, "month": "june", "hour": 12}
+    response = client.post(f"/api/v1/inference/predict-sync/{model_id}", json=input_data)
+
+    assert response.status_code == 422
+    assert [error["loc"] for error in response.json()["detail"]] == [["body", "month"]]
+    mock_check_user_access.assert_not_called()
+    mock_apply_async.assert_not_called()
+
+    client.app.dependency_overrides.clear()
+
+
+@pytest.mark.asyncio
+async def test_predict_sync_inline_failure_refunds_the_quota(
+    client: TestClient,
+    db_session,
+    monkeypatch,
+    setup_inference_objects,
+    override_current_active_user
+):
+    objects = await setup_inference_objects
+    model_id, user = objects['model'].id, objects['user']
+    client.app.dependency_overrides[views.current_active_user] = override_current_active_user(user)
+    monkeypatch.setitem(objects['model_registry_entry'], "inline", True)
+    monkeypatch.setattr(views, "model_registry", {model_id: objects['model_registry_entry']})
+    monkeypatch.setattr(views.inline_runner, "run", AsyncMock(side_effect=RuntimeError("model crashed")))
+    mock_refund = AsyncMock()
+    monkeypatch.setattr(views.crud, "refund_user_access", mock_refund)
+
+    with pytest.raises(RuntimeError):
+        client.post(f"/api/v1/inference/predict-sync/{model_id}", json={"param1": "value1"})
+
+    mock_refund.assert_awaited_once_with(user.id, model_id)
+    async with db_session() as session:
+        result = await session.execute(select(ServiceCall).where(ServiceCall.model_id == model_id))
+        assert result.scalar_one_or_none() is None
+
+    client.app.dependency_overrides.clear()
+
+
+@pytest.mark.asyncio
+async def test_predict_batch(
+    client: TestClient,
+    db_session,
+    monkeypatch,
+    setup_inference_objects,
+    override_current_active_user
+):
+    objects = await setup_inference_objects
+    model_id = objects['model'].id
+    client.app.dependency_overrides[views.current_active_user] = override_current_active_user(objects['user'])
+    monkeypatch.setattr(views, "model_registry", {model_id: objects['model_registry_entry']})
+    mock_apply_async = MagicMock()
+    monkeypatch.setattr(views.tasks.run_model_batch, "apply_async", mock_apply_async)
+
+    inputs = [{"param1": f"value{i}"} for i in range(3)]
+    response = client.post(f"/api/v1/inference/predict-batch/{model_id}", json={"inputs": inputs})
+
+    assert response.status_code == 200
+    task_id = response.json()["task_id"]
+    assert response.json() == {"task_id": task_id, "n_inputs": 3}
+    mock_apply_async.assert_called_once_with((model_id, inputs), task_id=task_id)
+
+    # One service call for the whole batch
+    async with db_session() as session:
+        result = await session.execute(select(ServiceCall).where(ServiceCall.model_id == model_id))
+        service_call = result.scalar_one_or_none()
+        assert service_call is not None
+        assert service_call.n_inputs == 3
+        assert service_call.celery_task_id == task_id
+
+    client.app.dependency_overrides.clear()
+
+
+@pytest.mark.asyncio
+async def test_predict_batch_empty(
+    client: TestClient,
+    db_session,
+    setup_inference_objects,
+    override_current_active_user
+):
+    objects = await setup_inference_objects
+    client.app.dependency_overrides[views.current_active_user] = override_current_active_user(objects['user'])
+
+    response = client.post(f"/api/v1/inference/predict-batch/{objects['model'].id}", json={"inputs": []})
+
+    assert response.status_code == 422
+
+    client.app.dependency_overrides.clear()
+
+
+@pytest.mark.asyncio
+async def test_predict_batch_invalid_row(
+    client: TestClient,
+    db_session,
+    monkeypatch,
+    setup_inference_objects,
+    override_current_active_user
+):
+    objects = await setup_inference_objects
+    model_id = objects['model'].id
+    client.app.dependency_overrides[views.current_active_user] = override_current_active_user(objects['user'])
+    # The temperature model, whose input schema validates
+    monkeypatch.setitem(objects['model_registry_entry'], "func", views.model_registry[2]["func"])
+    monkeypatch.setattr(views, "model_registry", {model_id: objects['model_registry_entry']})
+    mock_check_user_access = MagicMock()
+    monkeypatch.setattr(views.crud, "check_user_access", mock_check_user_access)
+    mock_apply_async = MagicMock()
+    monkeypatch.setattr(views.tasks.run_model_batch, "apply_async", mock_apply_async)
+
+    valid = {"latitude": 45, "longitude": 5, "month": 6, "hour": 12}
+    inputs = [valid, dict(valid, month="june")]
+    response = client.post(f"/api/v1/inference/predict-batch/{model_id}", json={"inputs": inputs})
+
+    # Rejected before the quota is charged for the batch
+    assert response.status_code == 422
+    assert [error["loc"] for error in response.json()["detail"]] == [["body", "inputs", 1, "month"]]
+    mock_check_user_access.assert_not_called()
+    mock_apply_async.assert_not_called()
+
+    client.app.dependency_overrides.clear()
+
+
+@pytest.mark.asyncio
+async def test_predict_refunds_the_quota_when_the_broker_is_down(
+    client: TestClient,
+    db_session,
+    monkeypatch,
+    setup_inference_objects,
+    override_current_active_user
+):
+    objects = await setup_inference_objects
+    model_id, user = objects['model'].id, objects['user']
+    client.app.dependency_overrides[views.current_active_user] = override_current_active_user(user)
+    monkeypatch.setattr(views, "model_registry", {model_id: objects['model_registry_entry']})
+    mock_refund = AsyncMock()
+    monkeypatch.setattr(views.crud, "refund_user_access", mock_refund)
+    monkeypatch.setattr(views.tasks.run_model, "apply_async", MagicMock(side_effect=ConnectionError("broker down")))
+
+    with pytest.raises(ConnectionError):
+        client.get(f"/api/v1/inference/predict/{model_id}")
+
+    # Neither counted by the quota nor recorded in the database
+    mock_refund.assert_awaited_once_with(user.id, model_id, 1)
+    async with db_session() as session:
+        result = await session.execute(select(ServiceCall).where(ServiceCall.model_id == model_id))
+        assert result.scalar_one_or_none() is None
+
+    client.app.dependency_overrides.clear()
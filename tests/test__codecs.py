@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from kombu.serialization import dumps as kombu_dumps, loads as kombu_loads
+
+from project import codecs
+from project.codecs import Codec, CodecError
+
+PAYLOAD = {"model_id": 1, "results": [{"temperature": 21.5}] * 2000}
+
+
+@pytest.mark.parametrize("serializer", ["json", "orjson"])
+def test_uncompressed_json_is_written_without_header(serializer):
+    data = Codec(serializer).dumps({"temperature": 21.5})
+
+    assert data == b'{"temperature": 21.5}' or data == b'{"temperature":21.5}'
+    assert codecs.loads(data) == {"temperature": 21.5}
+
+
+@pytest.mark.parametrize("serializer", ["json", "orjson"])
+def test_compression_above_threshold(serializer):
+    codec = Codec(serializer, "zlib", compress_min_bytes=1024)
+
+    small = codec.dumps({"temperature": 21.5})
+    large = codec.dumps(PAYLOAD)
+
+    assert not small.startswith(codecs.MAGIC)
+    assert large.startswith(codecs.MAGIC)
+    assert len(large) < len(Codec(serializer).dumps(PAYLOAD)) / 10
+    # Decoded whatever the codec reading it
+    assert Codec("json").loads(large) == PAYLOAD
+
+
+def test_numpy_arrays_are_encoded_as_lists_in_json():
+    array = np.arange(6, dtype=np.float32).reshape(2, 3)
+
+    for serializer in ("json", "orjson"):
+        assert codecs.loads(Codec(serializer).dumps({"scores": array, "n": np.int64(2)})) == {
+            "scores": [[0.0, 1.0, 2.0], [3.0, 4.0, 5.0]],
+            "n": 2,
+        }
+
+
+def test_msgpack_round_trips_numpy_arrays():
+    array = np.random.rand(100, 3)
+
+    decoded = codecs.loads(Codec("msgpack", "zlib", compress_min_bytes=0).dumps({"scores": array}))
+
+    np.testing.assert_array_equal(decoded["scores"], array)
+    assert decoded["scores"].dtype == array.dtype
+
+
+@pytest.mark.parametrize("serializer", ["json", "orjson", "msgpack"])
+def test_zstd_round_trip(serializer):
+    data = Codec(serializer, "zstd", compress_min_bytes=1024).dumps(PAYLOAD)
+
+    assert codecs.parse_header(data)[1] == codecs.COMPRESSIONS["zstd"]
+    assert codecs.loads(data) == PAYLOAD
+
+
+def test_unknown_or_missing_codec(monkeypatch):
+    with pytest.raises(CodecError):
+        Codec("pickle")
+    monkeypatch.setattr(codecs, "zstandard", None)
+    with pytest.raises(CodecError, match="pip install zstandard"):
+        Codec("json", "zstd")
+
+
+def test_celery_serializer():
+    codecs.register_celery_serializer(Codec("orjson", "zlib", compress_min_bytes=0))
+
+    content_type, content_encoding, body = kombu_dumps(PAYLOAD, serializer=codecs.CELERY_SERIALIZER)
+
+    assert content_type == codecs.CELERY_CONTENT_TYPE
+    assert kombu_loads(body, content_type, content_encoding, accept={codecs.CELERY_CONTENT_TYPE}) == PAYLOAD
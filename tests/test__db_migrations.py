@@ -10,4 +10,24 @@ async def test_database_tables_exist(db_session):
         tables = ['user', 'access_policy', 'inference_model', 'user_access', 'service_call']
         for table in tables:
             result = await session.execute(text(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table}'"))
-            assert result.scalar() is not None, f"Table {table} does not exist"
\ No newline at end of file
+            assert result.scalar() is not None, f"Table {table} does not exist"
+
+
+@pytest.mark.asyncio
+async def test_service_call_quota_index_exists(db_session):
+    async with db_session() as session:
+        result = await session.execute(text(
+            "SELECT name FROM sqlite_master WHERE type='index' AND name='ix_service_call_user_model_time'"
+        ))
+        assert result.scalar() is not None, "Index ix_service_call_user_model_time does not exist"
+
+
+@pytest.mark.asyncio
+async def test_service_call_task_id_index_exists(db_session):
+    async with db_session() as session:
+        result = await session.execute(text(
+            "SELECT sql FROM sqlite_master WHERE type='index' AND name='ix_service_call_celery_task_id'"
+        ))
+        index_sql = result.scalar()
+        assert index_sql is not None, "Index ix_service_call_celery_task_id does not exist"
+        assert index_sql.startswith("CREATE UNIQUE INDEX"), "Index ix_service_call_celery_task_id is not unique"
@@ -0,0 +1,41 @@
+import time
+
+from project.local_cache import Invalidator, LocalCache
+
+
+def test_local_cache_evicts_least_recently_used():
+    local_cache = LocalCache(max_entries=2, ttl=60)
+    local_cache.set("a", 1)
+    local_cache.set("b", 2)
+    local_cache.get("a")
+    local_cache.set("c", 3)
+
+    assert local_cache.get("a") == 1
+    assert local_cache.get("b") is None
+    assert local_cache.get("c") == 3
+
+
+def test_local_cache_ttl_is_capped():
+    local_cache = LocalCache(max_entries=10, ttl=0.05)
+    local_cache.set("a", 1, ttl=3600)
+
+    time.sleep(0.1)
+    assert local_cache.get("a") is None
+    assert len(local_cache) == 0
+
+
+def test_invalidations_reach_other_processes(fake_redis):
+    local_cache = LocalCache(max_entries=10, ttl=60)
+    local_cache.set("inference:model:1", 1)
+    invalidator = Invalidator()
+    invalidator.register("invalidate", local_cache.delete_prefix)
+    invalidator.start()
+    try:
+        Invalidator().publish("invalidate", "inference:model:")
+        deadline = time.monotonic() + 2
+        while local_cache.get("inference:model:1") is not None and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        invalidator.stop()
+
+    assert local_cache.get("inference:model:1") is None
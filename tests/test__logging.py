@@ -0,0 +1,69 @@
+import json
+import logging
+
+import pytest
+
+from project import celery_utils, tracing
+from project.config import settings
+from project.logging import JsonFormatter, TraceContextFilter, configure_logging
+
+
+class DiscardExporter:
+    def export(self, spans):
+        pass
+
+
+@pytest.fixture
+def reconfigure(monkeypatch):
+    """Configure logging with other settings, then back to the test ones."""
+    def _reconfigure(**overrides):
+        for name, value in overrides.items():
+            monkeypatch.setattr(settings, name, value)
+        configure_logging()
+    yield _reconfigure
+    monkeypatch.undo()
+    configure_logging()
+
+
+def test_json_records_carry_extra_fields_and_trace():
+    tracing.configure(DiscardExporter())
+    try:
+        with tracing.span("request") as span:
+            record = logging.LogRecord("project.tasks", logging.INFO, __file__, 1, "Completed %s", ("run_model",), None)
+            record.task_id = "abc"
+            TraceContextFilter().filter(record)
+    finally:
+        tracing.configure(None)
+
+    data = json.loads(JsonFormatter().format(record))
+
+    assert data["message"] == "Completed run_model"
+    assert data["level"] == "INFO"
+    assert data["task_id"] == "abc"
+    assert data["trace_id"] == span.trace_id
+    assert data["request_id"] == span.request_id
+
+
+def test_queued_records_are_written_by_the_listener(reconfigure, capsys):
+    reconfigure(LOG_QUEUE=True, LOG_FORMAT="json")
+    logging.getLogger("project.tests").info("queued", extra={"model_id": 1})
+    # Stopping the listener writes the records still queued
+    reconfigure(LOG_QUEUE=False)
+
+    records = [json.loads(line) for line in capsys.readouterr().err.splitlines() if line.startswith("{")]
+    assert {"message": "queued", "model_id": 1}.items() <= records[-1].items()
+
+
+def test_preview_cuts_large_payloads():
+    result = {"results": [{"value": index} for index in range(10000)]}
+
+    text = celery_utils.preview(result, max_length=100)
+
+    assert len(text) < 150
+    assert text.startswith("{'results': [{'value': 0}")
+    assert celery_utils.preview({"value": 1}) == "{'value': 1}"
+
+
+def test_sampled():
+    assert celery_utils.sampled(1.0)
+    assert not celery_utils.sampled(0.0)
@@ -0,0 +1,60 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from project import metrics
+
+
+def stage_count(stage, model_id):
+    value = metrics.REGISTRY.get_sample_value(
+        "inference_stage_seconds_count", {"stage": stage, "model_id": model_id}
+    )
+    return value or 0
+
+
+def test_timed_labels_with_model_id():
+    @metrics.timed("test_sync")
+    def sync_stage(model_id, data):
+        return data
+
+    before = stage_count("test_sync", "7")
+    assert sync_stage(7, data="x") == "x"
+    assert stage_count("test_sync", "7") == before + 1
+
+
+@pytest.mark.asyncio
+async def test_timed_async_without_model_id():
+    @metrics.timed("test_async")
+    async def async_stage(data):
+        return data
+
+    before = stage_count("test_async", "")
+    assert await async_stage("x") == "x"
+    assert stage_count("test_async", "") == before + 1
+
+
+def test_queue_wait_and_result_backend_write():
+    queue_wait = stage_count("queue_wait", "3")
+    backend_write = stage_count("result_backend_write", "3")
+
+    headers = {}
+    metrics.stamp_published_at(headers)
+    request = SimpleNamespace(returned_at=time.perf_counter(), **headers)
+    metrics.observe_queue_wait(request, 3)
+    metrics.observe_result_backend_write(request, 3)
+    # Requests of tasks published or run without the hooks are skipped
+    metrics.observe_queue_wait(SimpleNamespace(), 3)
+    metrics.observe_result_backend_write(SimpleNamespace(), 3)
+
+    assert stage_count("queue_wait", "3") == queue_wait + 1
+    assert stage_count("result_backend_write", "3") == backend_write + 1
+
+
+def test_metrics_endpoint(client):
+    client.get("/api/v1/users/me")
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert "inference_stage_seconds" in response.text
+    assert 'route="/api/v1/users/me"' in response.text
@@ -0,0 +1,27 @@
+import pytest
+from project import redis_utils
+
+
+@pytest.mark.asyncio
+async def test_amset_amget_cache(fake_redis):
+    await redis_utils.amset_cache({"key:1": {"value": 1}, "key:2": {"value": 2}}, expiration=60)
+
+    assert await redis_utils.amget_cache(["key:1", "missing", "key:2"]) == [{"value": 1}, None, {"value": 2}]
+    assert 0 < fake_redis.ttl("key:1") <= 60
+    assert await redis_utils.amget_cache([]) == []
+
+
+@pytest.mark.asyncio
+async def test_aset_cache_is_read_by_the_sync_client(fake_redis):
+    await redis_utils.aset_cache("key:3", {"value": 3})
+
+    # Same encoding as the worker cache
+    assert redis_utils.get_cache("key:3") == {"value": 3}
+
+
+def test_async_client_uses_a_bounded_pool():
+    client = redis_utils.create_async_redis_client()
+
+    pool = client.connection_pool
+    assert pool.max_connections == redis_utils.settings.REDIS_MAX_CONNECTIONS
+    assert pool.connection_kwargs["health_check_interval"] == redis_utils.settings.REDIS_HEALTH_CHECK_INTERVAL
@@ -0,0 +1,156 @@
+import json
+from types import SimpleNamespace
+from uuid import uuid4
+
+import fakeredis
+import pytest
+
+from project import redis_utils, tracing
+from project.fu_core.security import get_jwt_strategy
+from project.inference import tasks
+
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+
+@pytest.fixture
+def exported():
+    exporter = ListExporter()
+    tracing.configure(exporter)
+    yield exporter.spans
+    tracing.configure(None)
+
+
+def by_name(spans):
+    tracing.flush()
+    return {span.name: span for span in spans}
+
+
+def test_spans_nest_in_one_trace(exported):
+    with tracing.span("request") as request:
+        with tracing.span("child", model_id=1):
+            pass
+    with pytest.raises(ValueError):
+        with tracing.span("failing"):
+            raise ValueError("boom")
+
+    spans = by_name(exported)
+    assert spans["child"].trace_id == request.trace_id
+    assert spans["child"].parent_id == request.span_id
+    assert spans["child"].attributes == {"model_id": 1}
+    assert spans["failing"].trace_id != request.trace_id
+    assert spans["failing"].error == "ValueError: boom"
+    assert tracing.current_span() is None
+
+
+@pytest.mark.asyncio
+async def test_traced_async_function(exported):
+    @tracing.traced()
+    async def get_row(session):
+        return tracing.current_span().name
+
+    assert await get_row(None) == "test__tracing.test_traced_async_function.<locals>.get_row"
+    assert len(by_name(exported)) == 1
+
+
+def test_disabled_tracing_records_nothing():
+    with tracing.span("request") as span:
+        headers = {}
+        tracing.inject(headers)
+    assert span is None
+    assert headers == {}
+
+
+def test_task_continues_the_trace_of_its_publisher(exported):
+    headers = {}
+    with tracing.span("POST /predict") as request:
+        tasks.inject_trace_context(headers=headers)
+
+    # Celery exposes the message headers as attributes of the task request
+    task = SimpleNamespace(name="run_model", request=SimpleNamespace(**headers))
+    tasks.start_task_span(task_id="abc", task=task)
+    with tracing.span("predict"):
+        pass
+    tasks.end_task_span(task=task, retval={"result": 1}, state="SUCCESS")
+
+    spans = by_name(exported)
+    assert spans["run_model"].trace_id == request.trace_id
+    assert spans["run_model"].parent_id == request.span_id
+    assert spans["run_model"].request_id == request.request_id
+    assert spans["run_model"].attributes == {"task_id": "abc", "state": "SUCCESS"}
+    assert spans["predict"].parent_id == spans["run_model"].span_id
+
+
+def test_unsampled_traces_are_not_exported(exported):
+    traceparent = f"00-{'a' * 32}-{'b' * 16}-00"
+    trace = tracing.start_span("run_model", traceparent=traceparent)
+    with tracing.span("predict"):
+        pass
+    tracing.end_span(trace)
+
+    assert by_name(exported) == {}
+
+
+@pytest.mark.asyncio
+async def test_request_span_and_request_id(client, exported):
+    traceparent = f"00-{'a' * 32}-{'b' * 16}-01"
+    # Token of a user who does not exist
+    token = await get_jwt_strategy().write_token(SimpleNamespace(id=uuid4()))
+    response = client.get(
+        "/api/v1/users/me",
+        headers={"traceparent": traceparent, "X-Request-ID": "req-1", "Authorization": f"Bearer {token}"},
+    )
+
+    assert response.headers["X-Request-ID"] == "req-1"
+    spans = by_name(exported)
+    request = spans["GET /api/v1/users/me"]
+    assert request.trace_id == "a" * 32
+    assert request.parent_id == "b" * 16
+    assert request.attributes == {"http.status_code": 401}
+    assert spans["auth"].parent_id == request.span_id
+
+
+def test_redis_commands_are_traced(exported):
+    client = redis_utils.TracedRedis(connection_pool=fakeredis.FakeRedis().connection_pool)
+    with tracing.span("task") as task:
+        client.set("key", "value")
+        pipeline = client.pipeline(transaction=False)
+        pipeline.get("key")
+        pipeline.get("other")
+        assert pipeline.execute() == [b"value", None]
+
+    spans = by_name(exported)
+    assert spans["redis SET"].parent_id == task.span_id
+    assert spans["redis PIPELINE"].attributes == {"commands": 2}
+
+
+def test_json_file_exporter(tmp_path, exported):
+    path = tmp_path / "traces.jsonl"
+    with tracing.span("request", model_id=1) as span:
+        pass
+    span.end_ns = span.start_ns + 2_000_000
+    tracing.JsonFileExporter(str(path)).export([span])
+
+    record = json.loads(path.read_text())
+    assert record["trace_id"] == span.trace_id
+    assert record["duration_ms"] == 2.0
+    assert record["attributes"] == {"model_id": 1}
+
+
+def test_otlp_payload(exported):
+    with tracing.span("request"):
+        with tracing.span("child", model_id=1):
+            pass
+    spans = by_name(exported)
+
+    payload = tracing.OtlpHttpExporter("http://collector:4318", "api").payload(list(spans.values()))
+
+    otlp_spans = {span["name"]: span for span in payload["resourceSpans"][0]["scopeSpans"][0]["spans"]}
+    assert otlp_spans["child"]["parentSpanId"] == otlp_spans["request"]["spanId"]
+    assert "parentSpanId" not in otlp_spans["request"]
+    assert {"key": "model_id", "value": {"intValue": "1"}} in otlp_spans["child"]["attributes"]